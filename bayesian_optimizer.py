@@ -0,0 +1,219 @@
+import math
+
+import numpy as np
+
+from parameter_optimizer import bounds_from_settings, clip_setpoint
+
+_erf = np.vectorize(math.erf, otypes=[float])
+
+
+def _normal_cdf(z):
+    return 0.5 * (1 + _erf(z / math.sqrt(2)))
+
+
+def _normal_pdf(z):
+    return np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+
+
+class IncrementalGaussianProcess:
+    # gaussian process with a squared exponential kernel on unit-scaled inputs
+    # the inverse of the Cholesky factor grows by one row per observation (O(n^2)) instead of
+    # refactoring the whole kernel matrix (O(n^3)), the kernel hyperparameters stay fixed for that reason
+    def __init__(self, dimensions, length_scales=0.25, noise_ratio=0.05):
+        self.dimensions = dimensions
+        self.length_scales = np.array(np.broadcast_to(np.asarray(length_scales, dtype=float), (dimensions,)))
+        # noise variance relative to the (unit) signal variance
+        self.noise_ratio = noise_ratio
+
+        self.X = np.empty((0, dimensions))
+        self.y = np.empty(0)
+        # inverse of the lower Cholesky factor of K + noise I
+        self.inverse_cholesky = np.empty((0, 0))
+        self.alpha = np.empty(0)
+        self.y_mean = 0.0
+        self.y_scale = 1.0
+
+    def __len__(self):
+        return len(self.y)
+
+    def kernel(self, A, B):
+        scaled_A = A / self.length_scales
+        scaled_B = B / self.length_scales
+        squared_distance = (scaled_A ** 2).sum(1)[:, None] + (scaled_B ** 2).sum(1)[None, :] - 2 * scaled_A @ scaled_B.T
+        return np.exp(-0.5 * np.maximum(squared_distance, 0))
+
+    # rank-one extension of the factor: L_new = [[L, 0], [l, d]] so L_new^-1 = [[L^-1, 0], [-l L^-1 / d, 1 / d]]
+    def add(self, x, y):
+        x = np.asarray(x, dtype=float).reshape(1, self.dimensions)
+        k = self.kernel(self.X, x)[:, 0]
+        l = self.inverse_cholesky @ k
+        d = math.sqrt(max(1 + self.noise_ratio - l @ l, 1e-12))
+
+        n = len(self.y)
+        inverse_cholesky = np.zeros((n + 1, n + 1))
+        inverse_cholesky[:n, :n] = self.inverse_cholesky
+        inverse_cholesky[n, :n] = -(l @ self.inverse_cholesky) / d
+        inverse_cholesky[n, n] = 1 / d
+        self.inverse_cholesky = inverse_cholesky
+
+        self.X = np.vstack([self.X, x])
+        self.y = np.append(self.y, y)
+        self._update_weights()
+
+    # the counts are standardized, which changes the weights but not the factor (O(n^2))
+    def _update_weights(self):
+        self.y_mean = self.y.mean()
+        self.y_scale = self.y.std() if len(self.y) > 1 and self.y.std() > 0 else max(abs(self.y_mean), 1.0)
+        standardized = (self.y - self.y_mean) / self.y_scale
+        self.alpha = self.inverse_cholesky.T @ (self.inverse_cholesky @ standardized)
+
+    # posterior mean and variance at the points X_new, plus the projections needed for batch proposals
+    def predict(self, X_new, return_projection=False):
+        X_new = np.atleast_2d(X_new)
+        if len(self.y) == 0:
+            mean = np.full(len(X_new), self.y_mean)
+            variance = np.full(len(X_new), self.y_scale ** 2)
+            projection = np.empty((0, len(X_new)))
+        else:
+            cross_kernel = self.kernel(self.X, X_new)
+            projection = self.inverse_cholesky @ cross_kernel
+            mean = self.y_mean + self.y_scale * (cross_kernel.T @ self.alpha)
+            variance = self.y_scale ** 2 * np.maximum(1 - (projection ** 2).sum(0), 1e-12)
+        if return_projection:
+            return mean, variance, projection
+        return mean, variance
+
+    # posterior mean at the measured points: K (K + noise I)^-1 y = y - noise alpha, no kernel is evaluated (O(n))
+    def fitted_mean(self):
+        return self.y - self.y_scale * self.noise_ratio * self.alpha
+
+    # gradient of the posterior mean (in unit-scaled inputs) at a single point
+    def mean_gradient(self, x):
+        if len(self.y) == 0:
+            return np.zeros(self.dimensions)
+        x = np.asarray(x, dtype=float).reshape(1, self.dimensions)
+        k = self.kernel(self.X, x)[:, 0]
+        return self.y_scale * ((self.alpha * k) @ (self.X - x)) / self.length_scales ** 2
+
+
+class BayesianOptimizer:
+    # fits a gaussian process to every (setpoint, count) measured so far and proposes the next setpoint(s)
+    # by expected improvement over a cloud of rounded candidates inside the bounds, batch_size > 1 proposes
+    # several setpoints at once (the kriging believer: each pick lowers the variance around it for the next picks)
+    # it exposes the same tell/setpoint interface as ParameterOptimizer so the application can use either
+    def __init__(self, names, initial_values, lower_bounds, upper_bounds, batch_size=1, length_scales=0.25, noise_ratio=0.05,
+                 candidates=1000, exploration=0.0, count_change_tolerance=10, rng=None):
+        self.names = list(names)
+        self.size = len(self.names)
+        self.lower_bounds = np.array(np.broadcast_to(np.asarray(lower_bounds, dtype=float), (self.size,)))
+        self.upper_bounds = np.array(np.broadcast_to(np.asarray(upper_bounds, dtype=float), (self.size,)))
+
+        empty_windows = [name for name, lower, upper in zip(self.names, self.lower_bounds, self.upper_bounds) if lower > upper]
+        if empty_windows:
+            raise ValueError(f"lower bound is above upper bound for: {', '.join(empty_windows)}")
+
+        self.batch_size = batch_size
+        self.candidates = candidates
+        self.exploration = exploration
+        self.count_change_tolerance = count_change_tolerance
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.gaussian_process = IncrementalGaussianProcess(self.size, length_scales, noise_ratio)
+
+        self.setpoint = self.clip(initial_values)
+        self.values = self.setpoint.copy()
+        self.pending_setpoints = []
+
+        self.gradient = np.zeros(self.size)
+        self.expected_improvement = np.inf
+        self.converged = np.zeros(self.size, dtype=bool)
+        self.updated = False
+
+    # the values have to be rounded and clipped due to physical constraints
+    def clip(self, values):
+        return clip_setpoint(values, self.lower_bounds, self.upper_bounds)
+
+    # parameters are scaled to [0, 1] inside their bounds so one length scale fits focus and dispersion alike
+    def scale(self, values):
+        span = np.where(self.upper_bounds > self.lower_bounds, self.upper_bounds - self.lower_bounds, 1)
+        return (np.asarray(values, dtype=float) - self.lower_bounds) / span
+
+    def candidate_setpoints(self):
+        span = self.upper_bounds - self.lower_bounds
+        uniform = self.lower_bounds + self.rng.random((self.candidates, self.size)) * span
+        local = self.values + 0.05 * span * self.rng.standard_normal((self.candidates, self.size))
+        neighbours = self.values + np.vstack([np.eye(self.size), -np.eye(self.size)])
+        return np.unique(self.clip(np.vstack([uniform, local, neighbours])), axis=0)
+
+    # propose batch_size setpoints
+    def propose(self):
+        candidates = self.candidate_setpoints()
+        scaled_candidates = self.scale(candidates)
+        mean, variance, projection = self.gaussian_process.predict(scaled_candidates, return_projection=True)
+
+        best_count = self.gaussian_process.y.max() if len(self.gaussian_process) else mean.max()
+        count_variance = self.gaussian_process.y_scale ** 2
+
+        # each picked candidate is 'measured' at its predicted mean, which leaves the mean alone and shrinks the
+        # (standardized) variance around it: var_new(c) = var(c) - cov(c, pick)^2 / (var(pick) + noise)
+        standardized_variance = variance / count_variance
+        corrections = []
+        proposals = []
+        for _ in range(min(self.batch_size, len(candidates))):
+            expected_improvement = self._expected_improvement(mean, standardized_variance * count_variance, best_count)
+            pick = int(np.argmax(expected_improvement))
+            if not proposals:
+                self.expected_improvement = float(expected_improvement[pick])
+            proposals.append(candidates[pick])
+
+            covariance = self.gaussian_process.kernel(scaled_candidates, scaled_candidates[pick:pick + 1])[:, 0]
+            covariance -= projection.T @ projection[:, pick]
+            for correction in corrections:
+                covariance -= correction * correction[pick]
+            correction = covariance / math.sqrt(standardized_variance[pick] + self.gaussian_process.noise_ratio)
+            corrections.append(correction)
+            standardized_variance = np.maximum(standardized_variance - correction ** 2, 1e-12)
+
+        return proposals
+
+    def _expected_improvement(self, mean, variance, best_count):
+        deviation = np.sqrt(variance)
+        improvement = mean - best_count - self.exploration * deviation
+        z = improvement / deviation
+        return improvement * _normal_cdf(z) + deviation * _normal_pdf(z)
+
+    # hand in the mean count measured at self.setpoint, returns the setpoint to measure next
+    def tell(self, count):
+        self.gaussian_process.add(self.scale(self.setpoint), count)
+
+        # the incumbent is the measured setpoint with the best predicted count (robust to a lucky noisy shot)
+        measured = self.gaussian_process.X
+        best = int(np.argmax(self.gaussian_process.fitted_mean()))
+        self.values = self.clip(self.lower_bounds + measured[best] * (self.upper_bounds - self.lower_bounds))
+        span = np.where(self.upper_bounds > self.lower_bounds, self.upper_bounds - self.lower_bounds, 1)
+        self.gradient = self.gaussian_process.mean_gradient(measured[best]) / span
+
+        if not self.pending_setpoints:
+            self.pending_setpoints = self.propose()
+        self.setpoint = self.pending_setpoints.pop(0)
+
+        # no candidate is expected to beat the incumbent by more than the count noise tolerance
+        self.converged = np.full(self.size, self.expected_improvement < self.count_change_tolerance)
+        self.updated = True
+        return self.setpoint
+
+    @property
+    def is_converged(self):
+        return bool(self.converged.all())
+
+    def converged_names(self):
+        return [name for name, converged in zip(self.names, self.converged) if converged]
+
+    def as_dict(self):
+        return {name: int(value) for name, value in zip(self.names, self.values)}
+
+
+# build a bayesian optimizer from rows of parameter settings (see BetatronController.parameter_settings)
+def bayesian_optimizer_from_settings(parameter_settings, initial_values, **kwargs):
+    lower_bounds, upper_bounds = bounds_from_settings(parameter_settings, initial_values)
+    return BayesianOptimizer([setting["name"] for setting in parameter_settings], initial_values, lower_bounds, upper_bounds, **kwargs)
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+
+import numpy as np
+
+from control_loop import ControlLoop
+from image_scoring import calc_count_per_image, read_image, blur_image, reduce_image
+from parameter_optimizer import ParameterOptimizer
+from simulation import AnalyticModel, GaussianPeakModel, MultiPeakModel, NoisyModel, Simulator, readme_count_function
+
+IMAGE_PATTERNS = ('*.tiff', '*.tif', '*.png')
+RESULTS_DIRECTORY = r'benchmark_results'
+
+
+# ------------ Scoring throughput ------------ #
+
+def find_images(image_directory, limit=None):
+    image_paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(image_directory, pattern)))
+    return image_paths[:limit] if limit else image_paths
+
+
+def latency_summary(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "median_ms": float(np.median(latencies)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "max_ms": float(latencies.max()),
+        }
+
+
+# time decode, median blur and reduction of every image on one thread
+def benchmark_scoring_stages(image_paths, repeats=1):
+    stage_latencies = {"decode": [], "median_blur": [], "reduction": [], "total": []}
+
+    for _ in range(repeats):
+        for image_path in image_paths:
+            start = time.perf_counter()
+            image = read_image(image_path)
+            decoded = time.perf_counter()
+            blured_image = blur_image(image)
+            blured = time.perf_counter()
+            reduce_image(blured_image)
+            reduced = time.perf_counter()
+
+            stage_latencies["decode"].append(decoded - start)
+            stage_latencies["median_blur"].append(blured - decoded)
+            stage_latencies["reduction"].append(reduced - blured)
+            stage_latencies["total"].append(reduced - start)
+
+    return {stage: latency_summary(latencies) for stage, latencies in stage_latencies.items()}
+
+
+# mean time of the whole-frame median blur against the tiled blur of one frame and of image groups of frames
+def benchmark_tiled_blur(image_paths, tile_rows=256, workers=None, group=4, repeats=1):
+    from median_blur import TiledMedianBlur
+
+    images = [read_image(image_path) for image_path in image_paths]
+    tiled = TiledMedianBlur(tile_rows=tile_rows, workers=workers)
+
+    def mean_ms(function, batches):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for batch in batches:
+                function(batch)
+        return (time.perf_counter() - start) / (repeats * len(images)) * 1000
+
+    singles = [[image] for image in images]
+    groups = [images[index:index + group] for index in range(0, len(images), group)]
+    result = {
+        "tile_rows": tile_rows,
+        "workers": tiled.workers,
+        "whole_frame_ms": mean_ms(lambda batch: blur_image(batch[0]), singles),
+        "tiled_ms": mean_ms(lambda batch: tiled(batch[0]), singles),
+        "tiled_batch_ms": mean_ms(tiled.blur_batch, groups),
+        }
+    tiled.close()
+    return result
+
+
+# push every image through the scoring stage of the control loop with a given number of worker threads
+# (the decide stage only collects the counts, nothing is actuated)
+def benchmark_scoring_throughput(image_paths, workers, repeats=1):
+    delivered = []
+    loop = ControlLoop(calc_count_per_image, decide=lambda image_path, count: delivered.append(count) or False, actuate=lambda: None,
+                       workers=workers, max_queue_size=4 * workers)
+    loop.start()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for image_path in image_paths:
+            loop.submit(image_path)
+    loop.wait_until_idle()
+    elapsed = time.perf_counter() - start
+    loop.stop()
+
+    return {
+        "workers": workers,
+        "frames": len(delivered),
+        "elapsed_s": elapsed,
+        "frames_per_second": len(delivered) / elapsed if elapsed > 0 else float('inf'),
+        "frames_failed": loop.frames_failed,
+        }
+
+
+def run_scoring_benchmarks(image_directory, thread_counts, repeats=1, limit=None):
+    image_paths = find_images(image_directory, limit)
+    if not image_paths:
+        raise FileNotFoundError(f"no images matching {IMAGE_PATTERNS} in {image_directory}")
+
+    height, width = read_image(image_paths[0]).shape[:2]
+    return {
+        "image_directory": image_directory,
+        "images": len(image_paths),
+        "image_shape": [height, width],
+        "stages": benchmark_scoring_stages(image_paths, repeats),
+        "tiled_blur": benchmark_tiled_blur(image_paths, repeats=repeats),
+        "throughput": [benchmark_scoring_throughput(image_paths, workers, repeats) for workers in thread_counts],
+        }
+
+
+# ------------ Optimizer convergence ------------ #
+
+# each landscape gives the optimizer settings, the model and the best count that can be reached
+def gaussian_landscape():
+    model = GaussianPeakModel(peak=[-140, 36300, -27500], widths=[14, 350, 1400])
+    settings = {
+        "names": ['focus', 'second_dispersion', 'third_dispersion'],
+        "initial_values": [-150, 36100, -27000],
+        "lower_bounds": [-170, 35600, -29000],
+        "upper_bounds": [-130, 36600, -25000],
+        "learning_rates": [1e-2, 5, 50],
+        "perturbation": [2, 50, 200],
+        }
+    return settings, model, model.height
+
+
+def noisy_gaussian_landscape():
+    settings, model, best_count = gaussian_landscape()
+    return settings, NoisyModel(model, noise=100, rng=np.random.default_rng(0)), best_count
+
+
+def two_peak_landscape():
+    model = MultiPeakModel(
+        peaks=[[-160, 36000, -27000], [-138, 36400, -27800]],
+        widths=[[5, 150, 600], [10, 300, 1200]],
+        heights=[6000, 10000],
+        )
+    settings = dict(gaussian_landscape()[0], initial_values=[-158, 36050, -27050])
+    return settings, model, 10000
+
+
+def readme_landscape():
+    model = AnalyticModel(readme_count_function, sign=-1)
+    settings = {
+        "names": ['focus', 'second_dispersion'],
+        "initial_values": [-230, -230],
+        "lower_bounds": -999999,
+        "upper_bounds": 999999,
+        "learning_rates": 0.04,
+        "perturbation": 1,
+        }
+    # the minimum of the README function between its local minimum and the bounds of the README plots
+    x = np.arange(-1000, 1000)
+    return settings, model, float(np.max(-(0.1 * x) ** 2 * np.sin(0.01 * x)))
+
+
+LANDSCAPES = {
+    "gaussian": gaussian_landscape,
+    "noisy_gaussian": noisy_gaussian_landscape,
+    "two_peak": two_peak_landscape,
+    "readme": readme_landscape,
+    }
+
+CONFIGURATIONS = [
+    {"gradient_estimator": 'difference', "momentum": 0.999},
+    {"gradient_estimator": 'difference', "momentum": 0.5},
+    {"gradient_estimator": 'spsa', "momentum": 0.5},
+    {"gradient_estimator": 'spsa', "momentum": 0.9},
+    {"gradient_estimator": 'spsa', "momentum": 0.5, "update_rule": 'nesterov'},
+    {"gradient_estimator": 'spsa', "momentum": 0.5, "update_rule": 'rmsprop'},
+    {"gradient_estimator": 'spsa', "momentum": 0.0, "update_rule": 'adam'},
+    {"gradient_estimator": 'spsa', "momentum": 0.0, "update_rule": 'adam', "learning_rate_schedule": 'inverse_time', "learning_rate_decay": 0.05},
+    ]
+
+
+def benchmark_convergence(landscape_name, configuration, image_groups, image_group, target_fraction, seed=0):
+    settings, model, best_count = LANDSCAPES[landscape_name]()
+    optimizer = ParameterOptimizer(rng=np.random.default_rng(seed), **configuration, **settings)
+    simulator = Simulator(optimizer, model, image_group=image_group)
+
+    # the first image group that came within target_fraction of the best count, and the first convergence of the optimizer
+    target_count = model(settings["initial_values"]) + target_fraction * (best_count - model(settings["initial_values"]))
+    groups_to_target = None
+    groups_to_convergence = None
+
+    start = time.perf_counter()
+    for _ in range(image_groups):
+        count = simulator.step()
+        if groups_to_target is None and count >= target_count:
+            groups_to_target = simulator.image_groups_processed
+        if groups_to_convergence is None and optimizer.updated and optimizer.is_converged:
+            groups_to_convergence = simulator.image_groups_processed
+    elapsed = time.perf_counter() - start
+
+    result = simulator.result()
+    return {
+        "landscape": landscape_name,
+        **configuration,
+        "image_group": image_group,
+        "groups_to_target": groups_to_target,
+        "shots_to_target": None if groups_to_target is None else groups_to_target * image_group,
+        "groups_to_convergence": groups_to_convergence,
+        "shots_to_convergence": None if groups_to_convergence is None else groups_to_convergence * image_group,
+        "best_count": result["best_count"],
+        "best_fraction": result["best_count"] / best_count,
+        "image_groups_per_second": image_groups / elapsed if elapsed > 0 else float('inf'),
+        }
+
+
+def run_convergence_benchmarks(landscape_names, image_groups, image_group, target_fraction):
+    return [
+        benchmark_convergence(landscape_name, configuration, image_groups, image_group, target_fraction)
+        for landscape_name in landscape_names
+        for configuration in CONFIGURATIONS
+        ]
+
+
+# ------------ Reporting ------------ #
+
+def print_results(results):
+    scoring = results.get("scoring")
+    if scoring:
+        print(f"Scoring {scoring['images']} images of {scoring['image_shape'][1]}x{scoring['image_shape'][0]} from {scoring['image_directory']}")
+        for stage, latency in scoring["stages"].items():
+            print(f"  {stage:12s} mean {latency['mean_ms']:7.2f} ms  median {latency['median_ms']:7.2f} ms  p95 {latency['p95_ms']:7.2f} ms")
+        tiled = scoring.get("tiled_blur")
+        if tiled:
+            print(f"  median blur per frame: whole frame {tiled['whole_frame_ms']:.2f} ms, {tiled['tile_rows']} row tiles on {tiled['workers']} threads"
+                  f" {tiled['tiled_ms']:.2f} ms, in image groups {tiled['tiled_batch_ms']:.2f} ms")
+        for throughput in scoring["throughput"]:
+            print(f"  {throughput['workers']:2d} workers: {throughput['frames_per_second']:8.1f} frames per second")
+
+    for convergence in results.get("convergence", []):
+        print(f"{convergence['landscape']:15s} {convergence['gradient_estimator']:10s} {configuration_name(convergence):36s}"
+              f" shots to target {convergence['shots_to_target']}, shots to convergence {convergence['shots_to_convergence']},"
+              f" best {100 * convergence['best_fraction']:.1f}%")
+
+
+# update rule, momentum (adam has its own) and schedule of a convergence result (results of older runs have no update rule)
+def configuration_name(entry):
+    name = entry.get('update_rule', 'momentum')
+    if name != 'adam':
+        name += f" {entry['momentum']}"
+    if entry.get('learning_rate_schedule', 'constant') != 'constant':
+        name += f" {entry['learning_rate_schedule']} {entry['learning_rate_decay']}"
+    return name
+
+
+# compare against an earlier results file, ratios above 1 mean the current run is slower / needs more shots
+def compare_results(results, baseline):
+    comparison = []
+
+    if results.get("scoring") and baseline.get("scoring"):
+        for stage, latency in results["scoring"]["stages"].items():
+            if stage in baseline["scoring"]["stages"]:
+                comparison.append((f"scoring {stage} mean latency", latency["mean_ms"] / baseline["scoring"]["stages"][stage]["mean_ms"]))
+
+    baseline_convergence = {(entry["landscape"], entry["gradient_estimator"], configuration_name(entry)): entry for entry in baseline.get("convergence", [])}
+    for entry in results.get("convergence", []):
+        previous = baseline_convergence.get((entry["landscape"], entry["gradient_estimator"], configuration_name(entry)))
+        if previous and entry["shots_to_target"] and previous["shots_to_target"]:
+            comparison.append((f"{entry['landscape']} {entry['gradient_estimator']} {configuration_name(entry)} shots to target", entry["shots_to_target"] / previous["shots_to_target"]))
+
+    for name, ratio in comparison:
+        print(f"{name}: {ratio:.2f}x")
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark image scoring throughput and optimizer convergence")
+    parser.add_argument('--part', choices=['all', 'scoring', 'convergence'], default='all')
+    parser.add_argument('--images', default=r'images', help="directory with the images to score")
+    parser.add_argument('--image-limit', type=int, default=None)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--landscapes', nargs='+', choices=sorted(LANDSCAPES), default=sorted(LANDSCAPES))
+    parser.add_argument('--image-groups', type=int, default=500, help="image groups simulated per optimizer configuration")
+    parser.add_argument('--image-group', type=int, default=2, help="shots per image group")
+    parser.add_argument('--target-fraction', type=float, default=0.95)
+    parser.add_argument('--output', default=None, help="results file (default: a timestamped file in benchmark_results/)")
+    parser.add_argument('--compare', default=None, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        }
+
+    if args.part in ('all', 'scoring'):
+        results["scoring"] = run_scoring_benchmarks(args.images, args.threads, args.repeats, args.image_limit)
+    if args.part in ('all', 'convergence'):
+        results["convergence"] = run_convergence_benchmarks(args.landscapes, args.image_groups, args.image_group, args.target_fraction)
+
+    print_results(results)
+
+    output_path = args.output or os.path.join(RESULTS_DIRECTORY, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare_results(results, json.load(file))
+
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,307 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from metrics import Metrics
+
+# the control loop as one asyncio event loop on its own thread, with explicit stages:
+#   ingest   frames handed in by the image source (watchdog thread, frame ring poller) through submit()
+#   score    every frame is scored on a thread pool (OpenCV releases the GIL), at most max_in_flight at once
+#   decide   the counts in arrival order go to decide(frame, count), which returns True when the optimizer moved
+#   actuate  actuate() writes and uploads the new setpoint on a thread of its own, the loop never blocks on FTP
+#   publish  publish() (plots, session publisher) runs on another thread, groups finished meanwhile are coalesced
+# backpressure: a full ingest queue blocks submit() (or drops the frame), a full in-flight queue stops ingesting
+# frames taken before the new setpoint settled (actuated plus settle_time) are dropped instead of being counted
+# at the new setpoint, frames without a timestamp (an image file that is gone) are scored anyway
+# several named sources (diagnostics): score_function and workers are dicts by source name, every source is
+# scored by its own function on its own thread pool, and decide gets a SourceFrame for each of its frames
+
+
+# acquisition time (time.time()) of a ring frame or an image file, None if unknown
+def frame_timestamp(frame):
+    timestamp = getattr(frame, 'timestamp', None)
+    if timestamp is not None:
+        return timestamp
+    try:
+        return os.stat(frame).st_mtime
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+class SourceFrame:
+    # a frame (image path or ring frame) of a named source
+    def __init__(self, source, frame):
+        self.source = source
+        self.frame = frame
+        self.timestamp = frame_timestamp(frame)
+
+    def __repr__(self):
+        return f'{self.source}: {self.frame}'
+
+
+class ControlLoop:
+    def __init__(self, score_function, decide, actuate, publish=None, workers=4, max_queue_size=64, max_in_flight=None, block_when_full=True,
+                 drop_unsettled_frames=True, settle_time=0.0, fps_window=100, metrics=None):
+        self.score_functions = score_function if isinstance(score_function, dict) else {None: score_function}
+        self.decide = decide
+        self.actuate = actuate
+        self.publish = publish
+        self.workers = workers if isinstance(workers, dict) else {source: workers for source in self.score_functions}
+        self.max_queue_size = max_queue_size
+        self.max_in_flight = max_in_flight or 2 * sum(self.workers.values())
+        self.block_when_full = block_when_full
+        self.drop_unsettled_frames = drop_unsettled_frames
+        self.settle_time = settle_time
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+
+        # frames taken before this time (time.time()) belong to an earlier setpoint
+        self.settled_at = 0.0
+
+        # counters used for reporting
+        self.frames_submitted = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.frames_failed = 0
+        self.frames_unsettled = 0
+        self.delivery_times = deque(maxlen=fps_window)
+        self.submitted_at = None
+
+        # frames submitted and not yet decided (or dropped), for wait_until_idle
+        self.pending = 0
+        self.pending_condition = threading.Condition()
+
+        self.loop = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.score_executors = {
+            source: ThreadPoolExecutor(max_workers=self.workers[source], thread_name_prefix='scoring-worker' if source is None else f'scoring-{source}')
+            for source in self.score_functions
+            }
+        self.actuate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='actuate')
+        self.publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='publish')
+
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(started,), name='control-loop', daemon=True)
+        self.thread.start()
+        started.wait()
+        self.running = True
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.ingest_queue = asyncio.Queue(self.max_queue_size)
+        self.in_flight = asyncio.Queue(self.max_in_flight)
+        self.publish_requested = asyncio.Event()
+        self.actuation = None
+        self.tasks = [
+            self.loop.create_task(self._ingest(), name='ingest'),
+            self.loop.create_task(self._decide(), name='decide'),
+            self.loop.create_task(self._publish(), name='publish'),
+            ]
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+        self.loop.close()
+
+    # the new setpoint is on the devices, frames taken from settle_time on belong to it
+    def setpoint_applied(self):
+        self.settled_at = time.time() + self.settle_time
+
+    # hand a frame (image path or ring frame) to the loop from any thread, returns False if it was dropped
+    # (the frame of a named source is handed on as a SourceFrame)
+    def submit(self, frame, source=None):
+        if source not in self.score_functions:
+            raise ValueError(f"the control loop has no source {source!r}")
+        if not self.running:
+            return False
+        if source is not None:
+            frame = SourceFrame(source, frame)
+        with self.pending_condition:
+            self.pending += 1
+            self.frames_submitted += 1
+        item = (frame, time.perf_counter())
+
+        # without blocking a frame the ingest queue has no room for is dropped
+        put = self.ingest_queue.put if self.block_when_full else self._put_or_drop
+        future = asyncio.run_coroutine_threadsafe(put(item), self.loop)
+        queued = False
+        while self.running:
+            try:
+                queued = future.result(0.1) is not False
+                break
+            except FutureTimeoutError:
+                continue
+            except Exception:
+                break
+        if not future.done():
+            future.cancel()
+
+        if not queued:
+            self.frames_dropped += 1
+            self._done()
+        return queued
+
+    async def _put_or_drop(self, item):
+        if self.ingest_queue.full():
+            return False
+        self.ingest_queue.put_nowait(item)
+        return True
+
+    def _done(self, frames=1):
+        with self.pending_condition:
+            # a frame whose submit() gave up just as the loop stopped may be counted twice
+            self.pending = max(self.pending - frames, 0)
+            self.pending_condition.notify_all()
+
+    def _settled(self, timestamp):
+        return not self.drop_unsettled_frames or timestamp is None or timestamp >= self.settled_at
+
+    def _score(self, frame, submitted_at):
+        scoring_started = time.perf_counter()
+        self.metrics.observe('queue_wait', scoring_started - submitted_at)
+        try:
+            if isinstance(frame, SourceFrame):
+                count = self.score_functions[frame.source](frame.frame)
+            else:
+                count = self.score_functions[None](frame)
+        except Exception as e:
+            print(f"Error scoring {frame}: {e}")
+            count = None
+        scored_at = time.perf_counter()
+        self.metrics.observe('score', scored_at - scoring_started)
+        return count, scored_at
+
+    async def _ingest(self):
+        while True:
+            frame, submitted_at = await self.ingest_queue.get()
+            timestamp = frame_timestamp(frame)
+            # not worth scoring, the setpoint moved on since the frame was taken
+            if not self._settled(timestamp):
+                self.frames_unsettled += 1
+                self.metrics.increment('frames_unsettled')
+                self._done()
+                continue
+            executor = self.score_executors[frame.source if isinstance(frame, SourceFrame) else None]
+            scored = self.loop.run_in_executor(executor, self._score, frame, submitted_at)
+            try:
+                await self.in_flight.put((frame, timestamp, submitted_at, scored))
+            except asyncio.CancelledError:
+                scored.cancel()
+                self._done()
+                raise
+
+    async def _decide(self):
+        while True:
+            frame, timestamp, submitted_at, scored = await self.in_flight.get()
+            try:
+                count, scored_at = await scored
+                self.metrics.observe('delivery_wait', time.perf_counter() - scored_at)
+
+                if count is None:
+                    self.frames_failed += 1
+                    continue
+                # scored before the setpoint it was taken at was replaced
+                if not self._settled(timestamp):
+                    self.frames_unsettled += 1
+                    self.metrics.increment('frames_unsettled')
+                    continue
+
+                self.submitted_at = submitted_at
+                try:
+                    moved = self.decide(frame, count)
+                except Exception as e:
+                    print(f"Error processing count of {frame}: {e}")
+                    moved = False
+                self.frames_delivered += 1
+                self.delivery_times.append(time.monotonic())
+
+                if moved:
+                    # no frame counts until the devices hold the new setpoint, an actuation is never cut short
+                    self.settled_at = float('inf')
+                    self.actuation = self.loop.run_in_executor(self.actuate_executor, self.actuate)
+                    try:
+                        await asyncio.shield(self.actuation)
+                    except Exception as e:
+                        print(f"Error applying the setpoint: {e}")
+                    self.setpoint_applied()
+                    self.publish_requested.set()
+            finally:
+                self._done()
+
+    async def _publish(self):
+        while True:
+            await self.publish_requested.wait()
+            self.publish_requested.clear()
+            if self.publish is not None:
+                try:
+                    await self.loop.run_in_executor(self.publish_executor, self.publish)
+                except Exception as e:
+                    print(f"Error publishing: {e}")
+
+    # wait until every submitted frame has been decided (or dropped)
+    def wait_until_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.pending_condition:
+            while self.pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.pending_condition.wait(remaining)
+        return True
+
+    # cancel the stages, the queued frames are discarded but an actuation in progress is finished
+    def stop(self, timeout=None):
+        if not self.running:
+            return
+        self.running = False
+        asyncio.run_coroutine_threadsafe(self._cancel(), self.loop).result(timeout)
+        self.thread.join(timeout)
+        for executor in self.score_executors.values():
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.actuate_executor.shutdown(wait=True)
+        self.publish_executor.shutdown(wait=True)
+
+    async def _cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.actuation is not None:
+            await asyncio.gather(self.actuation, return_exceptions=True)
+
+        discarded = self.ingest_queue.qsize() + self.in_flight.qsize()
+        while not self.in_flight.empty():
+            self.in_flight.get_nowait()[3].cancel()
+        self._done(discarded)
+        self.loop.call_soon(self.loop.stop)
+
+    @property
+    def queue_depth(self):
+        if not self.running:
+            return 0
+        return self.ingest_queue.qsize() + self.in_flight.qsize()
+
+    @property
+    def frames_per_second(self):
+        if len(self.delivery_times) < 2:
+            return 0.0
+        elapsed = self.delivery_times[-1] - self.delivery_times[0]
+        if elapsed <= 0:
+            return 0.0
+        return (len(self.delivery_times) - 1) / elapsed
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "frames_per_second": self.frames_per_second,
+            "frames_submitted": self.frames_submitted,
+            "frames_delivered": self.frames_delivered,
+            "frames_dropped": self.frames_dropped,
+            "frames_failed": self.frames_failed,
+            "frames_unsettled": self.frames_unsettled,
+            }
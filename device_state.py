@@ -0,0 +1,141 @@
+import os
+import re
+
+# the values of the parameter files the devices read, kept in memory between steps
+# a file is only written when one of its values changed, and always written to a temporary file that is then
+# renamed over it, so the software on the device side sees either the old file or the new one, never half of it
+
+
+class DeviceFileError(ValueError):
+    def __init__(self, path, message):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+class MirrorFile:
+    # deformable mirror: one integer per actuator separated by whitespace, keyed by position
+    @staticmethod
+    def parse(path, text):
+        tokens = text.split()
+        if not tokens:
+            raise DeviceFileError(path, "no actuator values")
+        values = {}
+        for position, token in enumerate(tokens):
+            try:
+                values[position] = int(token)
+            except ValueError:
+                raise DeviceFileError(path, f"actuator {position} is {token!r}, not an integer") from None
+        return values
+
+    @staticmethod
+    def render(values):
+        return ' '.join(str(values[key]) for key in sorted(values))
+
+
+class DazzlerFile:
+    # dazzler: 'order2 = <value>' and 'order3 = <value>' lines, keyed 0 and 1
+    ORDERS = {"order2": 0, "order3": 1}
+    LINE = re.compile(r'^\s*(\w+)\s*=\s*(\S+)\s*$')
+
+    @classmethod
+    def parse(cls, path, text):
+        values = {}
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            match = cls.LINE.match(line)
+            if match is None:
+                raise DeviceFileError(path, f"line {number} is {line!r}, expected 'name = value'")
+            name, value = match.groups()
+            if name not in cls.ORDERS:
+                raise DeviceFileError(path, f"line {number} sets unknown order {name!r}")
+            try:
+                values[cls.ORDERS[name]] = int(value)
+            except ValueError:
+                raise DeviceFileError(path, f"line {number}: {name} is {value!r}, not an integer") from None
+
+        missing = [name for name, key in cls.ORDERS.items() if key not in values]
+        if missing:
+            raise DeviceFileError(path, f"missing {', '.join(missing)}")
+        return values
+
+    @classmethod
+    def render(cls, values):
+        return ''.join(f'{name} = {values[key]}\n' for name, key in cls.ORDERS.items())
+
+
+class DeviceState:
+    # the values of one device's parameter file (keys as in the 'key' of the parameter settings)
+    # setting a value marks the device dirty only when the value changes, write() writes a dirty device once
+    def __init__(self, name, path, file_format, values):
+        self.name = name
+        self.path = path
+        self.file_format = file_format
+        self.values = dict(values)
+        self.dirty = False
+        self.writes = 0
+
+    @classmethod
+    def read(cls, name, path, file_format):
+        with open(path, 'r') as file:
+            return cls(name, path, file_format, file_format.parse(path, file.read()))
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            raise KeyError(f"{self.name} has no value {key!r} ({self.path} has keys {sorted(self.values)})") from None
+
+    def __setitem__(self, key, value):
+        if key not in self.values:
+            raise KeyError(f"{self.name} has no value {key!r} ({self.path} has keys {sorted(self.values)})")
+        value = int(value)
+        if self.values[key] != value:
+            self.values[key] = value
+            self.dirty = True
+
+    def content(self):
+        return self.file_format.render(self.values).encode()
+
+    # returns True when the file was written
+    def write(self):
+        if not self.dirty:
+            return False
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(self.content())
+        os.replace(temporary_path, self.path)
+        self.dirty = False
+        self.writes += 1
+        return True
+
+
+class DeviceStates:
+    # the state of every device, the optimizer's setpoint goes in with set_setpoint and out with one write() per step
+    def __init__(self, devices):
+        self.devices = {device.name: device for device in devices}
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def value(self, setting):
+        return self.devices[setting["device"]][setting["key"]]
+
+    def set_setpoint(self, parameter_settings, setpoint):
+        for setting, value in zip(parameter_settings, setpoint):
+            self.devices[setting["device"]][setting["key"]] = value
+
+    # write the devices whose values changed, returns their names
+    def write(self):
+        return [name for name, device in self.devices.items() if device.write()]
+
+    # file name and content of every device, for the upload
+    def files(self):
+        return {name: (os.path.basename(device.path), device.content()) for name, device in self.devices.items()}
+
+
+def read_device_states(mirror_file_path, dispersion_file_path):
+    return DeviceStates([
+        DeviceState.read("mirror", mirror_file_path, MirrorFile),
+        DeviceState.read("dazzler", dispersion_file_path, DazzlerFile),
+        ])
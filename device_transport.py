@@ -0,0 +1,127 @@
+import io
+import time
+import ftplib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FTPDeviceConnection:
+    # persistent connection to the FTP server of one device (mirror or dazzler computer)
+    # the connection is opened on the first upload and opened again whenever an upload fails on it
+    def __init__(self, name, host, user='', password='', port=21, timeout=10, remote_directory=None, retries=1, ftp_factory=ftplib.FTP):
+        self.name = name
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self.remote_directory = remote_directory
+        self.retries = retries
+        self.ftp_factory = ftp_factory
+
+        self.ftp = None
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.reconnects = 0
+
+    def connect(self):
+        self.close()
+        if self.connections_opened:
+            self.reconnects += 1
+        self.connections_opened += 1
+
+        ftp = self.ftp_factory()
+        ftp.connect(self.host, self.port, timeout=self.timeout)
+        ftp.login(self.user, self.password)
+        if self.remote_directory:
+            ftp.cwd(self.remote_directory)
+        self.ftp = ftp
+
+    def close(self):
+        if self.ftp is None:
+            return
+        try:
+            self.ftp.quit()
+        except ftplib.all_errors:
+            self.ftp.close()
+        self.ftp = None
+
+    # stream the file content from memory, reconnecting (retries times) if the connection dropped
+    def upload(self, file_name, content):
+        with self.lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    if self.ftp is None:
+                        self.connect()
+                    self.ftp.storbinary(f'STOR {file_name}', io.BytesIO(content))
+                    return
+                except ftplib.all_errors:
+                    self.close()
+                    if attempt == self.retries:
+                        raise
+
+
+class DeviceTransport:
+    # uploads the parameter files of several devices concurrently over their persistent connections,
+    # a device only gets an upload when its file content changed since its last successful upload
+    def __init__(self, connections, latency_window=100):
+        self.connections = dict(connections)
+        self.executor = ThreadPoolExecutor(max_workers=max(len(self.connections), 1), thread_name_prefix='device-upload')
+
+        self.last_uploaded = {}
+        self.latencies = {name: deque(maxlen=latency_window) for name in self.connections}
+        self.uploads = {name: 0 for name in self.connections}
+        self.skipped = {name: 0 for name in self.connections}
+        self.failures = {name: 0 for name in self.connections}
+
+    # files maps device name -> (file name, content bytes), returns device name -> 'uploaded', 'unchanged' or the error
+    def upload(self, files):
+        futures = self.upload_async(files)
+        return {name: futures[name].result() if name in futures else 'unchanged' for name in files}
+
+    # same as upload but returns device name -> future without waiting
+    def upload_async(self, files):
+        futures = {}
+        for name, (file_name, content) in files.items():
+            if self.last_uploaded.get(name) == (file_name, content):
+                self.skipped[name] += 1
+                continue
+            futures[name] = self.executor.submit(self._upload, name, file_name, content)
+        return futures
+
+    def _upload(self, name, file_name, content):
+        start = time.perf_counter()
+        try:
+            self.connections[name].upload(file_name, content)
+        except Exception as e:
+            self.failures[name] += 1
+            # forget the last upload so the next call retries this device even if the content did not change
+            self.last_uploaded.pop(name, None)
+            return e
+
+        self.latencies[name].append(time.perf_counter() - start)
+        self.uploads[name] += 1
+        self.last_uploaded[name] = (file_name, content)
+        return 'uploaded'
+
+    def stats(self):
+        stats = {}
+        for name in self.connections:
+            latencies = self.latencies[name]
+            stats[name] = {
+                "uploads": self.uploads[name],
+                "skipped": self.skipped[name],
+                "failures": self.failures[name],
+                "reconnects": self.connections[name].reconnects,
+                "last_latency_ms": 1000 * latencies[-1] if latencies else None,
+                "mean_latency_ms": 1000 * sum(latencies) / len(latencies) if latencies else None,
+                "max_latency_ms": 1000 * max(latencies) if latencies else None,
+                }
+        return stats
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for connection in self.connections.values():
+            with connection.lock:
+                connection.close()
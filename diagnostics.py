@@ -0,0 +1,151 @@
+import os
+import re
+from collections import deque
+
+from control_loop import frame_timestamp
+
+# several diagnostics (betatron screen, spectrometer, beam profile, ...) looking at the same shots, each a named
+# source with its own image directory or frame ring, scoring settings and scoring threads (see
+# BetatronController.diagnostics), the counts of the frames of one shot are matched by the shot's timestamp or id
+# and combined into one objective value per shot:
+#   objective = sum of weight * count - sum of penalty * (how far a count is below its minimum or above its maximum)
+# a diagnostic with weight 0 and a minimum / maximum is a pure constraint (e.g. keep the beam profile's count up)
+MATCH_KEYS = ('timestamp', 'shot_id')
+
+# the last number in an image file name, e.g. 'spectrometer_000123.tiff' is shot 123
+SHOT_ID_PATTERN = re.compile(r'(\d+)\D*$')
+
+
+# the shot number of a ring frame (its sequence) or an image file (the last number of its name), None if it has none
+def shot_id(frame):
+    sequence = getattr(frame, 'sequence', None)
+    if sequence is not None:
+        return int(sequence)
+    match = SHOT_ID_PATTERN.search(os.path.basename(str(frame)))
+    return int(match.group(1)) if match else None
+
+
+class Shot:
+    # the frames and counts of every diagnostic for one shot
+    def __init__(self, key, frames, counts):
+        self.key = key
+        self.frames = frames
+        self.counts = counts
+        timestamps = [timestamp for timestamp in map(frame_timestamp, frames.values()) if timestamp is not None]
+        self.timestamp = min(timestamps) if timestamps else None
+
+    def __repr__(self):
+        return f"shot {self.key} ({', '.join(f'{source} {count:.2f}' for source, count in self.counts.items())})"
+
+
+class ShotMatcher:
+    # pairs up the counts of the sources: a shot is complete once every source has a frame with the same shot id
+    # (or a timestamp within tolerance seconds of the frame that completes it), a frame taken before a completed
+    # shot lost its partners and is dropped (frames_unmatched), as is the oldest frame of a source once max_pending
+    # of its frames wait for the other sources
+    def __init__(self, sources, match='timestamp', tolerance=0.005, max_pending=64):
+        if match not in MATCH_KEYS:
+            raise ValueError(f"unknown shot matching {match!r}, expected one of {MATCH_KEYS}")
+        self.sources = list(sources)
+        self.match = match
+        self.tolerance = tolerance if match == 'timestamp' else 0
+        self.pending = {source: deque() for source in self.sources}
+        self.max_pending = max_pending
+        self.shots_matched = 0
+        self.frames_unmatched = 0
+
+    def key(self, frame):
+        return frame_timestamp(frame) if self.match == 'timestamp' else shot_id(frame)
+
+    # the nearest pending frame of source within tolerance of key, None if there is none
+    def _candidate(self, source, key):
+        best = None
+        for index, (pending_key, _, _) in enumerate(self.pending[source]):
+            distance = abs(pending_key - key)
+            if distance <= self.tolerance and (best is None or distance < best[0]):
+                best = (distance, index)
+        return None if best is None else best[1]
+
+    # add the count of a frame, returns the Shot it completed (or None)
+    def add(self, source, frame, count):
+        key = self.key(frame)
+        if key is None:
+            self.frames_unmatched += 1
+            return None
+
+        pending = self.pending[source]
+        if len(pending) >= self.max_pending:
+            pending.popleft()
+            self.frames_unmatched += 1
+        pending.append((key, frame, count))
+
+        chosen = {}
+        for other in self.sources:
+            index = len(pending) - 1 if other == source else self._candidate(other, key)
+            if index is None:
+                return None
+            chosen[other] = index
+
+        frames = {}
+        counts = {}
+        for other, index in chosen.items():
+            matched_key, frames[other], counts[other] = self.pending[other][index]
+            del self.pending[other][index]
+            # the frames taken before the matched one will not find their partners any more
+            kept = [entry for entry in self.pending[other] if entry[0] >= matched_key - self.tolerance]
+            self.frames_unmatched += len(self.pending[other]) - len(kept)
+            self.pending[other] = deque(kept)
+        self.shots_matched += 1
+        return Shot(key, frames, counts)
+
+    def stats(self):
+        return {
+            "shots_matched": self.shots_matched,
+            "frames_unmatched": self.frames_unmatched,
+            "frames_pending": sum(len(pending) for pending in self.pending.values()),
+            }
+
+
+class FusedObjective:
+    # the objective of a shot from the counts of the diagnostics (rows of BetatronController.diagnostics)
+    def __init__(self, diagnostic_settings):
+        self.names = [setting["name"] for setting in diagnostic_settings]
+        self.weights = {setting["name"]: setting.get("weight", 1.0) for setting in diagnostic_settings}
+        self.minimums = {setting["name"]: setting.get("minimum") for setting in diagnostic_settings}
+        self.maximums = {setting["name"]: setting.get("maximum") for setting in diagnostic_settings}
+        self.penalties = {setting["name"]: setting.get("penalty", 10.0) for setting in diagnostic_settings}
+
+    # how far each count is outside its allowed range (0 inside)
+    def violations(self, counts):
+        violations = {}
+        for name, count in counts.items():
+            minimum, maximum = self.minimums[name], self.maximums[name]
+            below = minimum - count if minimum is not None and count < minimum else 0.0
+            above = count - maximum if maximum is not None and count > maximum else 0.0
+            violations[name] = below + above
+        return violations
+
+    def __call__(self, counts):
+        violations = self.violations(counts)
+        return sum(self.weights[name] * counts[name] - self.penalties[name] * violations[name] for name in self.names)
+
+
+class DiagnosticFusion:
+    # decide stage of the control loop for several sources: matches the SourceFrames into shots and hands
+    # on_shot(shot, objective) the objective of every complete shot (returns what on_shot returns, False otherwise)
+    def __init__(self, diagnostic_settings, on_shot, match='timestamp', tolerance=0.005, max_pending=64):
+        names = [setting["name"] for setting in diagnostic_settings]
+        if len(set(names)) != len(names):
+            raise ValueError(f"diagnostic names have to be unique: {', '.join(names)}")
+        self.matcher = ShotMatcher(names, match, tolerance, max_pending)
+        self.objective = FusedObjective(diagnostic_settings)
+        self.on_shot = on_shot
+
+    def decide(self, frame, count):
+        shot = self.matcher.add(frame.source, frame.frame, count)
+        if shot is None:
+            return False
+        return self.on_shot(shot, self.objective(shot.counts))
+
+    def stats(self):
+        return self.matcher.stats()
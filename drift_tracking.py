@@ -0,0 +1,217 @@
+from collections import deque
+
+import numpy as np
+
+from parameter_optimizer import bounds_from_settings, clip_setpoint, make_update_rule
+
+# a tracking run keeps the beam on the peak for a whole shift while the optimum drifts with the laser:
+# every group is measured at the current center plus a small random dither, the gradient is the slope of a least
+# squares fit over the last groups (instead of the difference of two noisy group means), and the optimizer switches
+# between converging on the peak (full steps, full dither) and tracking it (smaller steps and dither) depending on
+# whether the fitted slope stands out of the noise of the fit
+
+
+class WindowedGradient:
+    # least squares fit of count ~ level + trend * group + gradient . setpoint over the last `window` groups, kept as
+    # running sums that every new group adds to and the group leaving the window subtracts from, so a group costs
+    # O(size^2) whatever the window, the trend term keeps a drifting level (laser energy) out of the gradient
+    # the sums are rebuilt around the newest setpoint every `window` groups so the rounding of the subtractions
+    # never piles up and the setpoints stay small numbers however far the peak drifts
+    def __init__(self, size, window=20, scale=1, trend=True):
+        self.size = size
+        self.window = window
+        self.scale = np.array(np.broadcast_to(np.asarray(scale, dtype=float), (size,)))
+        self.trend = trend
+        self.parameters = 1 + int(trend) + size
+        if window <= self.parameters:
+            raise ValueError(f"a window of {window} groups can not fit {self.parameters} parameters")
+
+        self.groups = deque(maxlen=window)
+        self.group = 0
+        self.reference = None
+        self.reference_group = 0
+        self.clear_sums()
+
+    def clear_sums(self):
+        self.features_sum = np.zeros((self.parameters, self.parameters))
+        self.target_sum = np.zeros(self.parameters)
+        self.square_sum = 0.0
+
+    def features(self, group, setpoint):
+        distance = (np.asarray(setpoint, dtype=float) - self.reference) / self.scale
+        trend = [(group - self.reference_group) / self.window] if self.trend else []
+        return np.concatenate([[1.0], trend, distance])
+
+    def accumulate(self, group, setpoint, count, sign=1):
+        features = self.features(group, setpoint)
+        self.features_sum += sign * np.outer(features, features)
+        self.target_sum += sign * count * features
+        self.square_sum += sign * count * count
+
+    def rebuild(self):
+        group, setpoint, _ = self.groups[-1]
+        self.reference = np.asarray(setpoint, dtype=float)
+        self.reference_group = group
+        self.clear_sums()
+        for group, setpoint, count in self.groups:
+            self.accumulate(group, setpoint, count)
+
+    def add(self, setpoint, count):
+        if self.reference is None:
+            self.reference = np.asarray(setpoint, dtype=float)
+        if len(self.groups) == self.window:
+            self.accumulate(*self.groups[0], sign=-1)
+        self.group += 1
+        self.groups.append((self.group, np.array(setpoint, dtype=float), float(count)))
+        self.accumulate(*self.groups[-1])
+        if self.group % self.window == 0:
+            self.rebuild()
+
+    @property
+    def ready(self):
+        return len(self.groups) > self.parameters
+
+    # (gradient, standard error of every component) in counts per parameter unit, a parameter the window did not
+    # move has gradient 0 and an infinite error
+    def estimate(self):
+        inverse = np.linalg.pinv(self.features_sum)
+        coefficients = inverse @ self.target_sum
+        residual = self.square_sum - 2 * coefficients @ self.target_sum + coefficients @ self.features_sum @ coefficients
+        variance = max(residual, 0.0) / (len(self.groups) - self.parameters)
+
+        slopes = slice(self.parameters - self.size, None)
+        moved = np.diag(self.features_sum)[slopes] > 0
+        error = np.where(moved, np.sqrt(variance * np.maximum(np.diag(inverse)[slopes], 0)), np.inf)
+        return coefficients[slopes] / self.scale, error / self.scale
+
+
+class DriftTracker:
+    # the tell/setpoint interface of ParameterOptimizer for a run that never ends
+    # 'converge': the center takes update_rule steps along the windowed gradient and the groups are measured at the
+    #   center +- dither, once no component of the gradient is significant (|gradient| < significance standard
+    #   errors) for patience updates the peak is reached and the tracker switches to 'track'
+    # 'track': steps are tracking_gain times smaller and the dither is tracking_dither, the tracker goes back to
+    #   'converge' once the gradient is significant for patience updates or the count falls count_drop_tolerance
+    #   below its level when tracking started
+    # the default 'rmsprop' steps of step_sizes (a tenth of the dither) need no tuned learning rates, no update moves
+    # the center more than the dither, and there is no momentum by default: the windowed gradient lags the center
+    # by about half a window, and carrying the last move over on top of it overshoots the peak
+    # memory and time per group are bounded by the window whatever the length of the run
+    def __init__(self, names, initial_values, lower_bounds, upper_bounds, learning_rates, dither, window=12, momentum=0.0, update_rule='rmsprop', step_sizes=None,
+                 tracking_dither=None, tracking_gain=0.25, significance=2.0, patience=5, count_drop_tolerance=0.1, rng=None):
+        self.names = list(names)
+        self.size = len(self.names)
+        self.lower_bounds = self._as_vector(lower_bounds)
+        self.upper_bounds = self._as_vector(upper_bounds)
+        self.learning_rates = self._as_vector(learning_rates)
+        self.dither = self._as_vector(dither)
+        self.tracking_dither = np.maximum(self.dither / 2, 1) if tracking_dither is None else self._as_vector(tracking_dither)
+        self.tracking_gain = tracking_gain
+        self.significance = significance
+        self.patience = patience
+        self.count_drop_tolerance = count_drop_tolerance
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        step_sizes = self.dither / 10 if step_sizes is None else step_sizes
+        if isinstance(update_rule, str):
+            update_rule = make_update_rule(update_rule, self.learning_rates, self._as_vector(step_sizes), self._as_vector(momentum))
+        self.update_rule = update_rule
+
+        self.window = WindowedGradient(self.size, window, scale=np.maximum(self.dither, 1))
+        self.recent_counts = deque(maxlen=patience)
+
+        # the center is kept in floats, only the setpoints sent to the devices are rounded
+        self.center = np.clip(np.asarray(initial_values, dtype=float), self.lower_bounds, self.upper_bounds)
+        self.last_move = np.zeros(self.size)
+        self.state = 'converge'
+        self.state_changed = False
+        self.state_updates = 0
+        self.level = None
+        self.updates = 0
+
+        self.values = self.clip(self.center)
+        self.previous_values = self.values.copy()
+        self.gradient = np.zeros(self.size)
+        self.gradient_error = np.full(self.size, np.inf)
+        self.updated = False
+        self.setpoint = self.dithered()
+
+    def _as_vector(self, value):
+        return np.array(np.broadcast_to(np.asarray(value, dtype=float), (self.size,)))
+
+    def clip(self, values):
+        return clip_setpoint(values, self.lower_bounds, self.upper_bounds)
+
+    def dithered(self):
+        dither = self.dither if self.state == 'converge' else self.tracking_dither
+        return self.clip(self.center + self.rng.choice([-1.0, 1.0], size=self.size) * dither)
+
+    @property
+    def significant(self):
+        return np.abs(self.gradient) > self.significance * self.gradient_error
+
+    def switch(self, state):
+        self.state = state
+        self.state_changed = True
+        self.state_updates = 0
+        self.level = float(np.mean(self.recent_counts)) if state == 'track' else None
+
+    def update_state(self):
+        if self.state == 'converge':
+            self.state_updates = 0 if self.significant.any() else self.state_updates + 1
+            if self.state_updates >= self.patience:
+                self.switch('track')
+        else:
+            self.state_updates = self.state_updates + 1 if self.significant.any() else 0
+            dropped = np.mean(self.recent_counts) < self.level - self.count_drop_tolerance * abs(self.level)
+            if self.state_updates >= self.patience or (len(self.recent_counts) == self.patience and dropped):
+                self.switch('converge')
+
+    # hand in the mean count measured at self.setpoint, returns the setpoint to measure next
+    def tell(self, count):
+        self.updated = False
+        self.state_changed = False
+        self.window.add(self.setpoint, count)
+        self.recent_counts.append(count)
+
+        if self.window.ready:
+            self.gradient, self.gradient_error = self.window.estimate()
+            self.update_state()
+
+            gain = 1.0 if self.state == 'converge' else self.tracking_gain
+            change = np.clip(self.update_rule.change(self.gradient, self.last_move, gain), -self.dither, self.dither)
+            center = np.clip(self.center + change, self.lower_bounds, self.upper_bounds)
+            self.last_move = center - self.center
+            self.center = center
+            self.updates += 1
+            self.updated = True
+
+            self.previous_values = self.values
+            self.values = self.clip(self.center)
+
+        self.setpoint = self.dithered()
+        return self.setpoint
+
+    @property
+    def converged(self):
+        return np.full(self.size, self.state == 'track')
+
+    @property
+    def is_converged(self):
+        return self.state == 'track'
+
+    def converged_names(self):
+        return [name for name, converged in zip(self.names, self.converged) if converged]
+
+    def as_dict(self):
+        return {name: int(value) for name, value in zip(self.names, self.values)}
+
+
+# build a tracker from rows of parameter settings (see optimizer_from_settings), the dither is each row's perturbation
+def tracker_from_settings(parameter_settings, initial_values, **kwargs):
+    lower_bounds, upper_bounds = bounds_from_settings(parameter_settings, initial_values)
+
+    kwargs.setdefault("learning_rates", [setting["learning_rate"] for setting in parameter_settings])
+    kwargs.setdefault("dither", [setting.get("perturbation", 1) for setting in parameter_settings])
+
+    return DriftTracker([setting["name"] for setting in parameter_settings], initial_values, lower_bounds, upper_bounds, **kwargs)
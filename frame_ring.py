@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+# layout of a frame ring file, written by the acquisition software and read here without decoding or copying:
+#   a 64 byte header, then `slots` slots of a 16 byte slot header (sequence, timestamp) followed by one raw frame
+# handshake: the writer sets the slot sequence to 0, writes the frame, sets the slot sequence to the frame's
+# sequence number (1, 2, ...) and only then the header's `written` count, so a reader never sees a partial frame,
+# and a reader that finds another sequence in the slot after using the frame knows it was overwritten meanwhile
+RING_MAGIC = b'BTRING1'
+RING_VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('slots', '<u4'), ('height', '<u4'), ('width', '<u4'), ('dtype', 'S8'), ('written', '<u8'), ('reserved', 'V24')])
+SLOT_HEADER_DTYPE = np.dtype([('sequence', '<u8'), ('timestamp', '<f8')])
+SLOT_ALIGNMENT = 64
+
+
+def _slot_size(frame_bytes):
+    size = SLOT_HEADER_DTYPE.itemsize + frame_bytes
+    return -(-size // SLOT_ALIGNMENT) * SLOT_ALIGNMENT
+
+
+class FrameRing:
+    # a frame ring file mapped into memory, frames are numpy views straight into the mapping
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.memory = np.memmap(path, dtype=np.uint8, mode=mode)
+
+        self.header = self.memory[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if self.header['magic'][0] != RING_MAGIC:
+            raise ValueError(f"{path} is not a frame ring file")
+        if self.header['version'][0] != RING_VERSION:
+            raise ValueError(f"{path} has frame ring version {self.header['version'][0]}, expected {RING_VERSION}")
+
+        self.slots = int(self.header['slots'][0])
+        self.frame_shape = (int(self.header['height'][0]), int(self.header['width'][0]))
+        self.frame_dtype = np.dtype(self.header['dtype'][0].decode())
+        frame_bytes = self.frame_shape[0] * self.frame_shape[1] * self.frame_dtype.itemsize
+        self.slot_size = _slot_size(frame_bytes)
+
+        self.slot_headers = []
+        self.frames = []
+        for slot in range(self.slots):
+            offset = HEADER_DTYPE.itemsize + slot * self.slot_size
+            data_offset = offset + SLOT_HEADER_DTYPE.itemsize
+            self.slot_headers.append(self.memory[offset:data_offset].view(SLOT_HEADER_DTYPE))
+            self.frames.append(self.memory[data_offset:data_offset + frame_bytes].view(self.frame_dtype).reshape(self.frame_shape))
+
+    # create (or overwrite) a ring file with room for `slots` frames
+    @classmethod
+    def create(cls, path, frame_shape, dtype=np.uint16, slots=64):
+        dtype = np.dtype(dtype)
+        frame_bytes = frame_shape[0] * frame_shape[1] * dtype.itemsize
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = RING_MAGIC
+        header['version'] = RING_VERSION
+        header['slots'] = slots
+        header['height'], header['width'] = frame_shape
+        header['dtype'] = dtype.str.encode()
+
+        with open(path, 'wb') as file:
+            file.write(header.tobytes())
+            file.truncate(HEADER_DTYPE.itemsize + slots * _slot_size(frame_bytes))
+        return cls(path, mode='r+')
+
+    @property
+    def written(self):
+        return int(self.header['written'][0])
+
+    def slot(self, sequence):
+        return (sequence - 1) % self.slots
+
+    # sequence number currently held by the slot of `sequence`, 0 while the slot is being written
+    def slot_sequence(self, sequence):
+        return int(self.slot_headers[self.slot(sequence)]['sequence'][0])
+
+    def write(self, frame, timestamp=None):
+        sequence = self.written + 1
+        slot = self.slot(sequence)
+        slot_header = self.slot_headers[slot]
+
+        slot_header['sequence'] = 0
+        self.frames[slot][...] = frame
+        slot_header['timestamp'] = time.time() if timestamp is None else timestamp
+        slot_header['sequence'] = sequence
+        self.header['written'] = sequence
+        return sequence
+
+    def flush(self):
+        self.memory.flush()
+
+    # the mapping is released once the last frame view of it is gone
+    def close(self):
+        if self.memory.mode != 'r':
+            self.flush()
+        self.header = self.memory = None
+        self.slot_headers = []
+        self.frames = []
+
+
+class RingFrame:
+    # one frame of the ring: a zero-copy view and the sequence number needed to check it was not overwritten
+    def __init__(self, ring, sequence):
+        self.ring = ring
+        self.sequence = sequence
+        self.array = ring.frames[ring.slot(sequence)]
+        self.timestamp = float(ring.slot_headers[ring.slot(sequence)]['timestamp'][0])
+
+    @property
+    def intact(self):
+        return self.ring.slot_sequence(self.sequence) == self.sequence
+
+    def __repr__(self):
+        return f'{self.ring.path}#{self.sequence}'
+
+
+# score function for ring frames: scores the view in place and rejects the count if the writer
+# overwrote the slot while it was being scored (the frame is counted as failed by the ControlLoop)
+def score_ring_frame(score_function):
+    def score(frame):
+        count = score_function(frame.array)
+        if not frame.intact:
+            raise ValueError(f"frame {frame} was overwritten before it was scored")
+        return count
+    return score
+
+
+class FrameRingSource:
+    # polls a ring file for new frames and hands them to process_frames_callback(frames) in order,
+    # frames the writer already overwrote before they were seen are counted in frames_dropped
+    # stop() and join() like the watchdog observer of the directory source
+    def __init__(self, path, process_frames_callback, poll_interval=0.001, open_timeout=10):
+        self.path = path
+        self.process_frames_callback = process_frames_callback
+        self.poll_interval = poll_interval
+        self.open_timeout = open_timeout
+
+        self.ring = None
+        self.last_sequence = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.running = False
+        self.thread = None
+
+    # the acquisition software may create the ring file after the optimization started
+    def open(self):
+        deadline = time.monotonic() + self.open_timeout
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline:
+                raise FileNotFoundError(f"frame ring {self.path} was not created within {self.open_timeout} s")
+            time.sleep(0.05)
+        self.ring = FrameRing(self.path)
+        # only frames written from now on belong to this run
+        self.last_sequence = self.ring.written
+
+    def start(self):
+        if self.ring is None:
+            self.open()
+        self.running = True
+        self.thread = threading.Thread(target=self._poll, name='frame-ring-source', daemon=True)
+        self.thread.start()
+
+    # the frames written since the last call (oldest first)
+    def read_new_frames(self):
+        written = self.ring.written
+        if written <= self.last_sequence:
+            return []
+
+        # frames older than one ring were overwritten before we got to them
+        oldest = max(self.last_sequence + 1, written - self.ring.slots + 1)
+        self.frames_dropped += oldest - self.last_sequence - 1
+        frames = [RingFrame(self.ring, sequence) for sequence in range(oldest, written + 1)]
+        self.last_sequence = written
+        self.frames_read += len(frames)
+        return frames
+
+    def _poll(self):
+        while self.running:
+            frames = self.read_new_frames()
+            if frames:
+                self.process_frames_callback(frames)
+            else:
+                time.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
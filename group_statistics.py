@@ -0,0 +1,222 @@
+import numpy as np
+
+# normal scale of the median absolute deviation
+MAD_SCALE = 1.4826
+
+
+class RunningStatistics:
+    # online mean / variance (Welford), one value at a time or a batch of values at once
+    def __init__(self):
+        self.samples = 0
+        self.mean = 0.0
+        self.sum_of_squares = 0.0
+
+    def add(self, value):
+        self.samples += 1
+        delta = value - self.mean
+        self.mean += delta / self.samples
+        self.sum_of_squares += delta * (value - self.mean)
+
+    # merge the statistics of a batch into the running ones (Chan et al. parallel update)
+    def add_batch(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        if values.size == 0:
+            return
+
+        batch_samples = values.size
+        batch_mean = values.mean()
+        batch_sum_of_squares = ((values - batch_mean) ** 2).sum()
+
+        total_samples = self.samples + batch_samples
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_samples / total_samples
+        self.sum_of_squares += batch_sum_of_squares + delta ** 2 * self.samples * batch_samples / total_samples
+        self.samples = total_samples
+
+    @property
+    def variance(self):
+        return self.sum_of_squares / (self.samples - 1) if self.samples > 1 else np.inf
+
+    @property
+    def standard_error(self):
+        return np.sqrt(self.variance / self.samples) if self.samples > 1 else np.inf
+
+
+class ImageGroup:
+    # the shots taken at one setpoint
+    # a shot is rejected as a misfire when its count is below misfire_count, or when it is more than outlier_sigmas
+    # noise standard deviations away from the median of the group's shots (checked again as shots arrive, so a
+    # misfire among the first shots is rejected too), the accepted shots go into the running statistics
+    # two shots have no median to go by: they are told apart with the noise pooled over the earlier groups, and the one
+    # further from reference (the previous group's count, otherwise the higher shot since misfires lose counts) is rejected
+    def __init__(self, noise, misfire_count=None, outlier_sigmas=4.0, reference=None):
+        self.noise = noise
+        self.reference = reference
+        self.misfire_count = misfire_count
+        self.outlier_sigmas = outlier_sigmas
+        self.counts = []
+        self.accepted = []
+        self.statistics = RunningStatistics()
+
+    def add(self, count):
+        self.counts.append(float(count))
+        accepted = self._accepted()
+
+        # a new shot that only extends the accepted shots is a plain streaming update, otherwise rebuild
+        # (the group holds a handful of shots)
+        if accepted[:-1] == self.accepted and accepted[-1:] == [len(self.counts) - 1]:
+            self.statistics.add(self.counts[-1])
+        elif accepted != self.accepted:
+            self.statistics = RunningStatistics()
+            for index in accepted:
+                self.statistics.add(self.counts[index])
+        self.accepted = accepted
+
+    def _accepted(self):
+        counts = np.asarray(self.counts)
+        valid = np.ones(len(counts), dtype=bool) if self.misfire_count is None else counts >= self.misfire_count
+        if valid.sum() >= 3:
+            median = np.median(counts[valid])
+            # the group's own spread is unreliable with few shots, never trust it below the noise of earlier groups
+            scale = max(MAD_SCALE * np.median(np.abs(counts[valid] - median)), self.noise.standard_deviation)
+            if np.isfinite(scale) and scale > 0:
+                valid &= np.abs(counts - median) <= self.outlier_sigmas * scale
+        elif valid.sum() == 2 and self.noise.standard_deviation > 0:
+            pair = np.flatnonzero(valid)
+            if abs(counts[pair[0]] - counts[pair[1]]) > self.outlier_sigmas * np.sqrt(2) * self.noise.standard_deviation:
+                reference = self.reference if self.reference is not None else counts[pair].max()
+                valid[pair[np.argmax(np.abs(counts[pair] - reference))]] = False
+        return list(np.flatnonzero(valid))
+
+    @property
+    def shots(self):
+        return len(self.counts)
+
+    @property
+    def samples(self):
+        return self.statistics.samples
+
+    @property
+    def rejected(self):
+        return self.shots - self.samples
+
+    @property
+    def mean(self):
+        return self.statistics.mean
+
+    @property
+    def accepted_counts(self):
+        return [self.counts[index] for index in self.accepted]
+
+    # standard error of the mean, from the noise pooled over all groups (the spread of two or three shots says little)
+    @property
+    def standard_error(self):
+        variance = self.noise.variance_with(self.statistics)
+        return np.sqrt(variance / self.samples) if self.samples else np.inf
+
+
+class PooledNoise:
+    # shot-to-shot variance pooled over the completed groups (the sums of squares of every group around its own mean),
+    # independent of how the count changes between setpoints
+    def __init__(self):
+        self.sum_of_squares = 0.0
+        self.degrees_of_freedom = 0
+
+    def add(self, statistics):
+        if statistics.samples > 1:
+            self.sum_of_squares += statistics.sum_of_squares
+            self.degrees_of_freedom += statistics.samples - 1
+
+    # pooled variance including a group that is still open
+    def variance_with(self, statistics):
+        sum_of_squares = self.sum_of_squares
+        degrees_of_freedom = self.degrees_of_freedom
+        if statistics.samples > 1:
+            sum_of_squares += statistics.sum_of_squares
+            degrees_of_freedom += statistics.samples - 1
+        return sum_of_squares / degrees_of_freedom if degrees_of_freedom else np.inf
+
+    @property
+    def standard_deviation(self):
+        return np.sqrt(self.sum_of_squares / self.degrees_of_freedom) if self.degrees_of_freedom else 0.0
+
+
+class GroupSizer:
+    # decides when the shots of a setpoint are enough
+    # with adaptive groups a group takes at least min_shots accepted shots and then keeps going until its count
+    # differs from the previous group's by more than significance standard errors (the step changed the count) or
+    # the difference is known to within the count change tolerance (the step did not matter), never more than max_shots
+    # without adaptive groups every group takes min_shots accepted shots (or max_shots shots when too many misfire)
+    def __init__(self, min_shots=2, max_shots=8, adaptive=True, significance=2.0, tolerance=10, misfire_count=None, outlier_sigmas=4.0):
+        if max_shots < min_shots:
+            raise ValueError("max_shots has to be at least min_shots")
+        self.min_shots = min_shots
+        self.max_shots = max_shots
+        self.adaptive = adaptive
+        self.significance = significance
+        self.tolerance = tolerance
+        self.misfire_count = misfire_count
+        self.outlier_sigmas = outlier_sigmas
+
+        self.noise = PooledNoise()
+        self.previous = None
+        self.group = self.new_group()
+
+        # counters used for reporting
+        self.groups = 0
+        self.shots = 0
+        self.rejected = 0
+
+    def new_group(self):
+        return ImageGroup(self.noise, self.misfire_count, self.outlier_sigmas, reference=None if self.previous is None else self.previous[0])
+
+    # add the count of a shot, returns True when the group is complete
+    def add(self, count, min_shots=None):
+        self.group.add(count)
+        return self.complete(min_shots)
+
+    # min_shots may be lowered for a setpoint that already has cached shots
+    def complete(self, min_shots=None):
+        group = self.group
+        min_shots = self.min_shots if min_shots is None else min_shots
+        if group.shots >= self.max_shots:
+            return True
+        if group.samples < max(min_shots, 1):
+            return False
+        if not self.adaptive or self.previous is None:
+            return True
+
+        previous_mean, previous_error = self.previous
+        difference_error = np.hypot(group.standard_error, previous_error)
+        if not np.isfinite(difference_error):
+            return False
+        # the step changed the count, or the count change is known to be below the tolerance
+        return abs(group.mean - previous_mean) >= self.significance * difference_error or self.significance * difference_error <= self.tolerance
+
+    # close the group (its shots count towards the noise estimate) and start the next one
+    def finish(self):
+        group = self.group
+        self.noise.add(group.statistics)
+        if group.samples:
+            self.previous = (group.mean, group.standard_error)
+        self.groups += 1
+        self.shots += group.shots
+        self.rejected += group.rejected
+        self.group = self.new_group()
+        return group
+
+    # the count of a setpoint that was not measured by a group (e.g. reused from the measurement cache)
+    def set_previous(self, mean, samples):
+        standard_deviation = self.noise.standard_deviation
+        self.previous = (mean, standard_deviation / np.sqrt(samples) if standard_deviation and samples else np.inf)
+        if not self.group.shots:
+            self.group.reference = mean
+
+    def stats(self):
+        return {
+            "groups": self.groups,
+            "shots": self.shots,
+            "rejected": self.rejected,
+            "shots_per_group": self.shots / self.groups if self.groups else 0.0,
+            "noise": float(self.noise.standard_deviation),
+            }
@@ -0,0 +1,133 @@
+import os
+import threading
+
+import numpy as np
+
+
+class HistorySeries:
+    # one tracked series kept in a preallocated numpy buffer
+    # without max_length the buffer grows by doubling, with max_length it is a ring that keeps the newest points
+    # and (optionally) appends the points it drops to a raw binary file on disk
+    def __init__(self, width=None, capacity=1024, max_length=None, spill_path=None, dtype=float):
+        self.point_shape = () if width is None else (width,)
+        self.dtype = np.dtype(dtype)
+        self.max_length = max_length
+        self.spill_path = spill_path
+        self.spill_file = None
+
+        if max_length is not None:
+            if max_length < 1:
+                raise ValueError("max_length has to be at least 1")
+            # every point is written twice (slot and slot + max_length) so the newest points are always one contiguous slice
+            self.buffer = np.empty((2 * max_length,) + self.point_shape, dtype=self.dtype)
+        else:
+            self.buffer = np.empty((max(capacity, 1),) + self.point_shape, dtype=self.dtype)
+
+        # number of points ever appended and number of points currently held in memory
+        self.total = 0
+        self.length = 0
+
+    def append(self, value):
+        if self.max_length is None:
+            if self.length == len(self.buffer):
+                self._grow()
+            self.buffer[self.length] = value
+            self.length += 1
+        else:
+            slot = self.total % self.max_length
+            if self.total >= self.max_length and self.spill_path is not None:
+                self._spill(self.buffer[slot])
+            self.buffer[slot] = value
+            self.buffer[slot + self.max_length] = value
+            self.length = min(self.length + 1, self.max_length)
+        self.total += 1
+
+    def _grow(self):
+        new_buffer = np.empty((2 * len(self.buffer),) + self.point_shape, dtype=self.dtype)
+        new_buffer[:self.length] = self.buffer[:self.length]
+        self.buffer = new_buffer
+
+    def _spill(self, point):
+        if self.spill_file is None:
+            directory = os.path.dirname(self.spill_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.spill_file = open(self.spill_path, 'ab')
+        self.spill_file.write(np.ascontiguousarray(point, dtype=self.dtype).tobytes())
+
+    # zero-copy view of the points held in memory, oldest first (valid until the next append)
+    def view(self):
+        if self.max_length is None:
+            return self.buffer[:self.length]
+        oldest_slot = (self.total - self.length) % self.max_length
+        return self.buffer[oldest_slot:oldest_slot + self.length]
+
+    def last(self, count=1):
+        return self.view()[-count:]
+
+    # the points that were pushed out of memory to disk
+    def spilled(self):
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return np.empty((0,) + self.point_shape, dtype=self.dtype)
+        if self.spill_file is not None:
+            self.spill_file.flush()
+        return np.fromfile(self.spill_path, dtype=self.dtype).reshape((-1,) + self.point_shape)
+
+    # every point ever appended (copies, meant for saving or analysis not for the plots)
+    def full(self):
+        return np.concatenate([self.spilled(), self.view()])
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+
+class HistoryStore:
+    # all the series tracked during an optimization run, looked up by name
+    # appends and snapshots take a lock so another thread (the plots) can copy series while the control loop appends
+    def __init__(self, max_length=None, spill_directory=None, capacity=1024):
+        self.max_length = max_length
+        self.spill_directory = spill_directory
+        self.capacity = capacity
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def add_series(self, name, width=None, dtype=float):
+        spill_path = None
+        if self.max_length is not None and self.spill_directory is not None:
+            spill_path = os.path.join(self.spill_directory, f'{name}.bin')
+        self.series[name] = HistorySeries(width=width, capacity=self.capacity, max_length=self.max_length, spill_path=spill_path, dtype=dtype)
+        return self.series[name]
+
+    def append(self, name, value):
+        with self.lock:
+            self.series[name].append(value)
+
+    # copy several series at once (consistent with each other) for use on another thread,
+    # reduce(*views) may shrink the series (e.g. decimate them) instead of copying them whole
+    def snapshot(self, names, reduce=None):
+        with self.lock:
+            views = [self.series[name].view() for name in names]
+            if reduce is not None:
+                return reduce(*views)
+            return [view.copy() for view in views]
+
+    def last(self, name, count=1):
+        return self.series[name].last(count)
+
+    def close(self):
+        for series in self.series.values():
+            series.close()
+
+    def __getitem__(self, name):
+        return self.series[name].view()
+
+    def __contains__(self, name):
+        return name in self.series
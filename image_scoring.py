@@ -0,0 +1,208 @@
+import threading
+
+import numpy as np
+
+from metrics import Metrics
+
+
+# read the image in 16 bit
+# (cv2 is imported on first use, importing OpenCV is most of the start up time of the headless runner)
+def read_image(image_path):
+    import cv2
+    original_image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED | cv2.IMREAD_ANYDEPTH)
+    if original_image is None:
+        raise ValueError(f"could not read image {image_path}")
+    return original_image
+
+
+# apply median blur on image
+def blur_image(image):
+    import cv2
+    return cv2.medianBlur(image, 5)
+
+
+# calculate mean brightness of blured image
+def reduce_image(image):
+    return image.mean()
+
+
+# method to calculate count (by its brightness proxy)
+def calc_count_per_image(image_path):
+    return reduce_image(blur_image(read_image(image_path)))
+
+
+# pixels on each side of a region the 5x5 median blur needs to give the same values as on the whole frame
+BLUR_HALO = 2
+
+REDUCTIONS = ('mean', 'sum', 'threshold', 'percentile')
+
+
+# find the region around the signal: the bounding box of the pixels brighter than fraction of the way from
+# the median (background) level to the peak, searched on a strided view so it costs a fraction of the frame
+# returns (top, bottom, left, right) padded by margin and clipped to the frame
+def detect_roi(image, fraction=0.5, margin=16, stride=8):
+    coarse = image[::stride, ::stride]
+    background = np.median(coarse)
+    peak = coarse.max()
+    if peak <= background:
+        return None
+    rows, columns = np.nonzero(coarse > background + fraction * (peak - background))
+    return (
+        int(max(rows.min() * stride - margin, 0)),
+        int(min((rows.max() + 1) * stride + margin, image.shape[0])),
+        int(max(columns.min() * stride - margin, 0)),
+        int(min((columns.max() + 1) * stride + margin, image.shape[1])),
+        )
+
+
+# mean over binning x binning blocks (the edge rows and columns that do not fill a block are dropped),
+# summed from strided views which is much faster than a reshape and mean over the block axes
+def bin_image(image, binning):
+    if binning == 1:
+        return image
+    height = image.shape[0] - image.shape[0] % binning
+    width = image.shape[1] - image.shape[1] % binning
+    binned = np.zeros((height // binning, width // binning), dtype=np.float32)
+    for row in range(binning):
+        for column in range(binning):
+            binned += image[row:height:binning, column:width:binning]
+    binned /= binning * binning
+    return binned
+
+
+class FrameScorer:
+    # configurable brightness proxy, used as the score function of the control_loop.ControlLoop
+    # roi is None (whole frame), (top, bottom, left, right) or 'auto' (detected on the first frame, see reset_roi)
+    # the frame is cropped (with the halo the blur needs) before anything else, so the work scales with the roi,
+    # then the background frame is subtracted, the crop binned, blurred and reduced:
+    #   'mean' of the pixels (the default, same count as calc_count_per_image), 'sum' the integrated signal,
+    #   'threshold' the integrated signal above threshold, 'percentile' the given percentile of the pixels
+    # .npy frames are memory mapped so only the rows of the roi are read from disk
+    # metrics (a metrics.Metrics) times the decode, preprocess (crop, background, binning), blur and reduce stages
+    # with blur_tile_rows the blur of a frame is split into bands of that many rows blurred on blur_workers threads
+    # (see median_blur.TiledMedianBlur, same counts), which cuts the latency of large frames arriving one at a time,
+    # the control loop scores every frame on its own as it arrives so only this per-frame tiled blur is used there
+    def __init__(self, roi=None, binning=1, background=None, reduction='mean', threshold=0, percentile=99, blur=True, auto_roi_fraction=0.5, auto_roi_margin=16,
+                 blur_tile_rows=None, blur_workers=None, metrics=None):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"unknown reduction {reduction!r}, expected one of {', '.join(REDUCTIONS)}")
+        if binning < 1:
+            raise ValueError("binning has to be at least 1")
+        if roi is not None and roi != 'auto':
+            roi = tuple(int(edge) for edge in roi)
+            if len(roi) != 4 or roi[0] >= roi[1] or roi[2] >= roi[3]:
+                raise ValueError(f"roi has to be (top, bottom, left, right) with top < bottom and left < right, got {roi}")
+
+        self.auto_roi = roi == 'auto'
+        self.roi = None if self.auto_roi else roi
+        self.binning = binning
+        self.reduction = reduction
+        self.threshold = threshold
+        self.percentile = percentile
+        self.blur = blur
+        self.auto_roi_fraction = auto_roi_fraction
+        self.auto_roi_margin = auto_roi_margin
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+
+        self.tiled_blur = None
+        if blur_tile_rows is not None:
+            from median_blur import TiledMedianBlur
+            self.tiled_blur = TiledMedianBlur(tile_rows=blur_tile_rows, workers=blur_workers)
+
+        # the background frame (or its path) and its crop to the current roi
+        self.background = read_image(background) if isinstance(background, str) else background
+        self.background_crop = None
+        self.lock = threading.Lock()
+
+    # forget the detected roi, the next frame detects it again (e.g. after the beam moved)
+    def reset_roi(self):
+        with self.lock:
+            if self.auto_roi:
+                self.roi = None
+            self.background_crop = None
+
+    # a path or a frame that is already in memory (e.g. a view into a frame ring)
+    def load(self, image_path):
+        if isinstance(image_path, np.ndarray):
+            return image_path
+        if image_path.endswith('.npy'):
+            return np.load(image_path, mmap_mode='r')
+        return read_image(image_path)
+
+    # the crop (a view, with halo) and the slices that trim the halo off the processed crop
+    def crop(self, image):
+        with self.lock:
+            if self.roi is None and self.auto_roi:
+                self.roi = detect_roi(image, self.auto_roi_fraction, self.auto_roi_margin)
+            roi = self.roi
+        if roi is None:
+            return image, (slice(None), slice(None))
+
+        top, bottom, left, right = roi
+        # the halo is a whole number of bins so the bins of the crop line up with the bins of the roi
+        halo = BLUR_HALO * self.binning if self.blur else 0
+        outer_top, outer_left = max(top - halo, 0), max(left - halo, 0)
+        outer_bottom, outer_right = min(bottom + halo, image.shape[0]), min(right + halo, image.shape[1])
+        crop = image[outer_top:outer_bottom, outer_left:outer_right]
+
+        binning = self.binning
+        trim = (
+            slice((top - outer_top) // binning, (bottom - outer_top) // binning),
+            slice((left - outer_left) // binning, (right - outer_left) // binning),
+            )
+        return crop, trim
+
+    def subtract_background(self, crop):
+        if self.background is None:
+            return crop
+        if self.background_crop is None or self.background_crop.shape != crop.shape:
+            background_crop, _ = self.crop(self.background)
+            self.background_crop = np.asarray(background_crop, dtype=np.float32)
+        return np.subtract(crop, self.background_crop, dtype=np.float32)
+
+    def reduce(self, image):
+        if self.reduction == 'sum':
+            return image.sum(dtype=np.float64)
+        if self.reduction == 'threshold':
+            return np.maximum(np.subtract(image, self.threshold, dtype=np.float32), 0).sum(dtype=np.float64)
+        if self.reduction == 'percentile':
+            return np.percentile(image, self.percentile)
+        return image.mean()
+
+    def preprocess(self, image):
+        crop, trim = self.crop(image)
+        return bin_image(self.subtract_background(crop), self.binning), trim
+
+    def blur_frame(self, image):
+        if self.tiled_blur is not None:
+            return self.tiled_blur(image)
+        return blur_image(image)
+
+    def __call__(self, image_path):
+        metrics = self.metrics
+        with metrics.span('decode'):
+            image = self.load(image_path)
+        with metrics.span('preprocess'):
+            image, trim = self.preprocess(image)
+        if self.blur:
+            with metrics.span('blur'):
+                image = self.blur_frame(image)
+        with metrics.span('reduce'):
+            return self.reduce(image[trim])
+
+    # the counts of several frames already on disk (benchmarks, scoring a saved run), with tiling the tiles of all
+    # of them are blurred together on the pool, the control loop does not wait for a group's frames to batch them
+    def score_batch(self, image_paths):
+        metrics = self.metrics
+        with metrics.span('decode'):
+            images = [self.load(image_path) for image_path in image_paths]
+        with metrics.span('preprocess'):
+            images, trims = zip(*(self.preprocess(image) for image in images)) if images else ((), ())
+        if self.blur:
+            with metrics.span('blur'):
+                if self.tiled_blur is not None:
+                    images = self.tiled_blur.blur_batch(images)
+                else:
+                    images = [blur_image(image) for image in images]
+        with metrics.span('reduce'):
+            return [self.reduce(image[trim]) for image, trim in zip(images, trims)]
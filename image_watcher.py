@@ -0,0 +1,82 @@
+import os
+from collections import deque
+
+# the camera software may write an image under this suffix and rename it when it is complete,
+# such images are only processed once renamed so they are never read half written
+PARTIAL_SUFFIX = '.part'
+
+
+# the image files the camera writes, other files showing up in the directory (notes, exports, ...) are ignored
+# (the default of BetatronController.image_extensions)
+IMAGE_EXTENSIONS = ('.tiff', '.npy')
+
+
+class ImageHandler:
+    # handler of the watchdog observer, which calls dispatch with every event of the directory
+    # (watchdog is only imported by watch_directory, so the extensions can be read without it)
+    # extensions None hands on every file
+    def __init__(self, process_images_callback, extensions=IMAGE_EXTENSIONS):
+        self.process_images_callback = process_images_callback
+        self.extensions = None if extensions is None else tuple(extension.lower() for extension in extensions)
+
+    def is_image(self, path):
+        if path.endswith(PARTIAL_SUFFIX):
+            return False
+        return self.extensions is None or path.lower().endswith(self.extensions)
+
+    # created images, and images renamed from their partial name once complete
+    def dispatch(self, event):
+        if event.is_directory:
+            return
+        if event.event_type == 'created':
+            path = event.src_path
+        elif event.event_type == 'moved':
+            path = event.dest_path
+        else:
+            return
+        if self.is_image(path):
+            self.process_images_callback([path])
+
+
+# start watching the image directory, process_images_callback gets a list with the path of every new image
+def watch_directory(path, process_images_callback, extensions=IMAGE_EXTENSIONS):
+    from watchdog.observers import Observer
+
+    observer = Observer()
+    observer.schedule(ImageHandler(process_images_callback, extensions), path, recursive=False)
+    observer.start()
+    return observer
+
+
+class ImageTracker:
+    # the images of the directory that were already handed on, so every image is processed once however many
+    # events it gets (created, then moved from its partial name, ...) without listing the directory on every event
+    # the directory is listed once, the images already in it belong to an earlier run, only the newest
+    # `remember` images are kept (events of older images do not come any more)
+    def __init__(self, path, remember=4096):
+        self.seen = set()
+        self.order = deque()
+        self.remember = remember
+        for entry in os.scandir(path):
+            if entry.is_file():
+                self._add(entry.path)
+
+    def _add(self, image_path):
+        self.seen.add(image_path)
+        self.order.append(image_path)
+        if len(self.order) > self.remember:
+            self.seen.discard(self.order.popleft())
+
+    # the images not seen before that still exist, oldest first
+    def new_images(self, image_paths):
+        new_images = []
+        for image_path in image_paths:
+            if image_path in self.seen:
+                continue
+            try:
+                created = os.stat(image_path).st_ctime
+            except OSError:
+                continue
+            self._add(image_path)
+            new_images.append((created, image_path))
+        return [image_path for _, image_path in sorted(new_images)]
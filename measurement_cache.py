@@ -0,0 +1,115 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from group_statistics import RunningStatistics
+
+# what to do at a setpoint before measuring it
+REUSE = 'reuse'
+TOP_UP = 'top_up'
+MEASURE = 'measure'
+
+
+class CachedMeasurement(RunningStatistics):
+    # running mean / variance of the image counts measured at one setpoint
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+        self.first_measured = None
+        self.last_measured = None
+
+    # merge a batch of counts measured at time now into the running statistics
+    def add_counts(self, counts, now):
+        counts = np.atleast_1d(np.asarray(counts, dtype=float))
+        if counts.size == 0:
+            return
+        self.add_batch(counts)
+
+        if self.first_measured is None:
+            self.first_measured = now
+        self.last_measured = now
+
+
+class MeasurementCache:
+    # counts measured at each quantized setpoint, so coming back to a setpoint costs fewer (or no) shots
+    # an entry with target_samples shots is reused as is, an entry with fewer is topped up, and an entry last
+    # measured more than staleness seconds ago is measured again from scratch (the laser drifts), the least
+    # recently used entry is evicted once max_entries setpoints are cached
+    def __init__(self, target_samples, max_entries=256, staleness=300, clock=time.monotonic):
+        self.target_samples = target_samples
+        self.max_entries = max_entries
+        self.staleness = staleness
+        self.clock = clock
+        self.entries = OrderedDict()
+
+        # counters used for reporting
+        self.hits = 0
+        self.top_ups = 0
+        self.misses = 0
+        self.shots_saved = 0
+
+    # setpoints are integers on the devices, so the rounded tuple identifies a measurement
+    def key(self, setpoint):
+        return tuple(int(value) for value in np.rint(np.asarray(setpoint, dtype=float)))
+
+    def lookup(self, setpoint):
+        key = self.key(setpoint)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if self.staleness is not None and self.clock() - entry.last_measured > self.staleness:
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return entry
+
+    # decide how to get the count at a setpoint: (REUSE, entry), (TOP_UP, shots needed) or (MEASURE, shots needed)
+    def policy(self, setpoint):
+        entry = self.lookup(setpoint)
+        if entry is None:
+            self.misses += 1
+            return MEASURE, self.target_samples
+
+        if entry.samples >= self.target_samples:
+            self.hits += 1
+            self.shots_saved += self.target_samples
+            return REUSE, entry
+
+        self.top_ups += 1
+        self.shots_saved += entry.samples
+        return TOP_UP, self.target_samples - entry.samples
+
+    # add the counts of the images measured at a setpoint and return its updated entry, with replace the counts
+    # take the place of the cached ones instead of being merged into them (a setpoint measured again on purpose
+    # to follow a drift, averaging with the old counts would hide the drift)
+    def add(self, setpoint, counts, replace=False):
+        key = self.key(setpoint)
+        if replace:
+            self.entries.pop(key, None)
+        entry = self.lookup(setpoint)
+        if entry is None:
+            entry = CachedMeasurement(key)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        entry.add_counts(counts, self.clock())
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "top_ups": self.top_ups,
+            "misses": self.misses,
+            "shots_saved": self.shots_saved,
+            }
+
+    def __len__(self):
+        return len(self.entries)
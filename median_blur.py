@@ -0,0 +1,85 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# pixels on each side of a tile the 5x5 median needs to give the same values as on the whole frame
+# (image_scoring.BLUR_HALO is the same number for its roi crops)
+HALO = 2
+KSIZE = 2 * HALO + 1
+
+
+# the (top, bottom, left, right) tiles covering a frame and the same tiles grown by the halo (clipped to the frame)
+# at the frame's own edges the tile gets no halo, where cv2 replicates the border pixels just as for the whole frame
+def tile_layout(shape, tile_rows, tile_columns=None):
+    height, width = shape[:2]
+    tile_columns = tile_columns or width
+    tiles = []
+    for top in range(0, height, tile_rows):
+        for left in range(0, width, tile_columns):
+            bottom, right = min(top + tile_rows, height), min(left + tile_columns, width)
+            outer = (max(top - HALO, 0), min(bottom + HALO, height), max(left - HALO, 0), min(right + HALO, width))
+            tiles.append(((top, bottom, left, right), outer))
+    return tiles
+
+
+class TiledMedianBlur:
+    # cv2.medianBlur(image, 5) of large frames split into tiles (full width row bands by default) that are blurred
+    # with their halo on a thread pool (OpenCV releases the GIL) and copied into one output frame, bit-identical to
+    # blurring the whole frame (uint8, uint16 and float32 frames, the depths cv2 blurs with a 5x5 kernel)
+    # the output frames are preallocated per calling thread and reused: a result is only valid until the same thread
+    # blurs the next frame (of the same shape) or batch, copy it to keep it
+    def __init__(self, tile_rows=256, tile_columns=None, workers=None, executor=None):
+        if tile_rows < 1 or (tile_columns is not None and tile_columns < 1):
+            raise ValueError("tiles need at least one row and one column")
+        self.tile_rows = tile_rows
+        self.tile_columns = tile_columns
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='blur-tile')
+        self.owns_executor = executor is None
+        self.local = threading.local()
+
+    def _buffers(self):
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        return buffers
+
+    # output frame number `index` of the calling thread for frames of this shape and dtype
+    def output(self, image, index=0):
+        key = (image.shape, image.dtype.str, index)
+        buffers = self._buffers()
+        buffer = buffers.get(key)
+        if buffer is None:
+            buffer = buffers[key] = np.empty(image.shape, dtype=image.dtype)
+        return buffer
+
+    def _blur_tile(self, image, output, tile, outer):
+        import cv2
+
+        top, bottom, left, right = tile
+        outer_top, outer_bottom, outer_left, outer_right = outer
+        blurred = cv2.medianBlur(np.ascontiguousarray(image[outer_top:outer_bottom, outer_left:outer_right]), KSIZE)
+        output[top:bottom, left:right] = blurred[top - outer_top:bottom - outer_top, left - outer_left:right - outer_left]
+
+    def _submit(self, image, output):
+        return [self.executor.submit(self._blur_tile, image, output, tile, outer) for tile, outer in tile_layout(image.shape, self.tile_rows, self.tile_columns)]
+
+    def __call__(self, image, out=None):
+        output = self.output(image) if out is None else out
+        for future in self._submit(image, output):
+            future.result()
+        return output
+
+    # blur several frames in one go, the tiles of every frame share the pool (FrameScorer.score_batch, the benchmarks)
+    def blur_batch(self, images):
+        outputs = [self.output(image, index) for index, image in enumerate(images)]
+        futures = [future for image, output in zip(images, outputs) for future in self._submit(image, output)]
+        for future in futures:
+            future.result()
+        return outputs
+
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown()
@@ -0,0 +1,208 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper edges of the histogram buckets in seconds, four per decade from 1 us to 100 s
+BUCKETS = tuple(1e-6 * 10 ** (index / 4) for index in range(33))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # upper edge of the bucket holding the q quantile
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for edge, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return edge
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    # timing histograms (seconds), counters and gauges of the control loop
+    # `with metrics.span('blur'):` times a stage, when disabled span() hands back a shared do-nothing span
+    # and observe()/increment() return at once, so the instrumentation can stay in the hot path
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # a value read when the metrics are reported (queue depth, frames dropped, ...)
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                gauges[name] = repr(e)
+        return {"uptime": time.monotonic() - self.started, "histograms": histograms, "counters": counters, "gauges": gauges}
+
+    # prometheus text exposition format
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for name, histogram in self.histograms.items():
+                metric = f'betatron_{name}_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for edge, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{edge:.6g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum {histogram.sum:.9g}')
+                lines.append(f'{metric}_count {histogram.count}')
+            for name, value in self.counters.items():
+                lines.append(f'# TYPE betatron_{name}_total counter')
+                lines.append(f'betatron_{name}_total {value}')
+        for name, value in self.snapshot()["gauges"].items():
+            if isinstance(value, (int, float)):
+                lines.append(f'# TYPE betatron_{name} gauge')
+                lines.append(f'betatron_{name} {value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    # serves /metrics (prometheus text) and /metrics.json on a local port from a daemon thread
+    def __init__(self, metrics, host='127.0.0.1', port=9100):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path == '/metrics':
+                    body, content_type = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+                elif handler.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), 'application/json'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *arguments):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLog:
+    # appends a json snapshot of the metrics to a rotating log file every interval seconds
+    def __init__(self, metrics, path, interval=10, max_bytes=10 * 1024 * 1024, backups=3):
+        self.metrics = metrics
+        self.interval = interval
+        self.logger = logging.getLogger(f'betatron.metrics.{id(self)}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        self.logger.addHandler(self.handler)
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-log', daemon=True)
+        self.thread.start()
+
+    def write(self):
+        self.logger.info(json.dumps(dict(self.metrics.snapshot(), time=time.time())))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
@@ -0,0 +1,695 @@
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from image_scoring import FrameScorer
+from control_loop import ControlLoop
+from diagnostics import DiagnosticFusion
+from parameter_optimizer import optimizer_from_settings
+from bayesian_optimizer import bayesian_optimizer_from_settings
+from sensitivity_scan import scan_from_settings
+from drift_tracking import tracker_from_settings
+from history_store import HistoryStore
+from measurement_cache import MeasurementCache, REUSE
+from group_statistics import GroupSizer
+from run_journal import RunJournal, read_journal, measurements
+from metrics import Metrics
+from frame_ring import FrameRingSource, score_ring_frame
+from image_watcher import IMAGE_EXTENSIONS
+from device_state import read_device_states
+
+# the txt files the code adjusts and uploads
+MIRROR_FILE_PATH = r'dm_parameters.txt'
+DISPERSION_FILE_PATH = r'dazzler_parameters.txt'
+
+IMAGE_SOURCES = ('directory', 'ring')
+
+
+class BetatronController:
+    # the optimization loop without any GUI: watches the image directory, scores the images, runs the optimizer
+    # and writes (and uploads) the new setpoints. the Qt application and the headless command line both drive it,
+    # plots or a session publisher hook in through group_listeners, called after every image group
+    # every setting below can be overridden by keyword, e.g. BetatronController(image_group=4, optimizer_mode='bayesian')
+    def __init__(self, **settings):
+
+        # where the images come from: 'directory' watches IMG_PATH for new image files (.tiff, or .npy which are
+        # memory mapped), 'ring' reads raw frames in place from the frame ring file the acquisition software writes
+        self.image_source = 'directory'
+        self.frame_ring_path = r'frames.ring'
+
+        # image path (should match to path specified in SpinView), only files with one of image_extensions are
+        # scored (None for every file), e.g. ('.png',) for the sample images
+        self.IMG_PATH = r'images'
+        self.image_extensions = IMAGE_EXTENSIONS
+        self.mirror_file_path = MIRROR_FILE_PATH
+        self.dispersion_file_path = DISPERSION_FILE_PATH
+
+        # for how many images should the mean be taken for (the least number of accepted images with adaptive groups)
+        self.image_group = 2
+
+        # with adaptive groups a setpoint keeps taking images (up to max_image_group) until the count change of the
+        # step stands out of the shot noise by image_group_significance standard errors, or is known to be smaller
+        # than count_change_tolerance
+        self.adaptive_image_group = True
+        self.max_image_group = 8
+        self.image_group_significance = 2.0
+
+        # misfired shots: images with a count below misfire_count (None for no floor) or further than outlier_sigmas
+        # noise standard deviations from the median of their group are left out of the group's mean
+        self.misfire_count = None
+        self.outlier_sigmas = 4.0
+
+        # counts measured at each setpoint are cached, coming back to a setpoint reuses its count (or tops it up
+        # with the missing images) unless it was measured more than measurement_cache_staleness seconds ago
+        self.use_measurement_cache = True
+        self.measurement_cache_size = 256
+        self.measurement_cache_staleness = 300
+        # an oscillating optimizer keeps coming back to cached setpoints, measure again after this many reuses
+        self.max_cache_reuses = 10
+
+        # how the count is taken from every image (see image_scoring.FrameScorer), e.g. {"roi": 'auto', "binning": 2}
+        # or {"roi": (388, 812, 388, 812), "background": 'background.tiff', "reduction": 'threshold', "threshold": 500}
+        # the default blurs the whole image and takes its mean
+        self.scoring_settings = {}
+
+        # number of threads scoring images in parallel and how many images may wait for them
+        self.scoring_workers = 4
+        self.scoring_queue_size = 64
+
+        # several diagnostics instead of the one image source above, one row per diagnostic with its own source
+        # and path, scoring settings, scoring threads (default scoring_workers) and image extensions (default
+        # image_extensions), e.g.
+        #   {"name": "betatron", "source": 'directory', "path": 'images', "scoring": {"roi": 'auto'}, "weight": 1.0}
+        #   {"name": "spectrometer", "source": 'ring', "path": 'spectrometer.ring', "workers": 2, "weight": 0.5}
+        #   {"name": "profile", "source": 'directory', "path": 'profile', "weight": 0, "minimum": 2000, "penalty": 5}
+        # the frames of a shot are matched by diagnostic_match ('timestamp' within diagnostic_match_tolerance seconds,
+        # or 'shot_id', the last number of the file name / the ring sequence) and every shot counts as one image with
+        # the objective of diagnostics.FusedObjective (weighted counts minus the penalties of the violated ranges)
+        self.diagnostics = None
+        self.diagnostic_match = 'timestamp'
+        self.diagnostic_match_tolerance = 0.005
+
+        # images taken before the devices hold the new setpoint (plus settle_time seconds) are dropped instead of
+        # being counted at the new setpoint, an image's time is its file modification time (the camera's write)
+        self.drop_unsettled_frames = True
+        self.settle_time = 0.0
+
+        # every tracked series lives in a preallocated buffer, set history_max_length to keep only
+        # the newest points in memory and send the older ones to history_spill_directory
+        self.history_max_length = None
+        self.history_spill_directory = r'history'
+
+    # ------------ Deformable mirror and Dazzler ------------ #
+
+        # ftp servers of the mirror and dazzler computers
+        self.device_hosts = {
+            # init -150
+            "mirror": {"host": "192.168.200.3", "user": "Utilisateur", "password": "alls"},
+            "dazzler": {"host": "192.168.58.7", "user": "fastlite", "password": "fastlite"},
+            }
+
+        # send the parameter files to the devices after every step (both devices at once, only the ones that changed)
+        self.upload_to_devices = False
+
+    # ------------ Optimized parameters ------------ #
+
+        # one row per optimized parameter, to optimize another mirror actuator or dazzler order add a row here
+        # the parameter may move 'window' away from its initial value but never past the global bounds,
+        # 'perturbation' is the size of the +- step used by the spsa gradient estimator
+        self.parameter_settings = [
+            # focus: init -150
+            {"name": "focus", "device": "mirror", "key": 0, "window": 20, "lower": -200, "upper": 200, "learning_rate": 5, "perturbation": 2},
+            # second dispersion: 36100 initial
+            {"name": "second_dispersion", "device": "dazzler", "key": 0, "window": 500, "lower": 30000, "upper": 40000, "learning_rate": 5, "perturbation": 50},
+            # third dispersion: -27000 initial
+            {"name": "third_dispersion", "device": "dazzler", "key": 1, "window": 2000, "lower": -30000, "upper": -25000, "learning_rate": 5, "perturbation": 200},
+        ]
+
+        # start from these values ({name: value}, e.g. the best basin found by population_search.py) instead of
+        # the values in the parameter files, the windows are centered on them
+        self.initial_setpoint = None
+
+        self.count_change_tolerance = 10
+        self.momentum = 0.999
+
+        # 'difference' takes one image group per step, 'spsa' takes two image groups per step
+        # but estimates the gradient of every parameter correctly however many parameters there are
+        self.gradient_estimator = 'difference'
+
+        # how the momentum optimizer turns the gradient into a step: 'momentum' (heavy ball) and 'nesterov' use the
+        # learning rates of the parameter settings, 'rmsprop' and 'adam' scale every parameter by its own gradient
+        # and move it about 'step_size' per step (a tenth of its window when the row has no step_size), so the
+        # parameters need no hand-tuned learning rates, learning_rate_schedule ('constant', 'exponential',
+        # 'inverse_time') shrinks the rates by learning_rate_decay per update
+        self.update_rule = 'momentum'
+        self.learning_rate_schedule = 'constant'
+        self.learning_rate_decay = 0.01
+
+        # 'momentum' is the momentum gradient ascent, 'bayesian' fits a gaussian process to every measured group
+        # and proposes the next setpoint from it (bayesian_batch_size setpoints per proposal), 'scan' first measures
+        # a design of setpoints in the windows ('sweeps', 'latin_hypercube' or 'grid' with scan_points values per
+        # parameter, scan_repeats image groups each, in the order that moves the devices least), fits a quadratic
+        # and starts the momentum ascent at its peak with learning rates of scan_learning_rate_fraction newton steps
+        self.optimizer_mode = 'momentum'
+        self.bayesian_batch_size = 1
+        self.scan_design = 'sweeps'
+        self.scan_points = 5
+        self.scan_repeats = 1
+        self.scan_learning_rate_fraction = 0.5
+
+        # 'tracking' never stops: it measures every group at the peak estimate plus a random dither of each
+        # parameter's perturbation, fits the gradient over the last tracking_window groups and switches to smaller
+        # steps and dither once the gradient is lost in the noise for tracking_patience groups (back when the
+        # gradient comes back or the count drops), the history keeps only the newest tracking_history_length groups
+        # in memory (unless history_max_length is set), the measurement cache is off since the dither keeps coming
+        # back to the same setpoints and reused counts would hide the drift from the fitted gradient
+        self.tracking_window = 12
+        self.tracking_gain = 0.25
+        self.tracking_patience = 5
+        self.tracking_history_length = 20000
+
+        # seed of the optimizer's random generator (first direction, spsa perturbations), None picks a new one
+        self.seed = None
+
+        # every image group, gradient and setpoint is appended to a journal in journal_directory (synced to disk
+        # after every step), resume_journal continues the run of that journal with the optimizer state it ended with
+        self.use_journal = True
+        self.journal_directory = r'journal'
+        self.resume_journal = None
+
+        # timing of every stage of the control loop (from the file event to the plots), shot to setpoint latency and
+        # counters, served on http://metrics_host:metrics_port/metrics and appended to metrics_log every
+        # metrics_log_interval seconds, while disabled every stage costs a single check
+        self.metrics_enabled = False
+        self.metrics_host = '127.0.0.1'
+        self.metrics_port = 9100
+        self.metrics_log = r'metrics.log'
+        self.metrics_log_interval = 10
+
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise TypeError(f"unknown setting {name!r}")
+            setattr(self, name, value)
+
+        self.setup()
+
+    # build everything from the settings, the parameter files are only read here (not at import time)
+    def setup(self):
+        self.mean_count_per_image_group  = 0
+        self.image_groups_dir_run_count = 0
+
+        # keep track of number of processed images and image groups
+        self.image_groups_processed = 0
+        self.images_processed = 0
+
+        # the images taken at the current setpoint and how many accepted images the current setpoint needs at least
+        self.group_sizer = GroupSizer(
+            min_shots=self.image_group,
+            max_shots=self.max_image_group,
+            adaptive=self.adaptive_image_group,
+            significance=self.image_group_significance,
+            tolerance=self.count_change_tolerance,
+            misfire_count=self.misfire_count,
+            outlier_sigmas=self.outlier_sigmas,
+            )
+        self.images_needed = self.image_group
+
+        self.measurement_cache = MeasurementCache(target_samples=self.image_group, max_entries=self.measurement_cache_size, staleness=self.measurement_cache_staleness)
+
+        # called with the controller after every image group (plots, session publisher, ...)
+        self.group_listeners = []
+
+        # where each device keeps its values (mirror actuators by position, dazzler orders by key)
+        self.devices = read_device_states(self.mirror_file_path, self.dispersion_file_path)
+
+        self.parameter_names = [setting["name"] for setting in self.parameter_settings]
+        self.initial_values = np.array([self.devices.value(setting) for setting in self.parameter_settings])
+        if self.initial_setpoint is not None:
+            unknown = set(self.initial_setpoint) - set(self.parameter_names)
+            if unknown:
+                raise ValueError(f"initial setpoint has values for {', '.join(sorted(unknown))}, which are not optimized")
+            self.initial_values = np.array([self.initial_setpoint.get(name, value) for name, value in zip(self.parameter_names, self.initial_values)])
+
+        # a resumed run starts from the settings, initial values and seed of its journal so the optimizer
+        # goes through the same states again when the journal's counts are replayed into it
+        journal_records = None
+        if self.resume_journal is not None:
+            header, journal_records = read_journal(self.resume_journal)
+            if header["parameter_names"] != self.parameter_names:
+                raise ValueError(f"journal {self.resume_journal} optimizes {', '.join(header['parameter_names'])}, not {', '.join(self.parameter_names)}")
+            self.parameter_settings = header["parameter_settings"]
+            self.initial_values = np.array(header["initial_values"], dtype=float)
+            self.optimizer_mode = header["optimizer_mode"]
+            self.seed = header["seed"]
+            for name, value in header["optimizer_settings"].items():
+                setattr(self, name, value)
+
+        if self.seed is None:
+            self.seed = np.random.SeedSequence().entropy
+        rng = np.random.default_rng(self.seed)
+
+        # the optimizer clips every parameter to its local window and global bounds, a value outside the global
+        # bounds starts from the nearest bound
+        for setting, value in zip(self.parameter_settings, self.initial_values):
+            if not setting.get("lower", -np.inf) <= value <= setting.get("upper", np.inf):
+                print(f"Initial {setting['name']} {int(value)} is outside its bounds [{setting.get('lower')}, {setting.get('upper')}], starting from the nearest bound")
+        if self.optimizer_mode == 'bayesian':
+            self.optimizer = bayesian_optimizer_from_settings(
+                self.parameter_settings,
+                self.initial_values,
+                batch_size=self.bayesian_batch_size,
+                count_change_tolerance=self.count_change_tolerance,
+                rng=rng,
+            )
+        elif self.optimizer_mode == 'scan':
+            self.optimizer = scan_from_settings(
+                self.parameter_settings,
+                self.initial_values,
+                design=self.scan_design,
+                points=self.scan_points,
+                repeats=self.scan_repeats,
+                learning_rate_fraction=self.scan_learning_rate_fraction,
+                momentum=self.momentum,
+                count_change_tolerance=self.count_change_tolerance,
+                gradient_estimator=self.gradient_estimator,
+                update_rule=self.update_rule,
+                learning_rate_schedule=self.learning_rate_schedule,
+                learning_rate_decay=self.learning_rate_decay,
+                rng=rng,
+            )
+            self.scan_reported = False
+        elif self.optimizer_mode == 'tracking':
+            self.optimizer = tracker_from_settings(
+                self.parameter_settings,
+                self.initial_values,
+                window=self.tracking_window,
+                tracking_gain=self.tracking_gain,
+                patience=self.tracking_patience,
+                rng=rng,
+            )
+            if self.history_max_length is None:
+                self.history_max_length = self.tracking_history_length
+            self.use_measurement_cache = False
+        else:
+            self.optimizer = optimizer_from_settings(
+                self.parameter_settings,
+                self.initial_values,
+                momentum=self.momentum,
+                count_change_tolerance=self.count_change_tolerance,
+                gradient_estimator=self.gradient_estimator,
+                update_rule=self.update_rule,
+                learning_rate_schedule=self.learning_rate_schedule,
+                learning_rate_decay=self.learning_rate_decay,
+                rng=rng,
+            )
+
+        # initialize lists to keep track of optimization process
+        self.history = HistoryStore(max_length=self.history_max_length, spill_directory=self.history_spill_directory)
+        self.history.add_series('count')
+        self.history.add_series('iteration')
+        self.history.add_series('total_gradient')
+        self.history.add_series('gradient_iteration')
+
+        # one row per image group with the setpoint it was measured at (and one row per estimated gradient)
+        self.history.add_series('parameters', width=self.optimizer.size)
+        self.history.add_series('gradient', width=self.optimizer.size)
+
+        self.journal = None
+        self.image_trackers = {}
+        if journal_records is not None:
+            self.replay_journal(journal_records)
+
+        for source in self.image_sources():
+            if source["source"] not in IMAGE_SOURCES:
+                raise ValueError(f"unknown image source {source['source']!r}, expected one of {', '.join(IMAGE_SOURCES)}")
+
+        self.metrics = Metrics(enabled=self.metrics_enabled)
+        self.metrics_server = None
+        self.metrics_writer = None
+        self.group_times = deque(maxlen=100)
+        self.group_first_shot = None
+
+        # ingest, score, decide, actuate and publish stages on one event loop (see control_loop.py),
+        # the counts are decided in the order the images arrived (every diagnostic scored on its own threads)
+        score_functions = {}
+        workers = {}
+        for source in self.image_sources():
+            score_function = FrameScorer(metrics=self.metrics, **source["scoring"])
+            score_functions[source["name"]] = score_ring_frame(score_function) if source["source"] == 'ring' else score_function
+            workers[source["name"]] = source["workers"]
+        self.fusion = None
+        decide = self.process_image_count
+        if self.diagnostics:
+            self.fusion = DiagnosticFusion(self.diagnostics, self.process_image_count, self.diagnostic_match, self.diagnostic_match_tolerance)
+            decide = self.fusion.decide
+        self.score_function = score_functions if self.diagnostics else score_functions[None]
+        self.control_loop = ControlLoop(
+            self.score_function,
+            decide=decide,
+            actuate=self.apply_setpoint,
+            publish=self.publish_group,
+            workers=workers,
+            max_queue_size=self.scoring_queue_size,
+            drop_unsettled_frames=self.drop_unsettled_frames,
+            settle_time=self.settle_time,
+            metrics=self.metrics,
+            )
+
+        # ftplib is only loaded when the devices are actually used
+        self.device_transport = None
+        if self.upload_to_devices:
+            from device_transport import DeviceTransport, FTPDeviceConnection
+            self.device_transport = DeviceTransport({name: FTPDeviceConnection(name, **host) for name, host in self.device_hosts.items()})
+
+        # the watchdog observer of the image directory or the poller of the frame ring
+        self.frame_sources = []
+
+    # everything needed to rebuild the optimizer of this run from its journal
+    def journal_header(self):
+        return {
+            "parameter_names": self.parameter_names,
+            "parameter_settings": self.parameter_settings,
+            "initial_values": self.initial_values.tolist(),
+            "optimizer_mode": self.optimizer_mode,
+            "optimizer_settings": {
+                "gradient_estimator": self.gradient_estimator,
+                "momentum": self.momentum,
+                "update_rule": self.update_rule,
+                "learning_rate_schedule": self.learning_rate_schedule,
+                "learning_rate_decay": self.learning_rate_decay,
+                "count_change_tolerance": self.count_change_tolerance,
+                "bayesian_batch_size": self.bayesian_batch_size,
+                "scan_design": self.scan_design,
+                "scan_points": self.scan_points,
+                "scan_repeats": self.scan_repeats,
+                "scan_learning_rate_fraction": self.scan_learning_rate_fraction,
+                "tracking_window": self.tracking_window,
+                "tracking_gain": self.tracking_gain,
+                "tracking_patience": self.tracking_patience,
+                },
+            "seed": self.seed,
+            "created": time.time(),
+            }
+
+    # bring the history and the optimizer (momentum, first direction, spsa phase, ...) to the end of a journal,
+    # the counts go through the optimizer again, which is much faster than the run that measured them
+    def replay_journal(self, records):
+        for record in measurements(records):
+            if not np.array_equal(self.optimizer.setpoint, record['values']):
+                raise ValueError(f"journal {self.resume_journal} does not match the optimizer at image group {record['iteration']}")
+
+            self.history.append('count', record['value'])
+            self.history.append('parameters', record['values'])
+            self.image_groups_processed += 1
+            self.history.append('iteration', self.image_groups_processed)
+
+            self.optimizer.tell(record['value'])
+            if self.optimizer.updated:
+                self.image_groups_dir_run_count += 1
+                self.history.append('gradient', self.optimizer.gradient)
+                self.history.append('total_gradient', self.optimizer.gradient.sum())
+                self.history.append('gradient_iteration', self.image_groups_dir_run_count)
+
+            self.group_sizer.set_previous(record['value'], max(int(record['shots']), 1))
+
+        print(f"Resumed {self.image_groups_processed} image groups from {self.resume_journal}, current values are: {self.format_parameters(self.optimizer.setpoint)}")
+
+    # start scoring and watching the image source
+    def start(self):
+        written = []
+        if self.resume_journal is not None:
+            self.journal = RunJournal.append_to(self.resume_journal)
+            # the devices go back to where the journal left them
+            written = self.record_values()
+        else:
+            if self.use_journal:
+                journal_path = os.path.join(self.journal_directory, time.strftime('run-%Y%m%d-%H%M%S.journal'))
+                self.journal = RunJournal.create(journal_path, self.journal_header())
+                print(f"Writing the run journal to {journal_path}")
+            # the first group is measured at the seeded setpoint, not at the values in the parameter files
+            if self.initial_setpoint is not None:
+                written = self.record_values()
+
+        if self.metrics_enabled:
+            from metrics import MetricsServer, MetricsLog
+
+            self.register_gauges()
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_host, self.metrics_port)
+            self.metrics_writer = MetricsLog(self.metrics, self.metrics_log, self.metrics_log_interval)
+            print(f"Serving metrics on http://{self.metrics_server.address[0]}:{self.metrics_server.address[1]}/metrics")
+
+        self.control_loop.start()
+        if written:
+            self.control_loop.setpoint_applied()
+
+        # setup tracking for new images, a watcher (or frame ring poller) per source
+        for source in self.image_sources():
+            name = source["name"]
+            if source["source"] == 'ring':
+                print(f"Waiting for frames{'' if name is None else f' of {name}'} ...")
+                frame_source = FrameRingSource(source["path"], lambda frames, name=name: self.process_frames(frames, name))
+                frame_source.start()
+            else:
+                from image_watcher import watch_directory, ImageTracker
+
+                print(f"Waiting for images{'' if name is None else f' of {name}'} ...")
+                self.image_trackers[name] = ImageTracker(source["path"])
+                frame_source = watch_directory(source["path"], lambda new_images, name=name: self.process_images(new_images, name), source["extensions"])
+            self.frame_sources.append(frame_source)
+
+    # the image sources as rows of diagnostics, the one source of image_source (named None) without diagnostics
+    def image_sources(self):
+        if not self.diagnostics:
+            path = self.frame_ring_path if self.image_source == 'ring' else self.IMG_PATH
+            return [{"name": None, "source": self.image_source, "path": path, "scoring": self.scoring_settings, "workers": self.scoring_workers,
+                     "extensions": self.image_extensions}]
+        return [
+            {"name": diagnostic["name"], "source": diagnostic.get("source", 'directory'), "path": diagnostic["path"], "scoring": diagnostic.get("scoring", {}),
+             "workers": diagnostic.get("workers", self.scoring_workers), "extensions": diagnostic.get("extensions", self.image_extensions)}
+            for diagnostic in self.diagnostics
+            ]
+
+    def register_gauges(self):
+        pipeline = self.control_loop
+        self.metrics.gauge('queue_depth', lambda: pipeline.queue_depth)
+        self.metrics.gauge('frames_per_second', lambda: pipeline.frames_per_second)
+        self.metrics.gauge('frames_failed', lambda: pipeline.frames_failed)
+        # frames the scoring queue had no room for and frames the frame ring overwrote before they were read
+        self.metrics.gauge('frames_dropped', lambda: pipeline.frames_dropped + sum(getattr(frame_source, 'frames_dropped', 0) for frame_source in self.frame_sources))
+        self.metrics.gauge('frames_unsettled', lambda: pipeline.frames_unsettled)
+        if self.fusion is not None:
+            self.metrics.gauge('frames_unmatched', lambda: self.fusion.matcher.frames_unmatched)
+        self.metrics.gauge('groups_per_minute', self.groups_per_minute)
+        self.metrics.gauge('images_per_group', lambda: self.group_sizer.stats()["shots_per_group"])
+
+    def groups_per_minute(self):
+        now = time.monotonic()
+        return sum(1 for group_time in self.group_times if now - group_time <= 60)
+
+    # method used to send the new values to the mirror and dazzler computers via FTP
+    def upload_files(self):
+        results = self.device_transport.upload(self.devices.files())
+
+        for device, result in results.items():
+            if isinstance(result, Exception):
+                print(f"Error in FTP upload to {device}: {result}")
+            elif result == 'uploaded':
+                print(f"Uploaded to {device} FTP: {self.device_transport.stats()[device]['last_latency_ms']:.1f} ms")
+
+    # write the (already clipped and rounded) setpoint into the parameter files, once per step and only the
+    # files whose values changed
+    def record_values(self):
+        self.devices.set_setpoint(self.parameter_settings, self.optimizer.setpoint)
+        return self.devices.write()
+
+    # publish stage: tell the listeners (plots, session publisher) that a group was processed, called by the
+    # control loop on its publish thread (groups finished while the listeners were busy come in one call)
+    def publish_group(self):
+        with self.metrics.span('publish'):
+            for listener in self.group_listeners:
+                try:
+                    listener(self)
+                except Exception as e:
+                    print(f"Error in group listener {listener}: {e}")
+
+    def optimize_count(self):
+        # estimates the gradient and takes the step
+        with self.metrics.span('optimize'):
+            self.optimizer.tell(self.history['count'][-1])
+
+        # the scan just measured its last setpoint
+        if self.optimizer_mode == 'scan' and self.optimizer.fit is not None and not self.scan_reported:
+            self.scan_reported = True
+            print(self.optimizer.summary())
+
+        # the first group only sets the random direction, and spsa updates once per plus/minus pair
+        # (the bayesian optimizer refits after every group)
+        if not self.optimizer.updated:
+            return
+
+        self.image_groups_dir_run_count += 1
+        self.history.append('gradient', self.optimizer.gradient)
+        if self.journal is not None:
+            self.journal.append_gradient(self.image_groups_dir_run_count, self.optimizer.gradient)
+
+        self.total_gradient = self.optimizer.gradient.sum()
+        self.history.append('total_gradient', self.total_gradient)
+        self.history.append('gradient_iteration', self.image_groups_dir_run_count)
+
+        # a tracking run only reports when it finds or loses the peak
+        if self.optimizer_mode == 'tracking':
+            if self.optimizer.state_changed:
+                print(f"{'Tracking the peak' if self.optimizer.state == 'track' else 'Lost the peak, converging again'} at {self.format_parameters(self.optimizer.values)}")
+            return
+
+        # if the change in all variables is less than one (we can not take smaller steps thus this is the optimization boundry)
+        # or if the count is not changing much this means that we are near the peak
+        if self.optimizer.is_converged:
+            print("Convergence achieved")
+
+        # stop optimizing parameter if we reached optimization resolution limit
+        elif self.optimizer.converged.any():
+            print(f"Convergence achieved in {', '.join(self.optimizer.converged_names())}")
+
+    # called from the watchdog thread, only hands the images to the control loop so the observer is never blocked by scoring
+    # (blocks while the control loop has no room for them), source is the name of the diagnostic the images are from
+    def process_images(self, new_images, source=None):
+        with self.metrics.span('file_event'):
+            new_images = self.image_trackers[source].new_images(new_images)
+
+        for image_path in new_images:
+            self.control_loop.submit(image_path, source)
+
+    # called from the frame ring poller with the frames written since its last call, they are complete and in order
+    def process_frames(self, frames, source=None):
+        for frame in frames:
+            self.control_loop.submit(frame, source)
+
+    # decide stage: called by the control loop with the count of every image, in the order the images arrived,
+    # returns True when the group is complete and the optimizer moved to a new setpoint
+    def process_image_count(self, image_path, img_mean_count):
+        # keep track of the times the program ran (number of images we processed)
+        self.images_processed += 1
+        self.metrics.increment('images')
+        if self.group_sizer.group.shots == 0:
+            self.group_first_shot = self.control_loop.submitted_at
+
+        # conditional to check if the group has enough images (misfires are left out of its statistics)
+        with self.metrics.span('group'):
+            if not self.group_sizer.add(img_mean_count, self.images_needed):
+                return False
+            group = self.group_sizer.finish()
+        self.metrics.increment('images_rejected', group.rejected)
+
+        if not group.samples:
+            print(f"All {group.shots} images at {self.format_parameters(self.optimizer.setpoint)} were rejected, measuring again")
+            return False
+        print(f"Took {group.shots} images ({group.rejected} rejected), standard error {group.standard_error:.2f}")
+
+        # take the mean count for the images of the group (together with the cached images of this setpoint),
+        # a setpoint that did not move since the last group was measured again to follow a drift and replaces its cached count
+        if self.use_measurement_cache:
+            unmoved = len(self.history['parameters']) > 0 and np.array_equal(self.optimizer.setpoint, self.history['parameters'][-1])
+            self.mean_count_per_image_group = self.measurement_cache.add(self.optimizer.setpoint, group.accepted_counts, replace=unmoved).mean
+        else:
+            self.mean_count_per_image_group = group.mean
+
+        self.complete_image_group(self.mean_count_per_image_group, shots=group.shots, standard_error=group.standard_error)
+
+        # skip the setpoints the cache already knows, without sending them to the devices
+        self.images_needed = self.image_group
+        for _ in range(self.max_cache_reuses if self.use_measurement_cache else 0):
+            # a setpoint that did not move (converged or clipped at a bound) is measured again to follow drifts
+            if np.array_equal(self.optimizer.setpoint, self.history['parameters'][-1]):
+                break
+            action, cached = self.measurement_cache.policy(self.optimizer.setpoint)
+            if action != REUSE:
+                self.images_needed = cached
+                break
+            print(f"Reusing cached count of {cached.samples} images at {self.format_parameters(self.optimizer.setpoint)}")
+            self.group_sizer.set_previous(cached.mean, cached.samples)
+            self.complete_image_group(cached.mean)
+
+        # print the current parameter values which will be measured next
+        print(f"Current values are: {self.format_parameters(self.optimizer.setpoint)}")
+
+        # print how far behind the scoring is (helps track the camera rate)
+        print(f"Scoring queue depth: {self.control_loop.queue_depth}, frames per second: {self.control_loop.frames_per_second:.1f}, frames dropped before the setpoint settled: {self.control_loop.frames_unsettled}")
+        print(f"Image groups: {self.group_sizer.stats()}")
+        if self.use_measurement_cache:
+            print(f"Measurement cache: {self.measurement_cache.stats()}, images needed at the next setpoint: {self.images_needed}")
+
+        print('-------------')
+        return True
+
+    # actuate stage: called by the control loop on its actuation thread once the optimizer moved
+    def apply_setpoint(self):
+        # adjust the values to the clipped bounderies
+        with self.metrics.span('file_write'):
+            written = self.record_values()
+        self.metrics.increment('file_writes', len(written))
+
+        # the step is on disk before the devices move
+        if self.journal is not None:
+            with self.metrics.span('journal'):
+                self.journal.sync()
+
+        # after the algorithm adjusted the value and wrote it to the txt, send new txt to deformable mirror computer
+        if self.upload_to_devices:
+            with self.metrics.span('upload'):
+                self.upload_files()
+
+        # from the first image of the group arriving to the next setpoint being on the devices
+        if self.group_first_shot is not None:
+            self.metrics.observe('shot_to_setpoint', time.perf_counter() - self.group_first_shot)
+        self.group_times.append(time.monotonic())
+        self.metrics.increment('image_groups')
+
+    # record the count of the current setpoint and let the optimizer pick the next setpoint
+    # (shots is 0 for a count reused from the measurement cache)
+    def complete_image_group(self, mean_count, shots=0, standard_error=np.nan):
+        # append to the count history to keep track of count through the optimization process
+        self.history.append('count', mean_count)
+        self.history.append('parameters', self.optimizer.setpoint)
+
+        # update count for 'images_group' processed (number of image groups processed)
+        self.image_groups_processed += 1
+        self.history.append('iteration', self.image_groups_processed)
+        if self.journal is not None:
+            self.journal.append_measurement(self.image_groups_processed, mean_count, self.optimizer.setpoint, shots, standard_error)
+
+        # if we are in the first time where the algorithm needs to adjust the value
+        if self.image_groups_processed == 1:
+            print('-------------')
+
+            # print to help track the evolution of the system
+            print(f"initial values are: {self.format_parameters(self.optimizer.values)}")
+            if self.optimizer_mode == 'momentum' and self.gradient_estimator == 'difference':
+                print(f"initial directions are: {self.format_parameters(self.optimizer.random_direction)}")
+
+        # print the latest mean count (helps track system)
+        print(f"Mean count at {self.format_parameters(self.optimizer.setpoint)}: {mean_count:.2f}")
+
+        # hand the group's count to the optimizer, which picks the next setpoint
+        self.optimize_count()
+
+    def format_parameters(self, values):
+        return ', '.join(f"{name} {int(value)}" for name, value in zip(self.parameter_names, values))
+
+    # stop the image sources and let the scoring workers finish the queued images
+    def shutdown(self):
+        for frame_source in self.frame_sources:
+            frame_source.stop()
+            frame_source.join()
+        self.frame_sources = []
+        self.control_loop.stop()
+        self.history.close()
+        if self.device_transport is not None:
+            self.device_transport.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_writer.close()
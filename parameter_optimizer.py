@@ -0,0 +1,302 @@
+import numpy as np
+
+GRADIENT_ESTIMATORS = ('difference', 'spsa')
+
+
+# the values have to be rounded and clipped due to physical constraints (shared by every optimizer and search)
+def clip_setpoint(values, lower_bounds, upper_bounds):
+    return np.rint(np.clip(np.asarray(values, dtype=float), lower_bounds, upper_bounds))
+
+
+class SPSAGradientEstimator:
+    # simultaneous perturbation: every parameter is moved at once by +-perturbation along a random sign vector,
+    # the plus and minus measurement groups give an estimate of the whole gradient whatever the number of parameters
+    def __init__(self, size, perturbation=1, rng=None):
+        self.size = size
+        self.perturbation = np.array(np.broadcast_to(np.asarray(perturbation, dtype=float), (size,)))
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.direction = np.ones(size)
+        self.new_direction()
+
+    def new_direction(self):
+        self.direction = self.rng.choice([-1.0, 1.0], size=self.size)
+        return self.direction
+
+    # the two setpoints to measure around center (clip keeps them rounded and inside the bounds)
+    def setpoints(self, center, clip):
+        step = self.perturbation * self.direction
+        return clip(center + step), clip(center - step)
+
+    def estimate(self, plus_count, minus_count, plus_setpoint, minus_setpoint):
+        # use the displacement that was actually applied, clipping at a bound can shorten (or remove) it
+        displacement = plus_setpoint - minus_setpoint
+        gradient = np.zeros(self.size)
+        np.divide(plus_count - minus_count, displacement, out=gradient, where=displacement != 0)
+        return gradient
+
+
+class MomentumRule:
+    # heavy ball: the last move (as it was taken, after clipping and rounding) carried over plus the gradient step
+    def __init__(self, learning_rates, momentum):
+        self.learning_rates = learning_rates
+        self.momentum = momentum
+
+    def change(self, gradient, last_move, scale):
+        return self.momentum * last_move + scale * self.learning_rates * gradient
+
+
+class NesterovRule(MomentumRule):
+    # nesterov momentum in the form that needs no measurement at the look-ahead point:
+    # the gradient step is applied to the carried over move and once more to the result
+    def change(self, gradient, last_move, scale):
+        velocity = self.momentum * last_move + scale * self.learning_rates * gradient
+        return self.momentum * velocity + scale * self.learning_rates * gradient
+
+
+class RMSPropRule:
+    # the gradient of every parameter is divided by its running root mean square, so every parameter moves about
+    # step_sizes (in its own units) per step however steep the count is along it, plus the heavy ball momentum
+    def __init__(self, step_sizes, momentum, decay=0.9, epsilon=1e-8):
+        self.step_sizes = step_sizes
+        self.momentum = momentum
+        self.decay = decay
+        self.epsilon = epsilon
+        self.mean_square = np.zeros(len(step_sizes))
+        self.steps = 0
+
+    def change(self, gradient, last_move, scale):
+        self.steps += 1
+        self.mean_square = self.decay * self.mean_square + (1 - self.decay) * gradient ** 2
+        # without the bias correction the first steps would be far too large
+        root_mean_square = np.sqrt(self.mean_square / (1 - self.decay ** self.steps))
+        return self.momentum * last_move + scale * self.step_sizes * gradient / (root_mean_square + self.epsilon)
+
+
+class AdamRule:
+    # running mean of the gradient (the momentum) over its running root mean square, bias corrected,
+    # the step of every parameter is at most about step_sizes and shrinks where the gradient keeps changing sign
+    def __init__(self, step_sizes, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        self.step_sizes = step_sizes
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.mean = np.zeros(len(step_sizes))
+        self.mean_square = np.zeros(len(step_sizes))
+        self.steps = 0
+
+    def change(self, gradient, last_move, scale):
+        self.steps += 1
+        self.mean = self.beta1 * self.mean + (1 - self.beta1) * gradient
+        self.mean_square = self.beta2 * self.mean_square + (1 - self.beta2) * gradient ** 2
+        mean = self.mean / (1 - self.beta1 ** self.steps)
+        root_mean_square = np.sqrt(self.mean_square / (1 - self.beta2 ** self.steps))
+        return scale * self.step_sizes * mean / (root_mean_square + self.epsilon)
+
+
+UPDATE_RULES = ('momentum', 'nesterov', 'rmsprop', 'adam')
+LEARNING_RATE_SCHEDULES = ('constant', 'exponential', 'inverse_time')
+
+
+def make_update_rule(name, learning_rates, step_sizes, momentum):
+    if name == 'momentum':
+        return MomentumRule(learning_rates, momentum)
+    if name == 'nesterov':
+        return NesterovRule(learning_rates, momentum)
+    if name == 'rmsprop':
+        return RMSPropRule(step_sizes, momentum)
+    if name == 'adam':
+        return AdamRule(step_sizes)
+    raise ValueError(f"unknown update rule {name!r}, expected one of {UPDATE_RULES}")
+
+
+# factor on the learning rates (step sizes) after `updates` updates
+def schedule_factor(schedule, decay, updates):
+    if schedule == 'constant':
+        return 1.0
+    if schedule == 'exponential':
+        return (1 - decay) ** updates
+    if schedule == 'inverse_time':
+        return 1 / (1 + decay * updates)
+    raise ValueError(f"unknown learning rate schedule {schedule!r}, expected one of {LEARNING_RATE_SCHEDULES}")
+
+
+class ParameterOptimizer:
+    # momentum gradient ascent on a vector of integer parameters (mirror actuators, dazzler orders, ...)
+    # every setting is a numpy array with one entry per parameter so adding a parameter costs no extra code
+    # gradient_estimator 'difference' divides the count change of the last step by each parameter's own step (one group per step),
+    # 'spsa' measures a plus and a minus perturbation of all parameters at once (two groups per step)
+    # update_rule turns the gradient into the step: 'momentum' (heavy ball) and 'nesterov' scale it by learning_rates,
+    # 'rmsprop' and 'adam' normalize it per parameter and take steps of about step_sizes (by default a twentieth of
+    # each parameter's bounds), or any object with a change(gradient, last_move, scale) method
+    # the learning rates / step sizes decay with learning_rate_schedule ('constant', 'exponential', 'inverse_time')
+    def __init__(self, names, initial_values, lower_bounds, upper_bounds, learning_rates, momentum=0.999, count_change_tolerance=10, gradient_estimator='difference', perturbation=1,
+                 update_rule='momentum', step_sizes=None, learning_rate_schedule='constant', learning_rate_decay=0.01, rng=None):
+        self.names = list(names)
+        self.size = len(self.names)
+
+        self.lower_bounds = self._as_vector(lower_bounds)
+        self.upper_bounds = self._as_vector(upper_bounds)
+        self.learning_rates = self._as_vector(learning_rates)
+        self.momentum = self._as_vector(momentum)
+        self.count_change_tolerance = count_change_tolerance
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        if gradient_estimator not in GRADIENT_ESTIMATORS:
+            raise ValueError(f"unknown gradient estimator {gradient_estimator!r}, expected one of {GRADIENT_ESTIMATORS}")
+        self.gradient_estimator = gradient_estimator
+
+        empty_windows = [name for name, lower, upper in zip(self.names, self.lower_bounds, self.upper_bounds) if lower > upper]
+        if empty_windows:
+            raise ValueError(f"lower bound is above upper bound for: {', '.join(empty_windows)}")
+
+        if step_sizes is None:
+            bounds_range = self.upper_bounds - self.lower_bounds
+            step_sizes = np.where(np.isfinite(bounds_range), bounds_range / 20, self.learning_rates)
+        self.step_sizes = self._as_vector(step_sizes)
+        if isinstance(update_rule, str):
+            update_rule = make_update_rule(update_rule, self.learning_rates, self.step_sizes, self.momentum)
+        self.update_rule = update_rule
+
+        schedule_factor(learning_rate_schedule, learning_rate_decay, 0)
+        self.learning_rate_schedule = learning_rate_schedule
+        self.learning_rate_decay = learning_rate_decay
+        self.updates = 0
+
+        # current setpoint and the setpoint each parameter held before its last move
+        self.values = self.clip(initial_values)
+        self.previous_values = self.values.copy()
+
+        # results of the last update
+        self.gradient = np.zeros(self.size)
+        self.change = np.zeros(self.size)
+        self.converged = np.zeros(self.size, dtype=bool)
+        self.count_converged = False
+
+        # the setpoint the devices should hold for the next measurement group
+        self.setpoint = self.values.copy()
+        self.updated = False
+        self.last_count = None
+
+        # random direction of the first step in difference mode
+        self.random_direction = self.rng.choice([-1.0, 1.0], size=self.size)
+
+        self.spsa = None
+        self.spsa_phase = None
+        if self.gradient_estimator == 'spsa':
+            self.spsa = SPSAGradientEstimator(self.size, perturbation, self.rng)
+            self.spsa_phase = 'center'
+            self.plus_setpoint = self.minus_setpoint = self.values
+            self.plus_count = None
+
+    def _as_vector(self, value):
+        vector = np.array(np.broadcast_to(np.asarray(value, dtype=float), (self.size,)))
+        return vector
+
+    # the values have to be rounded and clipped due to physical constraints
+    def clip(self, values):
+        return clip_setpoint(values, self.lower_bounds, self.upper_bounds)
+
+    # move every parameter by the given step (used for the first random direction)
+    def take_step(self, step):
+        new_values = self.clip(self.values + np.asarray(step, dtype=float))
+        self.previous_values = self.values
+        self.values = new_values
+        return self.values
+
+    # estimate the partial derivatives from the count change caused by the last move of each parameter
+    def calc_gradient(self, count_change):
+        displacement = self.values - self.previous_values
+        gradient = np.zeros(self.size)
+        np.divide(count_change, displacement, out=gradient, where=displacement != 0)
+        return gradient
+
+    # one step of the update rule for all parameters, count_change is the change in mean count caused by the last step
+    def update(self, count_change, gradient=None):
+        self.gradient = self.calc_gradient(count_change) if gradient is None else np.asarray(gradient, dtype=float)
+
+        scale = schedule_factor(self.learning_rate_schedule, self.learning_rate_decay, self.updates)
+        self.change = self.update_rule.change(self.gradient, self.values - self.previous_values, scale)
+        self.updates += 1
+
+        # we can not take steps smaller than one, a parameter that wants to move less has converged
+        moving = np.abs(self.change) > 1
+        new_values = self.clip(self.values + self.change)
+
+        self.previous_values = np.where(moving, self.values, self.previous_values)
+        self.values = np.where(moving, new_values, self.values)
+
+        self.converged = ~moving
+        # if the count is not changing much this means that we are near the peak
+        self.count_converged = bool(np.abs(count_change) <= self.count_change_tolerance)
+
+        return self.values
+
+    # hand in the mean count measured at self.setpoint, returns the setpoint to measure next
+    def tell(self, count):
+        self.updated = False
+
+        if self.gradient_estimator == 'difference':
+            if self.last_count is None:
+                # take random direction for each of the variables
+                self.take_step(self.random_direction)
+            else:
+                self.update(count - self.last_count)
+                self.updated = True
+            self.setpoint = self.values.copy()
+
+        elif self.spsa_phase == 'plus':
+            self.plus_count = count
+            self.spsa_phase = 'minus'
+            self.setpoint = self.minus_setpoint
+
+        else:
+            if self.spsa_phase == 'minus':
+                gradient = self.spsa.estimate(self.plus_count, count, self.plus_setpoint, self.minus_setpoint)
+                self.update(self.plus_count - count, gradient=gradient)
+                self.updated = True
+                self.spsa.new_direction()
+
+            self.plus_setpoint, self.minus_setpoint = self.spsa.setpoints(self.values, self.clip)
+            self.spsa_phase = 'plus'
+            self.setpoint = self.plus_setpoint
+
+        self.last_count = count
+        return self.setpoint
+
+    @property
+    def is_converged(self):
+        return bool(self.converged.all()) or self.count_converged
+
+    def converged_names(self):
+        return [name for name, converged in zip(self.names, self.converged) if converged]
+
+    def as_dict(self):
+        return {name: int(value) for name, value in zip(self.names, self.values)}
+
+
+# each parameter may move 'window' away from its initial value but never past its global 'lower'/'upper' bounds
+# the window of a parameter is centered on its initial value moved inside the global bounds, so a parameter file
+# holding a value outside them (e.g. the sample dazzler_parameters.txt) starts from the nearest bound instead of
+# leaving an empty window
+def bounds_from_settings(parameter_settings, initial_values):
+    initial_values = np.asarray(initial_values, dtype=float)
+    windows = np.array([setting.get("window", np.inf) for setting in parameter_settings], dtype=float)
+    global_lower_bounds = np.array([setting.get("lower", -np.inf) for setting in parameter_settings], dtype=float)
+    global_upper_bounds = np.array([setting.get("upper", np.inf) for setting in parameter_settings], dtype=float)
+    centers = np.clip(initial_values, global_lower_bounds, global_upper_bounds)
+    lower_bounds = np.maximum(centers - windows, global_lower_bounds)
+    upper_bounds = np.minimum(centers + windows, global_upper_bounds)
+    return lower_bounds, upper_bounds
+
+
+# build an optimizer from rows of parameter settings (see BetatronController.parameter_settings)
+def optimizer_from_settings(parameter_settings, initial_values, **kwargs):
+    lower_bounds, upper_bounds = bounds_from_settings(parameter_settings, initial_values)
+
+    kwargs.setdefault("learning_rates", [setting["learning_rate"] for setting in parameter_settings])
+    if all("step_size" in setting for setting in parameter_settings):
+        kwargs.setdefault("step_sizes", [setting["step_size"] for setting in parameter_settings])
+    if all("perturbation" in setting for setting in parameter_settings):
+        kwargs.setdefault("perturbation", [setting["perturbation"] for setting in parameter_settings])
+
+    return ParameterOptimizer([setting["name"] for setting in parameter_settings], initial_values, lower_bounds, upper_bounds, **kwargs)
@@ -0,0 +1,123 @@
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
+
+from metrics import Metrics
+
+# colours of the per-parameter trajectory curves
+PARAMETER_PENS = ['c', 'm', 'g', 'b', 'w', 'r', 'y']
+
+
+# keep the minimum and the maximum of each bin (in their original order) so peaks and dips of a long
+# series survive, the result has at most max_points points whatever the length of the series
+def decimate_min_max(x, y, max_points):
+    length = min(len(x), len(y))
+    x = x[:length]
+    y = y[:length]
+    if length <= max_points:
+        return x.copy(), y.copy()
+
+    bin_size = -(-length // (max_points // 2))
+    full_length = length - length % bin_size
+    bins = y[:full_length].reshape(-1, bin_size)
+    offsets = np.arange(0, full_length, bin_size)[:, None]
+    indices = np.sort(np.stack([bins.argmin(axis=1), bins.argmax(axis=1)], axis=1), axis=1) + offsets
+    indices = indices.ravel()
+
+    if full_length < length:
+        tail = y[full_length:]
+        indices = np.concatenate([indices, np.sort([full_length + tail.argmin(), full_length + tail.argmax()])])
+
+    return x[indices], y[indices]
+
+
+def _decimated_columns(max_points):
+    # reduce for HistoryStore.snapshot: x and every column of a 2-D y series decimated separately
+    def reduce(x, y):
+        if y.ndim == 1:
+            return [decimate_min_max(x, y, max_points)]
+        return [decimate_min_max(x, y[:, column], max_points) for column in range(y.shape[1])]
+    return reduce
+
+
+class OptimizationPlots(QtCore.QObject):
+    # the plot windows, owned by the GUI thread
+    # the control loop only calls publish() (a queued signal, safe from any thread) and the plots are
+    # redrawn from the history on the GUI thread at most max_fps times per second with decimated data,
+    # so the control loop never waits for a redraw however long the history gets
+    history_changed = QtCore.Signal()
+
+    def __init__(self, history, parameter_names, max_fps=10, max_points=2000, metrics=None, parent=None):
+        super(OptimizationPlots, self).__init__(parent)
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.history = history
+        self.parameter_names = list(parameter_names)
+        self.max_points = max_points
+        self.dirty = False
+        self.redraws = 0
+
+        self.main_plot_window = pg.GraphicsLayoutWidget()
+        self.main_plot_window.setWindowTitle('count optimization')
+        self.main_plot_window.show()
+
+        layout = self.main_plot_window.addLayout(row=0, col=0)
+
+        self.count_plot_widget = layout.addPlot(title='Count vs image group iteration')
+        self.total_gradient_plot = layout.addPlot(title='Total gradient vs image group iteration')
+
+        self.plot_curve = self.count_plot_widget.plot(pen='r')
+        self.total_gradient_curve = self.total_gradient_plot.plot(pen='y', name='total gradient')
+
+        # y labels of plots
+        self.total_gradient_plot.setLabel('left', 'Total Gradient')
+        self.count_plot_widget.setLabel('left', 'Count')
+
+        # x label of both plots
+        self.count_plot_widget.setLabel('bottom', 'Image Group Iteration')
+        self.total_gradient_plot.setLabel('bottom', 'Image Group Iteration')
+
+        # one trajectory plot per optimized parameter in a second row
+        parameter_layout = self.main_plot_window.addLayout(row=1, col=0)
+        self.parameter_curves = []
+        for index, name in enumerate(self.parameter_names):
+            parameter_plot = parameter_layout.addPlot(title=f'{name} vs image group iteration')
+            parameter_plot.setLabel('left', name)
+            parameter_plot.setLabel('bottom', 'Image Group Iteration')
+            self.parameter_curves.append(parameter_plot.plot(pen=PARAMETER_PENS[index % len(PARAMETER_PENS)]))
+
+        # the signal is queued onto the GUI thread, the timer caps the redraw rate
+        self.history_changed.connect(self._mark_dirty)
+        self.redraw_timer = QtCore.QTimer(self)
+        self.redraw_timer.setInterval(int(1000 / max_fps))
+        self.redraw_timer.timeout.connect(self.redraw)
+        self.redraw_timer.start()
+
+    # called by the control loop (any thread) after the history changed
+    def publish(self):
+        self.history_changed.emit()
+
+    def _mark_dirty(self):
+        self.dirty = True
+
+    def redraw(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        with self.metrics.span('plot'):
+            self._redraw()
+
+    def _redraw(self):
+        reduce = _decimated_columns(self.max_points)
+        (count_data,) = self.history.snapshot(['iteration', 'count'], reduce)
+        (total_gradient_data,) = self.history.snapshot(['gradient_iteration', 'total_gradient'], reduce)
+        parameter_data = self.history.snapshot(['iteration', 'parameters'], reduce)
+
+        self.plot_curve.setData(*count_data)
+        self.total_gradient_curve.setData(*total_gradient_data)
+        for curve, data in zip(self.parameter_curves, parameter_data):
+            curve.setData(*data)
+        self.redraws += 1
+
+    def close(self):
+        self.redraw_timer.stop()
+        self.main_plot_window.close()
@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from parameter_optimizer import ParameterOptimizer, clip_setpoint
+from simulation import Simulator
+
+# searches that evaluate many setpoints at once, only possible on a model of the beamline (the simulator or a
+# response surface recorded in a run journal), to find the best basin before the live run starts there
+# 'settings' are the ParameterOptimizer keyword arguments (names, initial_values, lower_bounds, upper_bounds,
+# learning_rates, perturbation) as in the benchmark landscapes, the model has to be picklable for the process pool
+
+
+# start points spread over the bounds by latin hypercube sampling (one start per stratum of every parameter),
+# the first start is the initial setpoint
+def start_points(settings, starts, rng):
+    lower = np.asarray(settings["lower_bounds"], dtype=float)
+    upper = np.asarray(settings["upper_bounds"], dtype=float)
+    size = len(settings["names"])
+
+    strata = np.array([rng.permutation(starts) for _ in range(size)]).T
+    samples = lower + (strata + rng.random((starts, size))) / starts * (upper - lower)
+    samples[0] = settings["initial_values"]
+    return clip_setpoint(samples, lower, upper)
+
+
+def _run_start(settings, configuration, model, start, image_groups, seed):
+    optimizer = ParameterOptimizer(**dict(settings, initial_values=start), **configuration, rng=np.random.default_rng(seed))
+    simulator = Simulator(optimizer, model)
+    result = simulator.run(image_groups, stop_when_converged=True)
+    result["start"] = np.asarray(start)
+    return result
+
+
+# independent momentum runs from every start point, on a process pool
+def run_multi_start(settings, model, starts=16, image_groups=300, workers=None, seed=0, **configuration):
+    rng = np.random.default_rng(seed)
+    points = start_points(settings, starts, rng)
+    seeds = rng.integers(0, 2 ** 32, size=len(points))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_start, settings, configuration, model, point, image_groups, int(run_seed)) for point, run_seed in zip(points, seeds)]
+        return [future.result() for future in futures]
+
+
+def _evaluate(model, setpoints):
+    return [model(setpoint) for setpoint in setpoints]
+
+
+class SeparableEvolutionStrategy:
+    # CMA-ES with a diagonal covariance (sep-CMA-ES): weighted recombination of the best mu of lambda samples,
+    # rank-mu update of the per-parameter variances and cumulative step size adaptation
+    # works in units of the bounds range so focus and dispersion share one step size, samples are clipped and
+    # rounded like every setpoint the devices get
+    def __init__(self, settings, population_size=None, sigma=0.3, rng=None):
+        self.lower = np.asarray(settings["lower_bounds"], dtype=float)
+        self.upper = np.asarray(settings["upper_bounds"], dtype=float)
+        self.scale = self.upper - self.lower
+        self.size = len(settings["names"])
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.population_size = population_size or 4 + int(3 * np.log(self.size))
+        self.parents = self.population_size // 2
+        weights = np.log(self.parents + 0.5) - np.log(np.arange(1, self.parents + 1))
+        self.weights = weights / weights.sum()
+        self.effective_parents = 1 / np.sum(self.weights ** 2)
+
+        self.c_sigma = (self.effective_parents + 2) / (self.size + self.effective_parents + 5)
+        self.d_sigma = 1 + 2 * max(0, np.sqrt((self.effective_parents - 1) / (self.size + 1)) - 1) + self.c_sigma
+        self.c_mu = min(1.0, (self.size + 2) / 3 * self.effective_parents / ((self.size + 2) ** 2 + self.effective_parents))
+        self.expected_norm = np.sqrt(self.size) * (1 - 1 / (4 * self.size) + 1 / (21 * self.size ** 2))
+
+        self.mean = (np.asarray(settings["initial_values"], dtype=float) - self.lower) / self.scale
+        self.sigma = sigma
+        self.variances = np.ones(self.size)
+        self.path = np.zeros(self.size)
+
+    def ask(self):
+        self.steps = self.rng.standard_normal((self.population_size, self.size)) * np.sqrt(self.variances)
+        candidates = np.clip(self.mean + self.sigma * self.steps, 0, 1)
+        return clip_setpoint(self.lower + candidates * self.scale, self.lower, self.upper)
+
+    def tell(self, setpoints, counts):
+        order = np.argsort(counts)[::-1][:self.parents]
+        # the steps that were actually taken (after clipping and rounding)
+        selected = ((setpoints[order] - self.lower) / self.scale - self.mean) / self.sigma
+
+        step = self.weights @ selected
+        self.mean = self.mean + self.sigma * step
+        self.path = (1 - self.c_sigma) * self.path + np.sqrt(self.c_sigma * (2 - self.c_sigma) * self.effective_parents) * step / np.sqrt(self.variances)
+        self.variances = (1 - self.c_mu) * self.variances + self.c_mu * (self.weights @ selected ** 2)
+        self.sigma *= np.exp(self.c_sigma / self.d_sigma * (np.linalg.norm(self.path) / self.expected_norm - 1))
+
+    @property
+    def setpoint(self):
+        return clip_setpoint(self.lower + np.clip(self.mean, 0, 1) * self.scale, self.lower, self.upper)
+
+
+# sample a population per generation and evaluate it on a process pool (in one chunk per worker)
+def run_evolution_strategy(settings, model, generations=50, population_size=None, sigma=0.3, workers=None, seed=0):
+    strategy = SeparableEvolutionStrategy(settings, population_size, sigma, np.random.default_rng(seed))
+    workers = workers or os.cpu_count() or 1
+    evaluated = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in range(generations):
+            setpoints = strategy.ask()
+            chunks = np.array_split(setpoints, min(workers, len(setpoints)))
+            counts = np.concatenate([np.asarray(chunk_counts, dtype=float) for chunk_counts in pool.map(_evaluate, [model] * len(chunks), chunks)])
+            strategy.tell(setpoints, counts)
+            evaluated.extend(zip(setpoints, counts))
+
+    best_setpoint, best_count = max(evaluated, key=lambda entry: entry[1])
+    return {
+        "evaluations": len(evaluated),
+        "best_count": float(best_count),
+        "best_setpoint": best_setpoint,
+        "final_setpoint": strategy.setpoint,
+        "final_count": float(model(strategy.setpoint)),
+        "points": evaluated,
+        }
+
+
+# group the runs into basins by the best setpoint they found (a momentum run keeps oscillating around the peak, its
+# last setpoint says less): runs within radius (in units of the bounds range) of a basin's best setpoint belong to it,
+# basins are sorted by their best count
+def find_basins(results, lower_bounds, upper_bounds, radius=0.1):
+    scale = np.asarray(upper_bounds, dtype=float) - np.asarray(lower_bounds, dtype=float)
+    basins = []
+    for result in sorted(results, key=lambda result: result["best_count"], reverse=True):
+        for basin in basins:
+            if np.linalg.norm((result["best_setpoint"] - basin["best_setpoint"]) / scale) <= radius:
+                basin["runs"] += 1
+                break
+        else:
+            basins.append({"best_count": result["best_count"], "best_setpoint": result["best_setpoint"], "runs": 1})
+    return basins
+
+
+# optimizer settings and model of a run journal (response surface interpolated between the recorded setpoints)
+def journal_problem(path):
+    from run_journal import read_journal, measurements
+    from parameter_optimizer import bounds_from_settings
+    from simulation import RecordedResponseModel
+
+    header, records = read_journal(path)
+    measured = measurements(records)
+    parameter_settings = header["parameter_settings"]
+    initial_values = np.array(header["initial_values"], dtype=float)
+    lower_bounds, upper_bounds = bounds_from_settings(parameter_settings, initial_values)
+    settings = {
+        "names": header["parameter_names"],
+        "initial_values": initial_values,
+        "lower_bounds": lower_bounds,
+        "upper_bounds": upper_bounds,
+        "learning_rates": [setting["learning_rate"] for setting in parameter_settings],
+        "perturbation": [setting.get("perturbation", 1) for setting in parameter_settings],
+        }
+    model = RecordedResponseModel(measured['values'], measured['value'], scales=[setting.get("window", 1) for setting in parameter_settings])
+    return settings, model
+
+
+def main(argv=None):
+    from benchmark_suite import LANDSCAPES
+
+    parser = argparse.ArgumentParser(description="Search a simulated or recorded response for its best basin with many parallel runs.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--landscape', choices=sorted(LANDSCAPES), default='two_peak', help="simulated landscape of the benchmark suite")
+    source.add_argument('--journal', help="search the response recorded in this run journal")
+    parser.add_argument('--mode', choices=('multi-start', 'evolution'), default='multi-start')
+    parser.add_argument('--starts', type=int, default=16, help="momentum runs of the multi-start search")
+    parser.add_argument('--image-groups', type=int, default=300, help="image groups per momentum run")
+    parser.add_argument('--gradient-estimator', choices=('difference', 'spsa'), default='spsa')
+    parser.add_argument('--momentum', type=float, default=0.5)
+    parser.add_argument('--generations', type=int, default=50, help="generations of the evolution strategy")
+    parser.add_argument('--population', type=int, default=None, help="samples per generation of the evolution strategy")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: one per cpu)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the best setpoint to this json file (for run_optimization.py --initial-values)")
+    arguments = parser.parse_args(argv)
+
+    if arguments.journal:
+        settings, model = journal_problem(arguments.journal)
+    else:
+        settings, model, _ = LANDSCAPES[arguments.landscape]()
+
+    start = time.perf_counter()
+    if arguments.mode == 'multi-start':
+        results = run_multi_start(settings, model, arguments.starts, arguments.image_groups, arguments.workers, arguments.seed,
+                                  gradient_estimator=arguments.gradient_estimator, momentum=arguments.momentum)
+        basins = find_basins(results, settings["lower_bounds"], settings["upper_bounds"])
+        best_setpoint, best_count = basins[0]["best_setpoint"], basins[0]["best_count"]
+        print(f"{len(results)} runs in {time.perf_counter() - start:.2f} s, {len(basins)} basins:")
+        for basin in basins:
+            print(f"  count {basin['best_count']:10.2f} at {basin['best_setpoint'].astype(int).tolist()} ({basin['runs']} runs)")
+    else:
+        result = run_evolution_strategy(settings, model, arguments.generations, arguments.population, workers=arguments.workers, seed=arguments.seed)
+        best_setpoint, best_count = result["best_setpoint"], result["best_count"]
+        print(f"{result['evaluations']} evaluations in {time.perf_counter() - start:.2f} s, best count {best_count:.2f} at {best_setpoint.astype(int).tolist()}")
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({name: int(value) for name, value in zip(settings["names"], best_setpoint)}, file, indent=2)
+        print(f"Wrote the best setpoint to {arguments.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import argparse
+
+import numpy as np
+
+# an append-only binary journal of a run: a header with everything needed to rebuild the optimizer
+# (parameter settings, initial values, optimizer settings and the seed of its random generator),
+# then one fixed-size record per measured image group and per gradient estimate
+# every record carries a crc32 so a record torn by a crash is detected and dropped when the journal is read
+JOURNAL_MAGIC = b'BTJRNL1\n'
+JOURNAL_VERSION = 1
+
+MEASUREMENT = 1
+GRADIENT = 2
+
+
+def record_dtype(width):
+    # 'values' is the setpoint of a measurement or the gradient of a gradient record,
+    # 'value' the mean count of a measurement or the total gradient
+    return np.dtype([
+        ('kind', '<u1'), ('reserved', 'V1'), ('shots', '<u2'), ('iteration', '<u4'),
+        ('timestamp', '<f8'), ('value', '<f8'), ('standard_error', '<f8'),
+        ('values', '<f8', (width,)), ('checksum', '<u4'),
+        ])
+
+
+class RunJournal:
+    def __init__(self, path, header, file):
+        self.path = path
+        self.header = header
+        self.width = len(header["parameter_names"])
+        self.dtype = record_dtype(self.width)
+        self.file = file
+        self.records_written = 0
+
+    # start a new journal (fails if the file exists, a journal is never overwritten)
+    @classmethod
+    def create(cls, path, header):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = dict(header, version=JOURNAL_VERSION)
+        encoded = json.dumps(header).encode()
+
+        file = open(path, 'xb')
+        file.write(JOURNAL_MAGIC + struct.pack('<I', len(encoded)) + encoded)
+        journal = cls(path, header, file)
+        journal.sync()
+        return journal
+
+    # continue an existing journal, a torn record at its end is cut off first
+    @classmethod
+    def append_to(cls, path):
+        header, records, end = read_journal(path, with_end=True)
+        file = open(path, 'r+b')
+        file.truncate(end)
+        file.seek(end)
+        return cls(path, header, file)
+
+    def _write(self, kind, iteration, value, values, shots=0, standard_error=np.nan):
+        record = np.zeros(1, dtype=self.dtype)
+        record['kind'] = kind
+        record['shots'] = min(shots, 0xffff)
+        record['iteration'] = iteration
+        record['timestamp'] = time.time()
+        record['value'] = value
+        record['standard_error'] = standard_error
+        record['values'] = values
+        data = record.tobytes()
+        record['checksum'] = zlib.crc32(data[:-4])
+        self.file.write(record.tobytes())
+        self.records_written += 1
+
+    def append_measurement(self, iteration, count, setpoint, shots=0, standard_error=np.nan):
+        self._write(MEASUREMENT, iteration, count, setpoint, shots, standard_error)
+
+    def append_gradient(self, iteration, gradient):
+        gradient = np.asarray(gradient, dtype=float)
+        self._write(GRADIENT, iteration, gradient.sum(), gradient)
+
+    # make the records written so far survive a crash (called once per optimization step)
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+# the header and the intact records of a journal (and optionally where the intact records end)
+def read_journal(path, with_end=False):
+    with open(path, 'rb') as file:
+        if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f"{path} is not a run journal")
+        (length,) = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(length))
+        if header.get("version") != JOURNAL_VERSION:
+            raise ValueError(f"{path} has journal version {header.get('version')}, expected {JOURNAL_VERSION}")
+        start = file.tell()
+        data = file.read()
+
+    dtype = record_dtype(len(header["parameter_names"]))
+    records = np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype=dtype)
+
+    # everything from the first record whose checksum does not match was torn by a crash
+    raw = np.frombuffer(data[:len(records) * dtype.itemsize], dtype=np.uint8).reshape(len(records), dtype.itemsize)
+    intact = len(records)
+    for index in range(len(records)):
+        if zlib.crc32(raw[index, :-4].tobytes()) != records['checksum'][index]:
+            intact = index
+            break
+    records = records[:intact]
+
+    if with_end:
+        return header, records, start + intact * dtype.itemsize
+    return header, records
+
+
+def measurements(records):
+    return records[records['kind'] == MEASUREMENT]
+
+
+def gradients(records):
+    return records[records['kind'] == GRADIENT]
+
+
+# re-run the measured response of a journal through another optimizer configuration, as fast as the CPU allows
+def replay(path, image_groups=None, optimizer_mode=None, seed=None, **optimizer_settings):
+    from simulation import RecordedResponseModel, Simulator
+    from parameter_optimizer import optimizer_from_settings
+    from bayesian_optimizer import bayesian_optimizer_from_settings
+    from sensitivity_scan import scan_from_settings
+    from drift_tracking import tracker_from_settings
+
+    header, records = read_journal(path)
+    measured = measurements(records)
+    if len(measured) == 0:
+        raise ValueError(f"{path} has no measurements to replay")
+
+    parameter_settings = header["parameter_settings"]
+    initial_values = np.array(header["initial_values"], dtype=float)
+    settings = dict(header["optimizer_settings"])
+    settings.update({name: value for name, value in optimizer_settings.items() if value is not None})
+    optimizer_mode = optimizer_mode or header["optimizer_mode"]
+    rng = np.random.default_rng(header["seed"] if seed is None else seed)
+
+    # the surface between the recorded setpoints is interpolated in units of the parameter windows
+    scales = [setting.get("window", 1) for setting in parameter_settings]
+    model = RecordedResponseModel(measured['values'], measured['value'], scales=scales)
+
+    # journals written before the update rules and the scan existed used the heavy ball momentum
+    momentum_settings = {
+        "count_change_tolerance": settings["count_change_tolerance"],
+        "momentum": settings["momentum"],
+        "gradient_estimator": settings["gradient_estimator"],
+        "update_rule": settings.get("update_rule", 'momentum'),
+        "learning_rate_schedule": settings.get("learning_rate_schedule", 'constant'),
+        "learning_rate_decay": settings.get("learning_rate_decay", 0.01),
+        }
+    if optimizer_mode == 'bayesian':
+        optimizer = bayesian_optimizer_from_settings(parameter_settings, initial_values, rng=rng, count_change_tolerance=settings["count_change_tolerance"], batch_size=settings["bayesian_batch_size"])
+    elif optimizer_mode == 'scan':
+        optimizer = scan_from_settings(
+            parameter_settings, initial_values, rng=rng,
+            design=settings.get("scan_design", 'sweeps'),
+            points=settings.get("scan_points", 5),
+            repeats=settings.get("scan_repeats", 1),
+            learning_rate_fraction=settings.get("scan_learning_rate_fraction", 0.5),
+            **momentum_settings,
+            )
+    elif optimizer_mode == 'tracking':
+        optimizer = tracker_from_settings(
+            parameter_settings, initial_values, rng=rng,
+            window=settings.get("tracking_window", 12),
+            tracking_gain=settings.get("tracking_gain", 0.25),
+            patience=settings.get("tracking_patience", 5),
+            )
+    else:
+        optimizer = optimizer_from_settings(parameter_settings, initial_values, rng=rng, **momentum_settings)
+
+    simulator = Simulator(optimizer, model)
+    result = simulator.run(image_groups or len(measured))
+    result["recorded_best_count"] = float(measured['value'].max())
+    result["recorded_image_groups"] = len(measured)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect a run journal or replay it through another optimizer configuration.")
+    parser.add_argument('journal', help="journal file written by a run")
+    parser.add_argument('--replay', action='store_true', help="run the recorded response through the optimizer")
+    parser.add_argument('--image-groups', type=int, help="image groups to replay (default: as many as were recorded)")
+    parser.add_argument('--optimizer', choices=('momentum', 'bayesian', 'scan', 'tracking'), help="optimizer mode (default: the recorded one)")
+    parser.add_argument('--scan-design', choices=('sweeps', 'latin_hypercube', 'grid'))
+    parser.add_argument('--scan-points', type=int)
+    parser.add_argument('--gradient-estimator', choices=('difference', 'spsa'))
+    parser.add_argument('--momentum', type=float)
+    parser.add_argument('--update-rule', choices=('momentum', 'nesterov', 'rmsprop', 'adam'))
+    parser.add_argument('--schedule', choices=('constant', 'exponential', 'inverse_time'), help="learning rate schedule")
+    parser.add_argument('--count-change-tolerance', type=float)
+    parser.add_argument('--seed', type=int, help="seed of the optimizer (default: the recorded one)")
+    arguments = parser.parse_args(argv)
+
+    header, records = read_journal(arguments.journal)
+    measured = measurements(records)
+    print(f"{arguments.journal}: {len(measured)} image groups, {len(gradients(records))} gradients, parameters {', '.join(header['parameter_names'])}")
+    if len(measured):
+        best = int(np.argmax(measured['value']))
+        print(f"best count {measured['value'][best]:.2f} at {measured['values'][best].astype(int).tolist()}")
+
+    if arguments.replay:
+        result = replay(
+            arguments.journal,
+            image_groups=arguments.image_groups,
+            optimizer_mode=arguments.optimizer,
+            seed=arguments.seed,
+            gradient_estimator=arguments.gradient_estimator,
+            momentum=arguments.momentum,
+            update_rule=arguments.update_rule,
+            learning_rate_schedule=arguments.schedule,
+            scan_design=arguments.scan_design,
+            scan_points=arguments.scan_points,
+            count_change_tolerance=arguments.count_change_tolerance,
+            )
+        print(json.dumps({name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in result.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import sys
+import time
+import argparse
+import threading
+
+# only the standard library is imported here so `--help` and a misconfigured run fail fast,
+# the optimization modules are imported by the mode that needs them and Qt only by the GUI and the viewer
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Optimize the betatron count by adjusting the mirror and dazzler parameters.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--headless', action='store_true', help="run without any GUI (never imports Qt), viewers can attach with --viewer")
+    mode.add_argument('--viewer', metavar='HOST:PORT', help="plot a session running headless on HOST:PORT")
+
+    parser.add_argument('--source', choices=('directory', 'ring'), help="read images from the image directory or from a frame ring file")
+    parser.add_argument('--images', help="directory the camera saves the images to")
+    parser.add_argument('--image-extensions', nargs='+', metavar='EXTENSION', help="score only the image files with these extensions (default image_watcher.IMAGE_EXTENSIONS)")
+    parser.add_argument('--ring-file', help="frame ring file the acquisition software writes (with --source ring)")
+    parser.add_argument('--mirror-file', help="parameter file of the deformable mirror")
+    parser.add_argument('--dazzler-file', help="parameter file of the dazzler")
+    parser.add_argument('--image-group', type=int, help="number of images averaged per setpoint")
+    parser.add_argument('--optimizer', choices=('momentum', 'bayesian', 'scan', 'tracking'),
+                        help="optimizer mode ('scan' maps the response around the initial values before the momentum ascent, 'tracking' follows a drifting peak for a whole shift)")
+    parser.add_argument('--tracking-window', type=int, help="image groups the tracking gradient is fitted over")
+    parser.add_argument('--scan-design', choices=('sweeps', 'latin_hypercube', 'grid'), help="setpoints the scan measures")
+    parser.add_argument('--scan-points', type=int, help="scan setpoints per parameter")
+    parser.add_argument('--scan-repeats', type=int, help="image groups measured at every scan setpoint")
+    parser.add_argument('--gradient-estimator', choices=('difference', 'spsa'), help="gradient estimator of the momentum optimizer")
+    parser.add_argument('--update-rule', choices=('momentum', 'nesterov', 'rmsprop', 'adam'), help="step rule of the momentum optimizer")
+    parser.add_argument('--schedule', choices=('constant', 'exponential', 'inverse_time'), help="learning rate schedule of the momentum optimizer")
+    parser.add_argument('--roi', nargs='+', metavar='EDGE', help="score only this region: 'auto' or TOP BOTTOM LEFT RIGHT in pixels")
+    parser.add_argument('--binning', type=int, help="average BINNING x BINNING pixel blocks before the blur")
+    parser.add_argument('--background', help="image subtracted from every image before scoring")
+    parser.add_argument('--reduction', choices=('mean', 'sum', 'threshold', 'percentile'), help="how the blurred pixels are reduced to a count")
+    parser.add_argument('--threshold', type=float, help="pixel level above which the 'threshold' reduction integrates the signal")
+    parser.add_argument('--percentile', type=float, help="percentile taken by the 'percentile' reduction")
+    parser.add_argument('--blur-tile-rows', type=int, help="blur every image in bands of this many rows on a thread pool (same counts)")
+    parser.add_argument('--blur-workers', type=int, help="threads blurring the bands of an image")
+    parser.add_argument('--scoring-workers', type=int, help="number of threads scoring images")
+    parser.add_argument('--diagnostics', metavar='JSON', help="score several diagnostics: a list of rows with name, source, path, scoring, workers, weight, minimum, maximum, penalty")
+    parser.add_argument('--match', choices=('timestamp', 'shot_id'), help="how the frames of the diagnostics are matched into shots")
+    parser.add_argument('--match-tolerance', type=float, help="seconds between the timestamps of the frames of one shot")
+    parser.add_argument('--seed', type=int, help="seed of the optimizer's random generator")
+    parser.add_argument('--initial-values', metavar='JSON', help="start from the setpoint in this file (written by population_search.py --output)")
+    parser.add_argument('--resume', metavar='JOURNAL', help="continue the run recorded in this journal")
+    parser.add_argument('--no-journal', action='store_true', help="do not write a run journal")
+    parser.add_argument('--metrics', action='store_true', help="time every stage and serve the metrics over http")
+    parser.add_argument('--metrics-port', type=int, help="port of the metrics endpoint")
+    parser.add_argument('--upload', action='store_true', help="upload the parameter files to the devices after every step")
+    parser.add_argument('--publish-host', default='127.0.0.1', help="address a headless run publishes its session on")
+    parser.add_argument('--publish-port', type=int, help="port a headless run publishes its session on")
+    parser.add_argument('--no-publish', action='store_true', help="do not publish the session of a headless run")
+    return parser.parse_args(argv)
+
+
+def read_json(path):
+    import json
+
+    with open(path) as file:
+        return json.load(file)
+
+
+# controller settings given on the command line (the rest keep the defaults of BetatronController)
+def controller_settings(arguments):
+    settings = {
+        'image_source': arguments.source,
+        'IMG_PATH': arguments.images,
+        'image_extensions': arguments.image_extensions and tuple(arguments.image_extensions),
+        'frame_ring_path': arguments.ring_file,
+        'mirror_file_path': arguments.mirror_file,
+        'dispersion_file_path': arguments.dazzler_file,
+        'image_group': arguments.image_group,
+        'optimizer_mode': arguments.optimizer,
+        'gradient_estimator': arguments.gradient_estimator,
+        'update_rule': arguments.update_rule,
+        'learning_rate_schedule': arguments.schedule,
+        'scan_design': arguments.scan_design,
+        'scan_points': arguments.scan_points,
+        'scan_repeats': arguments.scan_repeats,
+        'tracking_window': arguments.tracking_window,
+        'scoring_workers': arguments.scoring_workers,
+        'diagnostics': read_json(arguments.diagnostics) if arguments.diagnostics else None,
+        'diagnostic_match': arguments.match,
+        'diagnostic_match_tolerance': arguments.match_tolerance,
+        'upload_to_devices': arguments.upload or None,
+        'seed': arguments.seed,
+        'resume_journal': arguments.resume,
+        'initial_setpoint': read_json(arguments.initial_values) if arguments.initial_values else None,
+        'use_journal': False if arguments.no_journal else None,
+        'metrics_enabled': arguments.metrics or None,
+        'metrics_port': arguments.metrics_port,
+        }
+    settings = {name: value for name, value in settings.items() if value is not None}
+
+    scoring_settings = {
+        'roi': 'auto' if arguments.roi == ['auto'] else arguments.roi and tuple(int(edge) for edge in arguments.roi),
+        'binning': arguments.binning,
+        'background': arguments.background,
+        'reduction': arguments.reduction,
+        'threshold': arguments.threshold,
+        'percentile': arguments.percentile,
+        'blur_tile_rows': arguments.blur_tile_rows,
+        'blur_workers': arguments.blur_workers,
+        }
+    scoring_settings = {name: value for name, value in scoring_settings.items() if value is not None}
+    if scoring_settings:
+        settings['scoring_settings'] = scoring_settings
+    return settings
+
+
+def run_headless(arguments):
+    from optimization_controller import BetatronController
+    from session_link import SessionPublisher, DEFAULT_PORT
+
+    controller = BetatronController(**controller_settings(arguments))
+
+    publisher = None
+    if not arguments.no_publish:
+        port = DEFAULT_PORT if arguments.publish_port is None else arguments.publish_port
+        publisher = SessionPublisher(controller.history, controller.parameter_names, host=arguments.publish_host, port=port)
+        controller.group_listeners.append(lambda controller: publisher.publish())
+        print(f"Publishing the session on {publisher.address[0]}:{publisher.address[1]}")
+
+    controller.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.shutdown()
+        if publisher is not None:
+            publisher.close()
+
+
+def run_viewer(arguments):
+    from pyqtgraph.Qt import QtWidgets
+    from history_store import HistoryStore
+    from plotting import OptimizationPlots
+    from session_link import SessionSubscriber, apply_message, DEFAULT_PORT
+
+    host, _, port = arguments.viewer.rpartition(':')
+    subscriber = SessionSubscriber(host or '127.0.0.1', int(port) if port else DEFAULT_PORT)
+
+    # the hello message tells the viewer which parameters (and so which plots) the session has
+    messages = iter(subscriber)
+    hello = next(messages)
+    history = HistoryStore()
+    apply_message(history, hello)
+
+    app = QtWidgets.QApplication([])
+    plots = OptimizationPlots(history, hello["parameter_names"])
+    plots.publish()
+
+    def follow():
+        for message in messages:
+            apply_message(history, message)
+            plots.publish()
+        print("Session ended")
+
+    threading.Thread(target=follow, name='session-viewer', daemon=True).start()
+    app.aboutToQuit.connect(plots.close)
+    app.aboutToQuit.connect(subscriber.close)
+    return app.exec_()
+
+
+def run_gui(arguments):
+    from momentum_gradient_descent_optimization import BetatronApplication
+
+    app = BetatronApplication([], **controller_settings(arguments))
+    app.aboutToQuit.connect(app.shutdown)
+    return app.exec_()
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.headless:
+        return run_headless(arguments)
+    if arguments.viewer:
+        return run_viewer(arguments)
+    return run_gui(arguments)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import sys
+import argparse
+import itertools
+
+import numpy as np
+
+from parameter_optimizer import ParameterOptimizer, bounds_from_settings, clip_setpoint
+
+# a scan of the response around the initial setpoint before the optimization: a design of setpoints inside the
+# parameter windows, measured in the order that moves the actuators least, then a quadratic fit of the counts
+# whose curvature sets the learning rate of every parameter for the momentum run that follows
+SCAN_DESIGNS = ('sweeps', 'latin_hypercube', 'grid')
+
+
+# the setpoints of a design (rounded, without duplicates), the center comes first
+#   'sweeps': points setpoints along each parameter's window with the others at the center (size * points)
+#   'grid': points setpoints per parameter, every combination (points ** size)
+#   'latin_hypercube': points * size setpoints, one per stratum of every parameter's window
+def scan_design(design, center, lower_bounds, upper_bounds, points=5, rng=None):
+    center = clip_setpoint(center, lower_bounds, upper_bounds)
+    lower = np.asarray(lower_bounds, dtype=float)
+    upper = np.asarray(upper_bounds, dtype=float)
+    size = len(center)
+
+    if design == 'sweeps':
+        setpoints = []
+        for index in range(size):
+            for value in np.linspace(lower[index], upper[index], points):
+                setpoint = center.copy()
+                setpoint[index] = value
+                setpoints.append(setpoint)
+    elif design == 'grid':
+        axes = [np.linspace(lower[index], upper[index], points) for index in range(size)]
+        setpoints = [np.array(setpoint) for setpoint in itertools.product(*axes)]
+    elif design == 'latin_hypercube':
+        rng = rng if rng is not None else np.random.default_rng()
+        samples = points * size
+        strata = np.array([rng.permutation(samples) for _ in range(size)]).T
+        setpoints = list(lower + (strata + rng.random((samples, size))) / samples * (upper - lower))
+    else:
+        raise ValueError(f"unknown scan design {design!r}, expected one of {SCAN_DESIGNS}")
+
+    unique = {tuple(center): center}
+    for setpoint in clip_setpoint(setpoints, lower, upper):
+        unique.setdefault(tuple(setpoint), setpoint)
+    return np.array(list(unique.values()))
+
+
+# order the setpoints into a path from start that keeps the actuator travel (in units of each parameter's window,
+# every actuator moving at once) short: nearest neighbour, then 2-opt until no reversal of a stretch shortens it
+def order_by_travel(setpoints, start, scale):
+    points = np.asarray(setpoints, dtype=float) / scale
+    position = np.asarray(start, dtype=float) / scale
+
+    remaining = list(range(len(points)))
+    order = []
+    while remaining:
+        distances = np.abs(points[remaining] - position).sum(axis=1)
+        nearest = remaining.pop(int(np.argmin(distances)))
+        order.append(nearest)
+        position = points[nearest]
+
+    path = np.vstack([np.asarray(start, dtype=float) / scale, points[order]])
+
+    def distance(a, b):
+        return np.abs(path[a] - path[b]).sum()
+
+    improved = True
+    while improved:
+        improved = False
+        for first in range(1, len(path) - 1):
+            for last in range(first + 1, len(path)):
+                # reversing path[first:last + 1] changes the two edges at its ends (the path is open at its end)
+                before = distance(first - 1, first) + (distance(last, last + 1) if last + 1 < len(path) else 0)
+                after = distance(first - 1, last) + (distance(first, last + 1) if last + 1 < len(path) else 0)
+                if after < before - 1e-12:
+                    path[first:last + 1] = path[first:last + 1][::-1].copy()
+                    order[first - 1:last] = order[first - 1:last][::-1]
+                    improved = True
+    return np.array(order)
+
+
+def travel(setpoints, start, scale):
+    path = np.vstack([start, setpoints]) / scale
+    return float(np.abs(np.diff(path, axis=0)).sum())
+
+
+class QuadraticFit:
+    # count ~ constant + gradient . d + d . hessian . d / 2 with d the distance from center (in parameter units)
+    def __init__(self, center, constant, gradient, hessian, r_squared, residual, samples):
+        self.center = center
+        self.constant = constant
+        self.gradient = gradient
+        self.hessian = hessian
+        self.r_squared = r_squared
+        self.residual = residual
+        self.samples = samples
+
+    def __call__(self, setpoint):
+        distance = np.asarray(setpoint, dtype=float) - self.center
+        return self.constant + self.gradient @ distance + distance @ self.hessian @ distance / 2
+
+    # the peak of the fit clipped to the bounds, None if the fit has no maximum
+    def maximum(self, lower_bounds, upper_bounds):
+        if np.any(np.linalg.eigvalsh(self.hessian) >= 0):
+            return None
+        return clip_setpoint(self.center - np.linalg.solve(self.hessian, self.gradient), lower_bounds, upper_bounds)
+
+
+# least squares fit in units of scale around center, with the cross terms only when the design determines them
+# (sweeps move one parameter at a time and only give the diagonal of the hessian)
+def fit_quadratic(setpoints, counts, center, scale):
+    center = np.asarray(center, dtype=float)
+    scale = np.asarray(scale, dtype=float)
+    distances = (np.asarray(setpoints, dtype=float) - center) / scale
+    counts = np.asarray(counts, dtype=float)
+    size = len(center)
+
+    pairs = [(row, column) for row in range(size) for column in range(row, size)]
+    columns = [np.ones(len(counts))] + [distances[:, index] for index in range(size)] + [distances[:, row] * distances[:, column] for row, column in pairs]
+    features = np.column_stack(columns)
+    if np.linalg.matrix_rank(features) < features.shape[1]:
+        pairs = [(index, index) for index in range(size)]
+        features = np.column_stack(columns[:1 + size] + [distances[:, index] ** 2 for index in range(size)])
+    coefficients = np.linalg.lstsq(features, counts, rcond=None)[0]
+
+    hessian = np.zeros((size, size))
+    for coefficient, (row, column) in zip(coefficients[1 + size:], pairs):
+        if row == column:
+            hessian[row, row] = 2 * coefficient
+        else:
+            hessian[row, column] = hessian[column, row] = coefficient
+    # back to parameter units
+    gradient = coefficients[1:1 + size] / scale
+    hessian = hessian / np.outer(scale, scale)
+
+    residuals = counts - features @ coefficients
+    total = np.sum((counts - counts.mean()) ** 2)
+    r_squared = 1 - np.sum(residuals ** 2) / total if total > 0 else 1.0
+    degrees_of_freedom = len(counts) - features.shape[1]
+    residual = np.sqrt(np.sum(residuals ** 2) / degrees_of_freedom) if degrees_of_freedom > 0 else np.nan
+    return QuadraticFit(center, coefficients[0], gradient, hessian, r_squared, residual, len(counts))
+
+
+# learning rate of every parameter from the curvature of the fit: fraction of the newton step along each axis
+# (fraction / |d2 count / d parameter2|), parameters without a downward curvature keep their learning rate
+def learning_rates_from_hessian(hessian, learning_rates, fraction=0.5):
+    curvature = -np.diag(hessian)
+    learning_rates = np.array(np.broadcast_to(np.asarray(learning_rates, dtype=float), curvature.shape))
+    curved = curvature > 0
+    learning_rates[curved] = fraction / curvature[curved]
+    return learning_rates
+
+
+class SensitivityScan:
+    # the tell/setpoint interface of ParameterOptimizer: measures every setpoint of the design (repeats groups each),
+    # fits the quadratic and then hands over to make_optimizer(learning_rates, start), which continues from the peak of
+    # the fit (the best measured setpoint if the fit has none) with the learning rates from the fit, without
+    # make_optimizer the scan ends at that start
+    def __init__(self, names, initial_values, lower_bounds, upper_bounds, design='sweeps', points=5, repeats=1, learning_rates=5, learning_rate_fraction=0.5,
+                 make_optimizer=None, rng=None):
+        self.names = list(names)
+        self.size = len(self.names)
+        self.lower_bounds = np.array(np.broadcast_to(np.asarray(lower_bounds, dtype=float), (self.size,)))
+        self.upper_bounds = np.array(np.broadcast_to(np.asarray(upper_bounds, dtype=float), (self.size,)))
+        self.learning_rates = learning_rates
+        self.learning_rate_fraction = learning_rate_fraction
+        self.make_optimizer = make_optimizer
+        self.repeats = repeats
+        rng = rng if rng is not None else np.random.default_rng()
+
+        self.center = clip_setpoint(initial_values, self.lower_bounds, self.upper_bounds)
+        self.scale = np.maximum((self.upper_bounds - self.lower_bounds) / 2, 1)
+        design_setpoints = scan_design(design, self.center, self.lower_bounds, self.upper_bounds, points, rng)
+        self.design = design_setpoints[order_by_travel(design_setpoints, self.center, self.scale)]
+
+        self.measured_setpoints = []
+        self.measured_counts = []
+        self.fit = None
+        self.fitted_learning_rates = None
+        self.optimizer = None
+
+        self._setpoint = self.design[0]
+        self._gradient = np.zeros(self.size)
+
+    @property
+    def scanning(self):
+        return self.optimizer is None and self.fit is None
+
+    def tell(self, count):
+        if self.optimizer is not None:
+            return self.optimizer.tell(count)
+
+        if self.fit is None:
+            self.measured_setpoints.append(self._setpoint)
+            self.measured_counts.append(count)
+            index = len(self.measured_counts) // self.repeats
+            if index < len(self.design):
+                self._setpoint = self.design[index]
+            else:
+                self.finish()
+        return self.setpoint
+
+    def finish(self):
+        self.fit = fit_quadratic(self.measured_setpoints, self.measured_counts, self.center, self.scale)
+        self._gradient = self.fit.gradient
+        self.fitted_learning_rates = learning_rates_from_hessian(self.fit.hessian, self.learning_rates, self.learning_rate_fraction)
+        maximum = self.fit.maximum(self.lower_bounds, self.upper_bounds)
+        self._setpoint = maximum if maximum is not None else self.best_setpoint
+        if self.make_optimizer is not None:
+            self.optimizer = self.make_optimizer(self.fitted_learning_rates, self._setpoint)
+
+    @property
+    def best_setpoint(self):
+        return np.asarray(self.measured_setpoints[int(np.argmax(self.measured_counts))])
+
+    @property
+    def setpoint(self):
+        return self.optimizer.setpoint if self.optimizer is not None else self._setpoint
+
+    @property
+    def values(self):
+        return self.optimizer.values if self.optimizer is not None else self._setpoint
+
+    @property
+    def previous_values(self):
+        return self.optimizer.previous_values if self.optimizer is not None else self._setpoint
+
+    # the scan itself takes no gradient steps
+    @property
+    def updated(self):
+        return self.optimizer.updated if self.optimizer is not None else False
+
+    @property
+    def gradient(self):
+        return self.optimizer.gradient if self.optimizer is not None else self._gradient
+
+    @property
+    def converged(self):
+        if self.optimizer is not None:
+            return self.optimizer.converged
+        return np.full(self.size, self.fit is not None)
+
+    @property
+    def is_converged(self):
+        return bool(self.converged.all()) or (self.optimizer is not None and self.optimizer.is_converged)
+
+    def converged_names(self):
+        return [name for name, converged in zip(self.names, self.converged) if converged]
+
+    def summary(self):
+        fit = self.fit
+        lines = [f"Scanned {len(self.design)} setpoints ({fit.samples} image groups), quadratic fit r2 {fit.r_squared:.3f}, residual {fit.residual:.2f}"]
+        for index, name in enumerate(self.names):
+            lines.append(f"  {name}: slope {fit.gradient[index]:.4g}, curvature {fit.hessian[index, index]:.4g}, learning rate {self.fitted_learning_rates[index]:.4g}")
+        maximum = fit.maximum(self.lower_bounds, self.upper_bounds)
+        if maximum is not None:
+            lines.append(f"  fitted peak at {maximum.astype(int).tolist()}, best measured at {self.best_setpoint.astype(int).tolist()}")
+        return '\n'.join(lines)
+
+
+# build a scan followed by the momentum optimizer from rows of parameter settings (see optimizer_from_settings),
+# the momentum run keeps the windows around the initial values
+def scan_from_settings(parameter_settings, initial_values, design='sweeps', points=5, repeats=1, learning_rate_fraction=0.5, rng=None, **optimizer_settings):
+    lower_bounds, upper_bounds = bounds_from_settings(parameter_settings, initial_values)
+    names = [setting["name"] for setting in parameter_settings]
+    learning_rates = optimizer_settings.pop("learning_rates", [setting["learning_rate"] for setting in parameter_settings])
+    if all("perturbation" in setting for setting in parameter_settings):
+        optimizer_settings.setdefault("perturbation", [setting["perturbation"] for setting in parameter_settings])
+    if all("step_size" in setting for setting in parameter_settings):
+        optimizer_settings.setdefault("step_sizes", [setting["step_size"] for setting in parameter_settings])
+
+    def make_optimizer(fitted_learning_rates, start):
+        return ParameterOptimizer(names, start, lower_bounds, upper_bounds, fitted_learning_rates, rng=rng, **optimizer_settings)
+
+    return SensitivityScan(names, initial_values, lower_bounds, upper_bounds, design, points, repeats, learning_rates, learning_rate_fraction, make_optimizer, rng)
+
+
+def main(argv=None):
+    from benchmark_suite import LANDSCAPES
+    from simulation import Simulator
+
+    parser = argparse.ArgumentParser(description="Scan a simulated landscape, fit the quadratic and run the momentum optimizer with the fitted learning rates.")
+    parser.add_argument('--landscape', choices=sorted(LANDSCAPES), default='gaussian')
+    parser.add_argument('--design', choices=SCAN_DESIGNS, default='sweeps')
+    parser.add_argument('--points', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--image-groups', type=int, default=300, help="image groups of the scan and the momentum run together")
+    parser.add_argument('--gradient-estimator', choices=('difference', 'spsa'), default='spsa')
+    parser.add_argument('--momentum', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args(argv)
+
+    settings, model, best_count = LANDSCAPES[arguments.landscape]()
+    rng = np.random.default_rng(arguments.seed)
+
+    def make_optimizer(learning_rates, start):
+        return ParameterOptimizer(**dict(settings, initial_values=start, learning_rates=learning_rates), gradient_estimator=arguments.gradient_estimator, momentum=arguments.momentum, rng=rng)
+
+    scan = SensitivityScan(settings["names"], settings["initial_values"], settings["lower_bounds"], settings["upper_bounds"], arguments.design, arguments.points, arguments.repeats,
+                           settings["learning_rates"], make_optimizer=make_optimizer, rng=rng)
+    print(f"{len(scan.design)} setpoints, travel {travel(scan.design, scan.center, scan.scale):.1f} windows")
+    simulator = Simulator(scan, model)
+    simulator.run(len(scan.design) * arguments.repeats)
+    print(scan.summary())
+    result = simulator.run(arguments.image_groups - simulator.image_groups_processed)
+    print(f"best count {result['best_count']:.2f} of {best_count:.2f} at {result['best_setpoint'].astype(int).tolist()} after {result['image_groups']} image groups")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import json
+import socket
+import threading
+
+# port the headless runner publishes its session on and the viewer attaches to
+DEFAULT_PORT = 47800
+
+
+class SessionPublisher:
+    # streams the history of a running session to viewers over TCP, one json message per line
+    # a viewer that attaches gets a 'hello' with everything still held in memory, then after every image group
+    # a 'points' message with only the points it has not seen yet (a slow or closed viewer is dropped, never waited on)
+    def __init__(self, history, parameter_names, host='127.0.0.1', port=DEFAULT_PORT, send_timeout=1.0):
+        self.history = history
+        self.parameter_names = list(parameter_names)
+        self.send_timeout = send_timeout
+
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()
+
+        # client socket -> number of points of each series already sent to it
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.accept_thread = threading.Thread(target=self._accept, name='session-publisher', daemon=True)
+        self.accept_thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            client.settimeout(self.send_timeout)
+            with self.lock:
+                totals, series = self._new_points({})
+                widths = {name: self.history.series[name].point_shape[0] if self.history.series[name].point_shape else None for name in series}
+                if self._send(client, {"type": "hello", "parameter_names": self.parameter_names, "widths": widths, "series": series}):
+                    self.clients[client] = totals
+
+    # points of every series past the totals already sent, and the new totals
+    def _new_points(self, sent_totals):
+        with self.history.lock:
+            totals = {}
+            points = {}
+            for name, series in self.history.series.items():
+                totals[name] = series.total
+                new = min(series.total - sent_totals.get(name, 0), series.length)
+                points[name] = series.view()[series.length - new:].tolist() if new > 0 else []
+        return totals, points
+
+    def _send(self, client, message):
+        try:
+            client.sendall((json.dumps(message) + '\n').encode())
+            return True
+        except OSError:
+            client.close()
+            return False
+
+    # send the new points to every attached viewer (called after every image group)
+    def publish(self):
+        with self.lock:
+            for client, sent_totals in list(self.clients.items()):
+                totals, points = self._new_points(sent_totals)
+                if not any(points.values()):
+                    continue
+                if self._send(client, {"type": "points", "series": points}):
+                    self.clients[client] = totals
+                else:
+                    del self.clients[client]
+
+    @property
+    def viewers(self):
+        return len(self.clients)
+
+    def close(self):
+        self.running = False
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients.clear()
+
+
+class SessionSubscriber:
+    # the viewer side of SessionPublisher: iterating over it yields the decoded messages until the session ends
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, timeout=10):
+        self.connection = socket.create_connection((host, port), timeout=timeout)
+        self.connection.settimeout(None)
+        self.stream = self.connection.makefile('r', encoding='utf-8')
+
+    def __iter__(self):
+        for line in self.stream:
+            yield json.loads(line)
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
+
+
+# copy the messages of a session into a local HistoryStore (the viewer plots from it like the GUI does)
+def apply_message(history, message):
+    if message["type"] == "hello":
+        for name, width in message["widths"].items():
+            if name not in history:
+                history.add_series(name, width=width)
+    for name, points in message["series"].items():
+        for point in points:
+            history.append(name, point)
@@ -0,0 +1,182 @@
+import time
+
+import numpy as np
+
+from history_store import HistoryStore
+
+# a beamline model is any callable that takes a setpoint (one value per optimized parameter)
+# and returns the mean count an image group would measure there
+
+
+# the test function from the README: C(f, phi2) = (0.1 (f + phi2))^2 sin(0.01 (f + phi2))
+def readme_count_function(setpoint):
+    x = setpoint[0] + setpoint[1]
+    return (0.1 * x) ** 2 * np.sin(0.01 * x)
+
+
+class AnalyticModel:
+    # wraps a plain function of the setpoint, sign=-1 turns a minimization test function into a count to maximize
+    def __init__(self, function, sign=1):
+        self.function = function
+        self.sign = sign
+
+    def __call__(self, setpoint):
+        return self.sign * float(self.function(np.asarray(setpoint, dtype=float)))
+
+
+class GaussianPeakModel:
+    # smooth single peak, a reasonable stand-in for the count around the optimal focus and dispersion
+    def __init__(self, peak, widths, height=10000, background=0):
+        self.peak = np.asarray(peak, dtype=float)
+        self.widths = np.asarray(widths, dtype=float)
+        self.height = height
+        self.background = background
+
+    def __call__(self, setpoint):
+        distance = (np.asarray(setpoint, dtype=float) - self.peak) / self.widths
+        return self.background + self.height * float(np.exp(-0.5 * np.dot(distance, distance)))
+
+
+class MultiPeakModel:
+    # sum of gaussian peaks, a landscape with local maxima next to the global one
+    def __init__(self, peaks, widths, heights, background=0):
+        self.peaks = [GaussianPeakModel(peak, width, height) for peak, width, height in zip(peaks, widths, heights)]
+        self.background = background
+
+    def __call__(self, setpoint):
+        return self.background + sum(peak(setpoint) for peak in self.peaks)
+
+
+class NoisyModel:
+    # adds shot-to-shot noise to another model, the noise of an image group shrinks with sqrt(image_group)
+    def __init__(self, model, noise=0, relative_noise=0, image_group=1, rng=None):
+        self.model = model
+        self.noise = noise
+        self.relative_noise = relative_noise
+        self.image_group = image_group
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def __call__(self, setpoint):
+        count = self.model(setpoint)
+        sigma = np.hypot(self.noise, self.relative_noise * count) / np.sqrt(self.image_group)
+        return count + sigma * self.rng.standard_normal()
+
+
+class DriftingModel:
+    # the response of another model moving by `velocity` (one value per parameter) with every image group measured,
+    # the optimum drifting over a shift as the laser conditions change
+    def __init__(self, model, velocity):
+        self.model = model
+        self.velocity = np.asarray(velocity, dtype=float)
+        self.image_groups = 0
+
+    @property
+    def offset(self):
+        return self.velocity * self.image_groups
+
+    def __call__(self, setpoint):
+        count = self.model(np.asarray(setpoint, dtype=float) - self.offset)
+        self.image_groups += 1
+        return count
+
+
+class RecordedResponseModel:
+    # response surface interpolated from recorded (setpoint, count) pairs by inverse distance weighting
+    # of the nearest recorded points, distances are measured in units of 'scales' (e.g. the parameter windows)
+    def __init__(self, setpoints, counts, scales=1, neighbours=8, power=2):
+        self.setpoints = np.atleast_2d(np.asarray(setpoints, dtype=float))
+        self.counts = np.asarray(counts, dtype=float)
+        if len(self.setpoints) != len(self.counts):
+            raise ValueError("every recorded setpoint needs exactly one count")
+        if len(self.counts) == 0:
+            raise ValueError("a recorded response needs at least one point")
+
+        self.scales = np.broadcast_to(np.asarray(scales, dtype=float), self.setpoints.shape[1:])
+        self.scaled_setpoints = self.setpoints / self.scales
+        self.neighbours = min(neighbours, len(self.counts))
+        self.power = power
+
+    # build the surface from the 'parameters' and 'count' series of a recorded run
+    @classmethod
+    def from_history(cls, history, **kwargs):
+        length = min(len(history['parameters']), len(history['count']))
+        return cls(history['parameters'][:length], history['count'][:length], **kwargs)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as recorded:
+            return cls(recorded['parameters'], recorded['count'], **kwargs)
+
+    def save(self, path):
+        np.savez(path, parameters=self.setpoints, count=self.counts)
+
+    def __call__(self, setpoint):
+        distances = np.linalg.norm(self.scaled_setpoints - np.asarray(setpoint, dtype=float) / self.scales, axis=1)
+
+        nearest = np.argpartition(distances, self.neighbours - 1)[:self.neighbours]
+        if distances[nearest].min() == 0:
+            return float(self.counts[nearest[np.argmin(distances[nearest])]])
+
+        weights = distances[nearest] ** -self.power
+        return float(np.dot(weights, self.counts[nearest]) / weights.sum())
+
+
+class Simulator:
+    # drives the real optimizer against a beamline model, no Qt, no parameter files and no images
+    def __init__(self, optimizer, model, image_group=1, history_max_length=None):
+        self.optimizer = optimizer
+        self.model = model
+        self.image_group = image_group
+
+        self.history = HistoryStore(max_length=history_max_length)
+        self.history.add_series('count')
+        self.history.add_series('parameters', width=optimizer.size)
+        self.history.add_series('gradient', width=optimizer.size)
+
+        self.image_groups_processed = 0
+        self.steps = 0
+
+    @property
+    def shots(self):
+        return self.image_groups_processed * self.image_group
+
+    # measure one image group at the optimizer's setpoint and hand the count to the optimizer
+    def step(self):
+        setpoint = self.optimizer.setpoint
+        count = self.model(setpoint)
+
+        self.history.append('count', count)
+        self.history.append('parameters', setpoint)
+        self.image_groups_processed += 1
+
+        self.optimizer.tell(count)
+        if self.optimizer.updated:
+            self.steps += 1
+            self.history.append('gradient', self.optimizer.gradient)
+        return count
+
+    # run for a number of image groups, optionally stopping at the first convergence
+    def run(self, image_groups, stop_when_converged=False):
+        start_time = time.perf_counter()
+        for _ in range(image_groups):
+            self.step()
+            if stop_when_converged and self.optimizer.updated and self.optimizer.is_converged:
+                break
+        return self.result(time.perf_counter() - start_time)
+
+    def result(self, elapsed=None):
+        counts = self.history['count']
+        best = int(np.argmax(counts))
+        result = {
+            "image_groups": self.image_groups_processed,
+            "steps": self.steps,
+            "shots": self.shots,
+            "converged": self.optimizer.is_converged,
+            "best_count": float(counts[best]),
+            "best_setpoint": self.history['parameters'][best].copy(),
+            "final_setpoint": self.optimizer.values.copy(),
+            }
+        if elapsed is not None:
+            result["elapsed"] = elapsed
+            result["image_groups_per_second"] = self.image_groups_processed / elapsed if elapsed > 0 else float('inf')
+        return result
@@ -0,0 +1,72 @@
+import numpy as np
+
+from bayesian_optimizer import BayesianOptimizer, IncrementalGaussianProcess
+from simulation import GaussianPeakModel, NoisyModel, Simulator
+
+
+def test_incremental_factor_matches_a_full_solve():
+    rng = np.random.default_rng(0)
+    X = rng.random((30, 3))
+    y = rng.random(30)
+
+    gaussian_process = IncrementalGaussianProcess(3, length_scales=0.3, noise_ratio=0.05)
+    for x, count in zip(X, y):
+        gaussian_process.add(x, count)
+
+    kernel = gaussian_process.kernel(X, X) + 0.05 * np.eye(30)
+    alpha = np.linalg.solve(kernel, (y - y.mean()) / y.std())
+    np.testing.assert_allclose(gaussian_process.alpha, alpha, atol=1e-9)
+
+    X_new = rng.random((5, 3))
+    cross_kernel = gaussian_process.kernel(X, X_new)
+    mean, variance = gaussian_process.predict(X_new)
+    np.testing.assert_allclose(mean, y.mean() + y.std() * cross_kernel.T @ alpha, atol=1e-9)
+    np.testing.assert_allclose(variance, y.var() * (1 - np.einsum('ij,ij->j', cross_kernel, np.linalg.solve(kernel, cross_kernel))), atol=1e-9)
+
+    # the mean at the measured points needs no kernel
+    np.testing.assert_allclose(gaussian_process.fitted_mean(), gaussian_process.predict(X)[0], atol=1e-9)
+
+
+def test_a_tell_never_evaluates_the_kernel_between_all_measured_points():
+    optimizer = BayesianOptimizer(['focus', 'second_dispersion'], [0, 0], [-100, -100], [100, 100], candidates=200, rng=np.random.default_rng(3))
+    gaussian_process = optimizer.gaussian_process
+    kernel = gaussian_process.kernel
+    evaluations = []
+
+    def counting_kernel(A, B):
+        evaluations.append((len(A), len(B)))
+        return kernel(A, B)
+    gaussian_process.kernel = counting_kernel
+
+    model = GaussianPeakModel(peak=[20, -30], widths=[40, 40])
+    for _ in range(40):
+        evaluations.clear()
+        optimizer.tell(model(optimizer.setpoint))
+        measured = len(gaussian_process)
+        # the new point against the measured ones (the factor update), then the candidates against the measured
+        # ones and against each pick, never the measured points against each other
+        assert evaluations[0] == (measured - 1, 1)
+        assert measured == 1 or (measured, measured) not in evaluations
+        # kernel entries of a tell: linear in the measured points for a given candidate cloud
+        candidates = max(rows for rows, _ in evaluations)
+        assert sum(rows * columns for rows, columns in evaluations) <= candidates * (measured + optimizer.batch_size) + 2 * measured
+
+
+def test_batches_of_rounded_setpoints_inside_the_bounds_reach_the_peak():
+    model = GaussianPeakModel(peak=[-140, 36300, -27500], widths=[14, 350, 1400])
+    optimizer = BayesianOptimizer(
+        ['focus', 'second_dispersion', 'third_dispersion'],
+        [-150, 36100, -27000],
+        [-170, 35600, -29000],
+        [-130, 36600, -25000],
+        batch_size=4,
+        rng=np.random.default_rng(1),
+    )
+    simulator = Simulator(optimizer, NoisyModel(model, noise=100, rng=np.random.default_rng(2)))
+    simulator.run(60)
+
+    setpoints = simulator.history['parameters']
+    assert np.all(setpoints == np.rint(setpoints))
+    assert np.all(setpoints >= optimizer.lower_bounds)
+    assert np.all(setpoints <= optimizer.upper_bounds)
+    assert model(optimizer.values) > 0.9 * model.height
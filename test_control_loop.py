@@ -0,0 +1,121 @@
+import time
+import random
+import threading
+
+import pytest
+
+from control_loop import ControlLoop
+
+
+class Frame:
+    def __init__(self, number, timestamp=None):
+        self.number = number
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return f'frame {self.number}'
+
+
+def slow_score(frame):
+    time.sleep(random.uniform(0, 0.005))
+    return float(frame.number)
+
+
+def test_counts_are_decided_in_arrival_order():
+    decided = []
+    loop = ControlLoop(slow_score, decide=lambda frame, count: decided.append(count) or False, actuate=lambda: None, workers=4, max_queue_size=4)
+    loop.start()
+    for number in range(50):
+        loop.submit(Frame(number))
+    assert loop.wait_until_idle(timeout=10)
+    loop.stop()
+
+    assert decided == [float(number) for number in range(50)]
+    assert loop.stats()["frames_delivered"] == 50 and loop.frames_dropped == 0
+
+
+def test_frames_taken_before_the_setpoint_settled_are_dropped():
+    decided = []
+    actuations = []
+    published = threading.Event()
+
+    def decide(frame, count):
+        decided.append(frame.number)
+        # the first frame completes a group
+        return frame.number == 0
+
+    def actuate():
+        time.sleep(0.05)
+        actuations.append(time.time())
+
+    loop = ControlLoop(lambda frame: 1.0, decide, actuate, publish=published.set, workers=2)
+    loop.start()
+    # taken while the first group was being decided and actuated
+    for number in range(10):
+        loop.submit(Frame(number, timestamp=time.time()))
+    assert loop.wait_until_idle(timeout=10)
+    assert decided == [0] and len(actuations) == 1
+    assert loop.frames_unsettled == 9
+    assert published.wait(5)
+
+    # taken at the new setpoint
+    loop.submit(Frame(10))
+    assert loop.wait_until_idle(timeout=10)
+    loop.stop()
+    assert decided == [0, 10]
+
+
+def test_a_full_queue_drops_frames_without_blocking_the_source():
+    release = threading.Event()
+    loop = ControlLoop(lambda frame: release.wait() and 1.0, lambda frame, count: False, lambda: None, workers=1, max_queue_size=2, max_in_flight=1, block_when_full=False)
+    loop.start()
+    start = time.perf_counter()
+    accepted = [loop.submit(Frame(number)) for number in range(10)]
+    assert time.perf_counter() - start < 1
+    assert not all(accepted) and loop.frames_dropped == accepted.count(False)
+
+    release.set()
+    assert loop.wait_until_idle(timeout=10)
+    loop.stop()
+    assert loop.frames_delivered == accepted.count(True)
+
+
+def test_stop_cancels_the_queued_frames_but_finishes_the_actuation():
+    actuation_started = threading.Event()
+    actuated = []
+
+    def actuate():
+        actuation_started.set()
+        time.sleep(0.2)
+        actuated.append(True)
+
+    loop = ControlLoop(lambda frame: time.sleep(0.01) or 1.0, lambda frame, count: frame.number == 0, actuate, workers=1, max_queue_size=100)
+    loop.start()
+    threading.Thread(target=lambda: [loop.submit(Frame(number, timestamp=0)) for number in range(50)], daemon=True).start()
+    assert actuation_started.wait(5)
+
+    start = time.perf_counter()
+    loop.stop(timeout=5)
+    assert time.perf_counter() - start < 2
+    assert actuated == [True]
+    assert not loop.thread.is_alive()
+    assert loop.wait_until_idle(timeout=1)
+
+
+def test_image_tracker_hands_on_every_new_image_once(tmp_path):
+    pytest.importorskip('watchdog')
+    from image_watcher import ImageTracker
+
+    (tmp_path / 'old.tiff').write_bytes(b'')
+    tracker = ImageTracker(str(tmp_path), remember=3)
+
+    paths = []
+    for number in range(3):
+        path = tmp_path / f'image_{number}.tiff'
+        path.write_bytes(b'')
+        paths.append(str(path))
+
+    assert tracker.new_images([str(tmp_path / 'old.tiff'), paths[1], str(tmp_path / 'missing.tiff')]) == [paths[1]]
+    assert tracker.new_images([paths[2], paths[1], paths[0]]) == [paths[0], paths[2]]
+    assert tracker.new_images(paths) == []
+    assert len(tracker.seen) == 3
@@ -0,0 +1,61 @@
+import pytest
+
+from device_state import DeviceFileError, read_device_states
+
+
+@pytest.fixture
+def device_files(tmp_path):
+    mirror = tmp_path / 'dm_parameters.txt'
+    dazzler = tmp_path / 'dazzler_parameters.txt'
+    mirror.write_text('-150 3 7')
+    dazzler.write_text('order2 = 36100\norder3 = -27000\n')
+    return mirror, dazzler
+
+
+SETTINGS = [
+    {"name": "focus", "device": "mirror", "key": 0},
+    {"name": "second_dispersion", "device": "dazzler", "key": 0},
+    {"name": "third_dispersion", "device": "dazzler", "key": 1},
+    ]
+
+
+def test_only_changed_devices_are_written_and_the_files_round_trip(device_files):
+    mirror, dazzler = device_files
+    devices = read_device_states(str(mirror), str(dazzler))
+    assert [devices.value(setting) for setting in SETTINGS] == [-150, 36100, -27000]
+
+    # the same setpoint writes nothing
+    devices.set_setpoint(SETTINGS, [-150.0, 36100.0, -27000.0])
+    assert devices.write() == []
+
+    devices.set_setpoint(SETTINGS, [-149.0, 36100.0, -27000.0])
+    assert devices.write() == ['mirror']
+    assert devices.write() == []
+    assert mirror.read_text() == '-149 3 7'
+    assert not (mirror.parent / 'dm_parameters.txt.tmp').exists()
+
+    devices.set_setpoint(SETTINGS, [-149, 36150, -26900])
+    assert devices.write() == ['dazzler']
+    assert dazzler.read_text() == 'order2 = 36150\norder3 = -26900\n'
+    assert devices.files()["dazzler"] == ('dazzler_parameters.txt', b'order2 = 36150\norder3 = -26900\n')
+
+    reread = read_device_states(str(mirror), str(dazzler))
+    assert [reread.value(setting) for setting in SETTINGS] == [-149, 36150, -26900]
+
+
+@pytest.mark.parametrize('mirror_text, dazzler_text, message', [
+    ('', 'order2 = 1\norder3 = 2\n', 'no actuator values'),
+    ('-150 x 7', 'order2 = 1\norder3 = 2\n', "actuator 1 is 'x'"),
+    ('-150', 'order2 = 1\n', 'missing order3'),
+    ('-150', 'order2 = 1\norder3 = \n', "line 2 is 'order3 = '"),
+    ('-150', 'order2 = 1\norder4 = 2\n', "unknown order 'order4'"),
+    ('-150', 'order2 = 1.5\norder3 = 2\n', "order2 is '1.5'"),
+    ])
+def test_bad_files_give_a_clear_error(tmp_path, mirror_text, dazzler_text, message):
+    mirror = tmp_path / 'dm_parameters.txt'
+    dazzler = tmp_path / 'dazzler_parameters.txt'
+    mirror.write_text(mirror_text)
+    dazzler.write_text(dazzler_text)
+
+    with pytest.raises(DeviceFileError, match=message):
+        read_device_states(str(mirror), str(dazzler))
@@ -0,0 +1,79 @@
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+from device_transport import DeviceTransport, FTPDeviceConnection
+
+
+# a local stand-in for the ftp servers of the mirror and dazzler computers
+@pytest.fixture
+def ftp_server(tmp_path):
+    directories = {name: tmp_path / name for name in ("mirror", "dazzler")}
+    authorizer = DummyAuthorizer()
+    for name, directory in directories.items():
+        directory.mkdir()
+        authorizer.add_user(name, "password", str(directory), perm="elradfmw")
+
+    handler = type('Handler', (FTPHandler,), {"authorizer": authorizer})
+    server = FTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"timeout": 0.05}, daemon=True)
+    thread.start()
+
+    yield server.socket.getsockname()[1], directories
+
+    server.close_all()
+    thread.join(timeout=5)
+
+
+def make_transport(port):
+    return DeviceTransport({
+        name: FTPDeviceConnection(name, host="127.0.0.1", port=port, user=name, password="password")
+        for name in ("mirror", "dazzler")
+        })
+
+
+def test_uploads_only_the_devices_that_changed(ftp_server):
+    port, directories = ftp_server
+    transport = make_transport(port)
+
+    results = transport.upload({"mirror": ("dm_parameters.txt", b"-150 0 0"), "dazzler": ("dazzler_parameters.txt", b"order2 = 36100\norder3 = -27000\n")})
+    assert results == {"mirror": 'uploaded', "dazzler": 'uploaded'}
+    assert (directories["mirror"] / "dm_parameters.txt").read_bytes() == b"-150 0 0"
+
+    results = transport.upload({"mirror": ("dm_parameters.txt", b"-149 0 0"), "dazzler": ("dazzler_parameters.txt", b"order2 = 36100\norder3 = -27000\n")})
+    assert results == {"mirror": 'uploaded', "dazzler": 'unchanged'}
+    assert (directories["mirror"] / "dm_parameters.txt").read_bytes() == b"-149 0 0"
+
+    stats = transport.stats()
+    assert stats["mirror"]["uploads"] == 2 and stats["dazzler"]["uploads"] == 1
+    assert stats["mirror"]["mean_latency_ms"] is not None
+    transport.close()
+
+
+def test_reconnects_after_the_connection_dropped(ftp_server):
+    port, directories = ftp_server
+    transport = make_transport(port)
+
+    transport.upload({"mirror": ("dm_parameters.txt", b"1")})
+    transport.connections["mirror"].ftp.sock.shutdown(socket.SHUT_RDWR)
+
+    assert transport.upload({"mirror": ("dm_parameters.txt", b"2")}) == {"mirror": 'uploaded'}
+    assert (directories["mirror"] / "dm_parameters.txt").read_bytes() == b"2"
+    assert transport.stats()["mirror"]["reconnects"] == 1
+    transport.close()
+
+
+def test_failed_uploads_are_reported_and_retried():
+    transport = DeviceTransport({"mirror": FTPDeviceConnection("mirror", host="127.0.0.1", port=1, timeout=1)})
+
+    result = transport.upload({"mirror": ("dm_parameters.txt", b"1")})["mirror"]
+    assert isinstance(result, OSError)
+    assert isinstance(transport.upload({"mirror": ("dm_parameters.txt", b"1")})["mirror"], OSError)
+    assert transport.stats()["mirror"]["failures"] == 2
+    transport.close()
@@ -0,0 +1,98 @@
+import time
+import threading
+
+import pytest
+
+from control_loop import ControlLoop
+from diagnostics import DiagnosticFusion, FusedObjective, ShotMatcher, shot_id
+
+
+class Frame:
+    def __init__(self, name, timestamp):
+        self.name = name
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return self.name
+
+
+def test_shot_ids_of_files_and_ring_frames():
+    assert shot_id('/data/spectrometer/spectrometer_000123.tiff') == 123
+    assert shot_id('shot-7_cam2.npy') == 2
+    assert shot_id('background.tiff') is None
+
+    class RingFrame:
+        sequence = 41
+    assert shot_id(RingFrame()) == 41
+
+
+def test_frames_are_matched_by_shot_id_and_lost_partners_are_dropped():
+    matcher = ShotMatcher(['screen', 'spectrometer'], match='shot_id')
+    shots = []
+    arrivals = [('screen', 1), ('spectrometer', 1), ('screen', 2), ('screen', 3), ('spectrometer', 3), ('spectrometer', 4), ('screen', 5), ('screen', 4)]
+    for source, shot in arrivals:
+        result = matcher.add(source, f'{source}_{shot:04d}.tiff', float(shot))
+        if result is not None:
+            shots.append(result)
+
+    assert [shot.key for shot in shots] == [1, 3, 4]
+    assert shots[1].counts == {'screen': 3.0, 'spectrometer': 3.0}
+    # screen 2 never got a partner, screen 5 is still waiting for one
+    assert matcher.stats() == {"shots_matched": 3, "frames_unmatched": 1, "frames_pending": 1}
+
+
+def test_frames_are_matched_by_timestamp_within_the_tolerance():
+    matcher = ShotMatcher(['screen', 'spectrometer', 'profile'], match='timestamp', tolerance=0.002, max_pending=4)
+    shots = []
+    for shot in range(10):
+        taken = 100 + shot * 0.1
+        for source, delay in (('screen', 0.0), ('profile', 0.001), ('spectrometer', -0.0008)):
+            # the profile camera misses shot 4
+            if source == 'profile' and shot == 4:
+                continue
+            result = matcher.add(source, Frame(f'{source} {shot}', taken + delay), shot)
+            if result is not None:
+                shots.append(result)
+
+    # the key of a shot is the timestamp of the frame that completed it
+    assert [shot.key for shot in shots] == pytest.approx([100 + shot * 0.1 - 0.0008 for shot in range(10) if shot != 4])
+    assert [shot.timestamp for shot in shots] == pytest.approx([100 + shot * 0.1 - 0.0008 for shot in range(10) if shot != 4])
+    assert all(set(shot.counts.values()) == {shot.counts['screen']} for shot in shots)
+    assert matcher.frames_unmatched == 2 and matcher.stats()["frames_pending"] == 0
+
+
+def test_weighted_objective_with_a_constraint():
+    objective = FusedObjective([
+        {"name": "screen", "weight": 1.0},
+        {"name": "spectrometer", "weight": 0.5, "maximum": 800},
+        {"name": "profile", "weight": 0, "minimum": 2000, "penalty": 5},
+        ])
+    assert objective({"screen": 1000, "spectrometer": 600, "profile": 2500}) == 1300
+    assert objective({"screen": 1000, "spectrometer": 900, "profile": 1900}) == 1000 + 450 - 10 * 100 - 5 * 100
+
+
+def test_sources_are_scored_on_their_own_workers_and_fused_per_shot():
+    def slow(frame):
+        time.sleep(0.02)
+        return 1.0
+
+    shots = []
+    fusion = DiagnosticFusion([{"name": "screen"}, {"name": "spectrometer", "weight": 2.0}], lambda shot, objective: shots.append((shot.key, objective)) or False, match='shot_id')
+    loop = ControlLoop({"screen": slow, "spectrometer": slow}, decide=fusion.decide, actuate=lambda: None, workers={"screen": 1, "spectrometer": 1})
+    loop.start()
+    with pytest.raises(ValueError):
+        loop.submit('image_0001.tiff')
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=lambda source=source: [loop.submit(f'{source}_{shot:04d}.tiff', source) for shot in range(20)]) for source in ('screen', 'spectrometer')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loop.wait_until_idle(timeout=10)
+    elapsed = time.perf_counter() - start
+    loop.stop()
+
+    assert shots == [(shot, 3.0) for shot in range(20)]
+    # one worker per source: the two sources are scored side by side, not one after the other (0.8 s)
+    assert elapsed < 0.65
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from benchmark_suite import LANDSCAPES
+from drift_tracking import DriftTracker, WindowedGradient, tracker_from_settings
+from parameter_optimizer import ParameterOptimizer
+from simulation import DriftingModel, NoisyModel, Simulator
+
+
+def test_running_sums_match_a_fit_from_scratch():
+    rng = np.random.default_rng(0)
+    window = WindowedGradient(3, window=15, scale=[2, 50, 200])
+    gradient = np.array([30.0, -2.0, 0.5])
+    history = []
+    for group in range(1, 200):
+        # the setpoints wander far from where the window started
+        setpoint = np.round([-150 + group, 36100 + 20 * group, -27000 - 50 * group] + rng.normal(0, [2, 50, 200]))
+        count = 5000 + 3 * group + gradient @ setpoint + rng.normal(0, 10)
+        window.add(setpoint, count)
+        history.append((group, setpoint, count))
+
+        if window.ready and group % 7 == 0:
+            recent = history[-15:]
+            features = np.array([[1, group_index, *setpoint] for group_index, setpoint, _ in recent])
+            expected = np.linalg.lstsq(features, [count for *_, count in recent], rcond=None)[0][2:]
+            estimate, error = window.estimate()
+            assert np.allclose(estimate, expected, rtol=1e-6, atol=1e-6)
+            assert np.all(np.abs(estimate - gradient) < 4 * error)
+    assert len(window.groups) == 15
+
+
+def test_an_unmoved_parameter_has_no_significant_gradient():
+    window = WindowedGradient(2, window=8)
+    for group in range(8):
+        window.add([group % 3, 5], 100 + group % 3)
+    gradient, error = window.estimate()
+    assert gradient[0] == pytest.approx(1) and gradient[1] == 0 and error[1] == np.inf
+
+
+def drifting_run(optimizer, model, image_groups):
+    counts = []
+    simulator = Simulator(optimizer, model, history_max_length=100)
+    for _ in range(image_groups):
+        counts.append(model.model.model(np.asarray(optimizer.setpoint, dtype=float) - model.offset))
+        simulator.step()
+    return np.array(counts)
+
+
+def test_tracker_stays_on_a_drifting_peak():
+    settings, peak, best_count = LANDSCAPES['gaussian']()
+    settings.update(lower_bounds=[-300, 34000, -35000], upper_bounds=[0, 38000, -20000])
+    velocity = [0.01, 0.5, 2.0]
+
+    model = DriftingModel(NoisyModel(peak, noise=100, rng=np.random.default_rng(1)), velocity)
+    tracker = DriftTracker(settings["names"], settings["initial_values"], settings["lower_bounds"], settings["upper_bounds"], settings["learning_rates"], settings["perturbation"],
+                           rng=np.random.default_rng(0))
+    states = []
+    tracker_counts = []
+    simulator = Simulator(tracker, model, history_max_length=100)
+    for _ in range(1500):
+        tracker_counts.append(peak(np.asarray(tracker.setpoint, dtype=float) - model.offset))
+        simulator.step()
+        states.append(tracker.state)
+    tracker_counts = np.array(tracker_counts)
+
+    # by the end the peak moved 15, 750 and 3000 away from where it started (about two widths)
+    assert tracker_counts[-500:].mean() > 0.97 * best_count
+    assert 'track' in states[:300] and states.count('track') > 0.5 * len(states)
+    assert len(tracker.window.groups) == 12 and len(tracker.recent_counts) == 5
+
+    model = DriftingModel(NoisyModel(peak, noise=100, rng=np.random.default_rng(1)), velocity)
+    optimizer = ParameterOptimizer(**settings, gradient_estimator='spsa', momentum=0.5, rng=np.random.default_rng(0))
+    assert tracker_counts[-500:].mean() > drifting_run(optimizer, model, 1500)[-500:].mean()
+
+
+def test_tracker_converges_again_when_the_count_drops():
+    settings = [
+        {"name": "focus", "window": 50, "learning_rate": 5, "perturbation": 2},
+        {"name": "second_dispersion", "window": 1000, "learning_rate": 5, "perturbation": 50},
+        ]
+    tracker = tracker_from_settings(settings, [-150, 36100], rng=np.random.default_rng(2))
+    noise = np.random.default_rng(3)
+
+    def response(setpoint):
+        return 10000 - 20 * (setpoint[0] + 150) ** 2 - 0.01 * (setpoint[1] - 36100) ** 2 + noise.normal(0, 50)
+
+    for _ in range(100):
+        tracker.tell(response(tracker.setpoint))
+    assert tracker.is_converged and tracker.converged_names() == ["focus", "second_dispersion"]
+
+    # the peak jumps: tracking is given up and the tracker converges on the new peak
+    changes = []
+    for _ in range(300):
+        tracker.tell(response(tracker.setpoint - np.array([8, 0])))
+        if tracker.state_changed:
+            changes.append(tracker.state)
+    assert changes[:2] == ['converge', 'track']
+    assert abs(tracker.values[0] + 142) <= 2
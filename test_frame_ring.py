@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from frame_ring import FrameRing, FrameRingSource, score_ring_frame
+
+
+def make_frame(value, shape=(48, 64)):
+    return np.full(shape, value, dtype=np.uint16)
+
+
+def test_frames_are_read_in_place_and_in_order(tmp_path):
+    path = str(tmp_path / 'frames.ring')
+    writer = FrameRing.create(path, (48, 64), slots=4)
+    writer.write(make_frame(1))
+
+    received = []
+    source = FrameRingSource(path, received.extend)
+    source.open()
+    # frames written before the source opened belong to an earlier run
+    assert source.read_new_frames() == []
+
+    for value in (2, 3, 4):
+        writer.write(make_frame(value))
+    frames = source.read_new_frames()
+    assert [frame.sequence for frame in frames] == [2, 3, 4]
+    assert [int(frame.array[0, 0]) for frame in frames] == [2, 3, 4]
+    assert all(frame.intact for frame in frames)
+    # the frame is a view into the mapping, not a copy
+    assert not frames[0].array.flags['OWNDATA']
+
+
+def test_overwritten_frames_are_dropped_or_rejected(tmp_path):
+    path = str(tmp_path / 'frames.ring')
+    writer = FrameRing.create(path, (48, 64), slots=4)
+    source = FrameRingSource(path, None)
+    source.open()
+
+    for value in range(1, 7):
+        writer.write(make_frame(value))
+    frames = source.read_new_frames()
+    assert [frame.sequence for frame in frames] == [3, 4, 5, 6]
+    assert source.frames_dropped == 2
+
+    score = score_ring_frame(lambda image: image.mean())
+    assert score(frames[0]) == 3
+    writer.write(make_frame(7))
+    assert not frames[0].intact
+    with pytest.raises(ValueError):
+        score(frames[0])
@@ -0,0 +1,77 @@
+import numpy as np
+
+from group_statistics import GroupSizer, RunningStatistics
+
+
+def test_running_statistics_match_numpy():
+    values = np.random.default_rng(0).normal(5000, 300, 50)
+    statistics = RunningStatistics()
+    for value in values:
+        statistics.add(value)
+    assert np.isclose(statistics.mean, values.mean())
+    assert np.isclose(statistics.variance, values.var(ddof=1))
+
+    # batches of any size merge into the same statistics as one value at a time
+    batched = RunningStatistics()
+    for batch in np.split(values, [1, 4, 4, 20, 49]):
+        batched.add_batch(batch)
+    assert batched.samples == 50
+    assert np.isclose(batched.mean, statistics.mean)
+    assert np.isclose(batched.variance, statistics.variance)
+    assert np.isclose(batched.standard_error, statistics.standard_error)
+
+
+def test_misfired_shots_are_rejected():
+    sizer = GroupSizer(min_shots=4, max_shots=8, adaptive=False)
+    # the misfire is the first shot of the group, it is rejected once the other shots show where the count is
+    for count in (12.0, 5010.0, 4990.0, 5005.0, 4995.0):
+        complete = sizer.add(count)
+    assert complete
+    group = sizer.finish()
+    assert group.shots == 5 and group.rejected == 1
+    assert np.isclose(group.mean, 5000.0)
+
+    sizer = GroupSizer(min_shots=2, max_shots=4, adaptive=False, misfire_count=1000)
+    for count in (50.0, 5000.0, 5010.0):
+        complete = sizer.add(count)
+    assert complete and sizer.finish().rejected == 1
+
+
+def test_groups_grow_only_when_the_step_is_hidden_in_the_noise():
+    rng = np.random.default_rng(1)
+    sizer = GroupSizer(min_shots=2, max_shots=16, significance=2.0, tolerance=10)
+
+    def measure(level):
+        while not sizer.add(rng.normal(level, 100)):
+            pass
+        return sizer.finish().shots
+
+    # learn the noise
+    for _ in range(5):
+        measure(5000)
+    # a step far above the noise is resolved with the minimum number of shots, a step within the noise takes more
+    assert measure(8000) == 2
+    assert measure(8030) > 2
+
+
+def test_a_misfire_in_a_two_shot_group_is_rejected():
+    rng = np.random.default_rng(2)
+    sizer = GroupSizer(min_shots=2, max_shots=4, adaptive=False)
+    # learn the noise
+    for _ in range(5):
+        for count in rng.normal(5000, 20, 2):
+            sizer.add(count)
+        sizer.finish()
+
+    # the misfire is told apart from the pair alone, the group takes another shot to make up for it
+    for first, second in ((12.0, 5010.0), (4990.0, 12.0)):
+        assert not sizer.add(first)
+        assert not sizer.add(second)
+        assert sizer.add(5005.0)
+        group = sizer.finish()
+        assert group.shots == 3 and group.rejected == 1
+        assert group.accepted_counts == [max(first, second), 5005.0]
+
+    # two shots that agree within the noise are both kept
+    sizer.add(5010.0)
+    assert sizer.add(4995.0) and sizer.finish().rejected == 0
@@ -0,0 +1,62 @@
+import numpy as np
+
+from history_store import HistorySeries, HistoryStore
+
+
+def test_growing_series_keeps_every_point():
+    series = HistorySeries(width=2, capacity=3)
+    reference = np.empty((0, 2))
+    for index in range(10):
+        series.append([index, -index])
+        reference = np.append(reference, [[index, -index]], axis=0)
+    assert len(series) == 10 and series.total == 10
+    assert np.array_equal(series.view(), reference)
+    assert np.array_equal(series.last(3), reference[-3:])
+
+
+def test_ring_keeps_the_newest_points_across_the_wrap():
+    series = HistorySeries(max_length=4)
+    for value in range(3):
+        series.append(value)
+    assert np.array_equal(series.view(), [0, 1, 2])
+
+    for value in range(3, 11):
+        series.append(value)
+        # every view after the wrap is one contiguous slice, oldest first
+        view = series.view()
+        assert np.array_equal(view, np.arange(value - 3, value + 1))
+        assert np.shares_memory(view, series.buffer)
+        assert series[-1] == value and np.array_equal(series.last(2), [value - 1, value])
+    assert len(series) == 4 and series.total == 11
+
+
+def test_spilled_points_and_memory_make_up_the_whole_series(tmp_path):
+    rng = np.random.default_rng(0)
+    series = HistorySeries(width=3, max_length=5, spill_path=str(tmp_path / 'nested' / 'parameters.bin'))
+    reference = np.empty((0, 3))
+    for _ in range(23):
+        point = rng.normal(size=3)
+        series.append(point)
+        reference = np.append(reference, [point], axis=0)
+
+    assert np.array_equal(series.spilled(), reference[:-5])
+    assert np.array_equal(series.view(), reference[-5:])
+    assert np.array_equal(series.full(), reference)
+    series.close()
+    assert np.array_equal(np.fromfile(tmp_path / 'nested' / 'parameters.bin').reshape(-1, 3), reference[:-5])
+
+
+def test_snapshots_copy_the_series_consistently(tmp_path):
+    store = HistoryStore(max_length=3, spill_directory=str(tmp_path))
+    store.add_series('count')
+    store.add_series('parameters', width=2)
+    for index in range(5):
+        store.append('count', index)
+        store.append('parameters', [index, 2 * index])
+
+    counts, parameters = store.snapshot(['count', 'parameters'])
+    store.append('count', 5)
+    assert np.array_equal(counts, [2, 3, 4]) and np.array_equal(parameters[:, 1], [4, 6, 8])
+    assert store.snapshot(['count'], reduce=lambda counts: counts.max()) == 5
+    assert np.array_equal(store.series['count'].full(), np.arange(6))
+    store.close()
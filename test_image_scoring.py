@@ -0,0 +1,63 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from image_scoring import FrameScorer, bin_image, calc_count_per_image, read_image
+
+# frames of the sample run shipped with the repository (a bright spot in the middle of the detector)
+IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'images', '*.png')))[1:6]
+
+
+def test_default_scorer_matches_calc_count_per_image():
+    scorer = FrameScorer()
+    for image_path in IMAGES:
+        assert scorer(image_path) == calc_count_per_image(image_path)
+
+
+def test_roi_is_cropped_with_the_blur_halo(tmp_path):
+    # cropping before the blur gives exactly the blurred full frame inside the roi, also for memory mapped .npy frames
+    roi = (300, 900, 350, 850)
+    scorer = FrameScorer(roi=roi)
+    for index, image_path in enumerate(IMAGES):
+        expected = cv2.medianBlur(read_image(image_path), 5)[300:900, 350:850].mean()
+        assert scorer(image_path) == expected
+
+        npy_path = str(tmp_path / f'frame_{index}.npy')
+        np.save(npy_path, read_image(image_path))
+        assert scorer(npy_path) == expected
+
+        # the frame stays on disk, the crop is a view of the memory map (only the rows of the roi are read)
+        frame = scorer.load(npy_path)
+        crop, _ = scorer.crop(frame)
+        assert isinstance(frame, np.memmap) and isinstance(crop, np.memmap)
+        assert crop.shape == (604, 504) and np.shares_memory(crop, frame)
+
+
+def test_auto_roi_finds_the_signal(tmp_path):
+    image = read_image(IMAGES[0])
+    scorer = FrameScorer(roi='auto')
+    scorer(IMAGES[0])
+    top, bottom, left, right = scorer.roi
+    rows, columns = np.nonzero(image > image.max() / 2)
+    assert top <= rows.min() and rows.max() < bottom
+    assert left <= columns.min() and columns.max() < right
+    assert (bottom - top) * (right - left) < image.size / 2
+
+    np.save(tmp_path / 'frame.npy', image)
+    assert scorer(str(tmp_path / 'frame.npy')) == scorer(IMAGES[0])
+
+
+def test_binning_and_background():
+    image = read_image(IMAGES[2])
+    assert np.allclose(bin_image(image, 3), image.reshape(400, 3, 400, 3).mean(axis=(1, 3)), rtol=1e-6)
+
+    background = np.full(image.shape, 100, dtype=np.uint16)
+    with_background = FrameScorer(background=background, reduction='sum', blur=False)
+    assert with_background(IMAGES[2]) == pytest.approx(image.sum(dtype=np.float64) - 100 * image.size)
+
+    threshold = FrameScorer(reduction='threshold', threshold=1000, blur=False)
+    assert threshold(IMAGES[2]) == pytest.approx(np.clip(image.astype(float) - 1000, 0, None).sum())
@@ -0,0 +1,56 @@
+import os
+import time
+
+from watchdog.events import DirCreatedEvent, FileCreatedEvent, FileMovedEvent
+
+from image_watcher import ImageHandler, ImageTracker, watch_directory
+
+
+def handled(handler, events):
+    images = []
+    handler.process_images_callback = images.extend
+    for event in events:
+        handler.dispatch(event)
+    return images
+
+
+def test_only_complete_images_with_the_image_extensions_are_handed_on():
+    events = [
+        FileCreatedEvent('images/shot_0001.tiff'),
+        FileCreatedEvent('images/shot_0002.TIFF'),
+        FileCreatedEvent('images/notes.txt'),
+        FileCreatedEvent('images/shot_0003.tiff.part'),
+        FileMovedEvent('images/shot_0003.tiff.part', 'images/shot_0003.tiff'),
+        FileCreatedEvent('images/frame_0004.npy'),
+        FileCreatedEvent('images/preview.png'),
+        DirCreatedEvent('images/backup.tiff'),
+        ]
+    assert handled(ImageHandler(None), events) == ['images/shot_0001.tiff', 'images/shot_0002.TIFF', 'images/shot_0003.tiff', 'images/frame_0004.npy']
+    assert handled(ImageHandler(None, extensions=['.png']), events) == ['images/preview.png']
+    assert len(handled(ImageHandler(None, extensions=None), events)) == 6
+
+
+def test_images_already_in_the_directory_are_not_processed(tmp_path):
+    (tmp_path / 'old.tiff').write_bytes(b'')
+    tracker = ImageTracker(str(tmp_path))
+    (tmp_path / 'new.tiff').write_bytes(b'')
+
+    paths = [str(tmp_path / 'old.tiff'), str(tmp_path / 'new.tiff'), str(tmp_path / 'new.tiff'), str(tmp_path / 'gone.tiff')]
+    assert tracker.new_images(paths) == [str(tmp_path / 'new.tiff')]
+
+
+def test_the_observer_hands_on_new_images(tmp_path):
+    images = []
+    observer = watch_directory(str(tmp_path), images.extend)
+    try:
+        (tmp_path / 'notes.txt').write_text('')
+        (tmp_path / 'shot_0001.tiff.part').write_bytes(b'')
+        os.rename(tmp_path / 'shot_0001.tiff.part', tmp_path / 'shot_0001.tiff')
+        deadline = time.monotonic() + 5
+        while not images and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        observer.stop()
+        observer.join()
+    assert images == [str(tmp_path / 'shot_0001.tiff')]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from measurement_cache import MEASURE, REUSE, TOP_UP, MeasurementCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_full_entries_are_reused_and_partial_ones_topped_up():
+    cache = MeasurementCache(target_samples=4, clock=Clock())
+    assert cache.policy([10, 20.4]) == (MEASURE, 4)
+
+    cache.add([10, 20.4], [100, 110])
+    assert cache.policy([10.2, 20]) == (TOP_UP, 2)
+
+    entry = cache.add([10, 20], [120, 130])
+    assert entry.samples == 4
+    assert entry.mean == pytest.approx(115)
+    assert entry.variance == pytest.approx(np.var([100, 110, 120, 130], ddof=1))
+
+    action, cached = cache.policy([10, 20])
+    assert action == REUSE and cached is entry
+    assert cache.stats() == {"entries": 1, "hits": 1, "top_ups": 1, "misses": 1, "shots_saved": 6}
+
+
+def test_entries_go_stale_after_their_last_measurement():
+    clock = Clock()
+    cache = MeasurementCache(target_samples=2, staleness=300, clock=clock)
+    cache.add([0], [100])
+
+    # topped up just before going stale, the entry counts from the top up
+    clock.now = 250
+    cache.add([0], [102])
+    clock.now = 500
+    assert cache.policy([0])[0] == REUSE
+
+    clock.now = 551
+    assert cache.policy([0]) == (MEASURE, 2)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MeasurementCache(target_samples=1, max_entries=2, clock=Clock())
+    cache.add([1], [10])
+    cache.add([2], [20])
+    cache.policy([1])
+    cache.add([3], [30])
+
+    assert cache.policy([2]) == (MEASURE, 1)
+    assert cache.policy([1])[0] == REUSE and cache.policy([3])[0] == REUSE
+    assert len(cache) == 2
+
+
+def test_a_setpoint_measured_again_follows_a_drift():
+    rng = np.random.default_rng(0)
+    replaced = MeasurementCache(target_samples=2, clock=Clock())
+    merged = MeasurementCache(target_samples=2, clock=Clock())
+
+    # a converged setpoint is measured again every group, the count steps up by 3000 at group 300
+    for group in range(400):
+        counts = 1000 + 3000 * (group >= 300) + rng.normal(0, 50, size=2)
+        replaced_mean = replaced.add([5, -7], counts, replace=True).mean
+        merged_mean = merged.add([5, -7], counts).mean
+
+    assert replaced.policy([5, -7])[1].samples == 2
+    assert replaced_mean == pytest.approx(4000, abs=200)
+    assert merged_mean < 2000
@@ -0,0 +1,65 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from image_scoring import FrameScorer, calc_count_per_image, read_image
+from median_blur import TiledMedianBlur
+
+# every frame of the sample run shipped with the repository
+IMAGES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'images', '*.png')))
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return [read_image(image_path) for image_path in IMAGES]
+
+
+@pytest.mark.parametrize('tile_rows, tile_columns', [(256, None), (97, None), (300, 128)])
+def test_tiles_are_bit_identical_to_the_whole_frame_blur(frames, tile_rows, tile_columns):
+    blur = TiledMedianBlur(tile_rows, tile_columns, workers=4)
+    for frame in frames[::7]:
+        assert np.array_equal(blur(frame), cv2.medianBlur(frame, 5))
+    blur.close()
+
+
+# tiles thinner than the halo still see the rows and columns they need
+@pytest.mark.parametrize('tile_rows, tile_columns', [(1, None), (3, 5), (2, 1)])
+def test_tiles_smaller_than_the_kernel(frames, tile_rows, tile_columns):
+    frame = frames[0][500:620, 480:600]
+    blur = TiledMedianBlur(tile_rows, tile_columns, workers=2)
+    assert np.array_equal(blur(frame), cv2.medianBlur(np.ascontiguousarray(frame), 5))
+    blur.close()
+
+
+def test_batch_of_the_whole_corpus_is_bit_identical_and_reuses_its_buffers(frames):
+    blur = TiledMedianBlur(tile_rows=200, workers=4)
+    outputs = blur.blur_batch(frames)
+    for frame, output in zip(frames, outputs):
+        assert np.array_equal(output, cv2.medianBlur(frame, 5))
+
+    again = blur.blur_batch(frames[:3])
+    assert all(first is second for first, second in zip(outputs, again))
+    blur.close()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+def test_other_depths_and_odd_shapes(dtype):
+    frame = np.random.default_rng(0).integers(0, 250, (131, 77)).astype(dtype)
+    blur = TiledMedianBlur(tile_rows=10, tile_columns=9, workers=2)
+    assert np.array_equal(blur(frame), cv2.medianBlur(frame, 5))
+    blur.close()
+
+
+def test_tiled_scorer_gives_the_same_counts():
+    tiled = FrameScorer(blur_tile_rows=128, blur_workers=4)
+    tiled_roi = FrameScorer(roi=(300, 900, 350, 850), binning=2, blur_tile_rows=64, blur_workers=4)
+    plain_roi = FrameScorer(roi=(300, 900, 350, 850), binning=2)
+
+    assert tiled.score_batch(IMAGES[:8]) == [calc_count_per_image(image_path) for image_path in IMAGES[:8]]
+    for image_path in IMAGES[:8]:
+        assert tiled(image_path) == calc_count_per_image(image_path)
+        assert tiled_roi(image_path) == plain_roi(image_path)
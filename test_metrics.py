@@ -0,0 +1,39 @@
+import json
+import urllib.request
+
+from metrics import Metrics, MetricsServer
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    with metrics.span('blur'):
+        pass
+    metrics.observe('score', 0.1)
+    metrics.increment('images')
+    assert metrics.snapshot()["histograms"] == {} and metrics.snapshot()["counters"] == {}
+
+
+def test_spans_are_served_over_http():
+    metrics = Metrics()
+    for seconds in (0.001, 0.002, 0.003, 0.5):
+        metrics.observe('score', seconds)
+    with metrics.span('blur'):
+        pass
+    metrics.increment('images', 4)
+    metrics.gauge('queue_depth', lambda: 3)
+
+    summary = metrics.snapshot()["histograms"]["score"]
+    assert summary["count"] == 4 and summary["max"] == 0.5
+    assert 0.002 <= summary["p50"] <= 0.004
+
+    server = MetricsServer(metrics, port=0)
+    try:
+        url = f'http://127.0.0.1:{server.address[1]}'
+        text = urllib.request.urlopen(url + '/metrics').read().decode()
+        assert 'betatron_score_seconds_count 4' in text
+        assert 'betatron_images_total 4' in text
+        assert 'betatron_queue_depth 3' in text
+        snapshot = json.loads(urllib.request.urlopen(url + '/metrics.json').read())
+        assert snapshot["histograms"]["blur"]["count"] == 1
+    finally:
+        server.close()
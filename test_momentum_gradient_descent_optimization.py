@@ -1,223 +1,156 @@
-import os
 import numpy as np
-import random
-from pyqtgraph.Qt import QtCore, QtWidgets
-import sys 
-import pyqtgraph as pg
+import pytest
 
-# the txt files the code adjusts
-MIRROR_FILE_PATH = r'dm_parameters.txt'
-DISPERSION_FILE_PATH = r'dazzler_parameters.txt'
+from parameter_optimizer import ParameterOptimizer, optimizer_from_settings
+from simulation import AnalyticModel, GaussianPeakModel, NoisyModel, RecordedResponseModel, Simulator, readme_count_function
 
-# open and read the txt files and read the initial values
-with open(MIRROR_FILE_PATH, 'r') as file:
-    content = file.read()
-mirror_values = list(map(int, content.split()))
+# the bounds and starting point of the optimization test in the README
+README_INITIAL_VALUES = [-230, -230]
+README_BOUND = 999999
 
-with open(DISPERSION_FILE_PATH, 'r') as file:
-    content = file.readlines()
 
-dispersion_values = {
-    0: int(content[0].split('=')[1].strip()),  # 0 is the key for 'order2'
-    1: int(content[1].split('=')[1].strip())   # 1 is the key for 'order3'
-}
+def readme_optimizer(momentum, gradient_estimator='difference', learning_rate=0.04, seed=0):
+    return ParameterOptimizer(
+        ['focus', 'second_dispersion'],
+        README_INITIAL_VALUES,
+        -README_BOUND,
+        README_BOUND,
+        learning_rates=learning_rate,
+        momentum=momentum,
+        count_change_tolerance=0,
+        gradient_estimator=gradient_estimator,
+        rng=np.random.default_rng(seed),
+    )
 
-class BetatronApplication(QtWidgets.QApplication):
-    def __init__(self, *args, **kwargs):
-        super(BetatronApplication, self).__init__(*args, **kwargs)
 
-        self.new_focus = 0  
-        self.new_second_dispersion = 0  
-        
-        self.der_images_processed = 0
-        self.images_processed = 0
-        self.count_history = []
+def gaussian_optimizer(gradient_estimator='spsa', seed=0, learning_rates=(1e-2, 5, 50), momentum=0.5, **kwargs):
+    return ParameterOptimizer(
+        ['focus', 'second_dispersion', 'third_dispersion'],
+        [-150, 36100, -27000],
+        [-170, 35600, -29000],
+        [-130, 36600, -25000],
+        learning_rates=learning_rates,
+        momentum=momentum,
+        gradient_estimator=gradient_estimator,
+        perturbation=[2, 50, 200],
+        rng=np.random.default_rng(seed),
+        **kwargs,
+    )
 
-        # set learning rates for the different optimization variables
-        self.focus_learning_rate = 0.04
-        self.second_dispersion_learning_rate = 0.04
-        self.momentum = 0.999
 
-    # ------------ Plotting ------------ #
+GAUSSIAN_PEAK = GaussianPeakModel(peak=[-140, 36300, -27500], widths=[14, 350, 1400])
 
-        # initialize lists to keep track of optimization process
-        self.second_dispersion_der_history = []
-        self.focus_der_history = []
-        self.total_gradient_history = []
 
-        self.iteration_data = []
-        self.der_iteration_data = []
-        
-        self.count_plot_widget = pg.PlotWidget()
-        self.count_plot_widget.setWindowTitle('Count optimization')
-        self.count_plot_widget.setLabel('left', 'Count')
-        self.count_plot_widget.setLabel('bottom', 'Image group iteration')
-        self.count_plot_widget.show()
+# the README claim: vanilla gradient descent gets stuck in the local minimum while momentum passes it
+def test_momentum_passes_the_local_minimum_of_the_readme_function():
+    model = AnalyticModel(readme_count_function, sign=-1)
 
-        self.main_plot_window = pg.GraphicsLayoutWidget()
-        self.main_plot_window.show()
+    momentum_result = Simulator(readme_optimizer(momentum=0.999), model).run(100)
+    vanilla_result = Simulator(readme_optimizer(momentum=0), model).run(100)
 
-        layout = self.main_plot_window.addLayout(row=0, col=0)
+    assert momentum_result["best_count"] > vanilla_result["best_count"]
+    assert momentum_result["best_count"] > model(README_INITIAL_VALUES)
 
-        self.count_plot_widget = layout.addPlot(title='Count vs image group iteration')
-        self.total_gradient_plot = layout.addPlot(title='Total gradient vs image group iteration')
 
-        self.plot_curve = self.count_plot_widget.plot(pen='r')
-        self.total_gradient_curve = self.total_gradient_plot.plot(pen='y', name='total gradient')
-        
-        # y labels of plots
-        self.total_gradient_plot.setLabel('left', 'Total Gradient')
-        self.count_plot_widget.setLabel('left', 'Image Group Iteration')
+def test_spsa_climbs_to_the_peak():
+    result = Simulator(gaussian_optimizer(), GAUSSIAN_PEAK).run(200)
 
-        # x label of both plots
-        self.count_plot_widget.setLabel('bottom', 'Image Group Iteration')
-        self.total_gradient_plot.setLabel('bottom', 'Image Group Iteration')
+    assert result["best_count"] > 0.95 * GAUSSIAN_PEAK.height
+    assert np.all(np.abs(result["final_setpoint"] - GAUSSIAN_PEAK.peak) <= [3, 50, 200])
 
-        self.plot_curve.setData(self.iteration_data, self.count_history)
-        self.total_gradient_curve.setData(self.der_iteration_data, self.total_gradient_history)
 
-    # ------------ Deformable mirror ------------ #
+def test_setpoints_are_rounded_and_stay_inside_the_bounds():
+    optimizer = gaussian_optimizer(gradient_estimator='difference')
+    simulator = Simulator(optimizer, NoisyModel(GAUSSIAN_PEAK, noise=200, rng=np.random.default_rng(1)))
+    simulator.run(300)
 
-        self.initial_focus = -230
-        self.focus_history = []    
+    setpoints = simulator.history['parameters']
+    assert np.all(setpoints == np.rint(setpoints))
+    assert np.all(setpoints >= optimizer.lower_bounds)
+    assert np.all(setpoints <= optimizer.upper_bounds)
 
-        # self.FOCUS_LOWER_BOUND = max(self.initial_focus - 20, -200)
-        # self.FOCUS_UPPER_BOUND = min(self.initial_focus + 20, 200)
 
-        self.FOCUS_LOWER_BOUND = -999999
-        self.FOCUS_UPPER_BOUND = 999999
+# the rows of BetatronController.parameter_settings with the values of the sample parameter files
+SAMPLE_SETTINGS = [
+    {"name": "focus", "window": 20, "lower": -200, "upper": 200, "learning_rate": 5},
+    {"name": "second_dispersion", "window": 500, "lower": 30000, "upper": 40000, "learning_rate": 5},
+    {"name": "third_dispersion", "window": 2000, "lower": -30000, "upper": -25000, "learning_rate": 5},
+    ]
 
-        self.count_change_tolerance = 1
-        
-    # ------------ Dazzler ------------ #
 
-        self.initial_second_dispersion = -230
-        self.second_dispersion_history = []
+def test_windows_are_centered_on_the_initial_values_inside_the_global_bounds():
+    optimizer = optimizer_from_settings(SAMPLE_SETTINGS, [-150, 36100, -27000], rng=np.random.default_rng(0))
+    assert np.array_equal(optimizer.lower_bounds, [-170, 35600, -29000])
+    assert np.array_equal(optimizer.upper_bounds, [-130, 36600, -25000])
 
-        # self.SECOND_DISPERSION_LOWER_BOUND = max(self.initial_second_dispersion - 500, 30000)
-        # self.SECOND_DISPERSION_UPPER_BOUND = min(self.initial_second_dispersion + 500, 40000)
 
-        self.SECOND_DISPERSION_LOWER_BOUND = -999999
-        self.SECOND_DISPERSION_UPPER_BOUND = 999999
+def test_an_initial_value_outside_the_global_bounds_starts_from_the_nearest_bound():
+    # order2 = 500 in the sample dazzler_parameters.txt
+    optimizer = optimizer_from_settings(SAMPLE_SETTINGS, [1, 500, -25000], rng=np.random.default_rng(0))
+    assert np.array_equal(optimizer.lower_bounds, [-19, 30000, -27000])
+    assert np.array_equal(optimizer.upper_bounds, [21, 30500, -25000])
+    assert np.array_equal(optimizer.values, [1, 30000, -25000])
 
-        self.random_direction = [random.choice([-1, 1]) for _ in range(4)]
 
-    def write_values(self):
+def test_inverted_global_bounds_are_rejected():
+    settings = [dict(SAMPLE_SETTINGS[0], lower=200, upper=-200)]
+    with pytest.raises(ValueError, match="focus"):
+        optimizer_from_settings(settings, [0])
 
-        self.new_focus = round(np.clip(self.focus_history[-1], self.FOCUS_LOWER_BOUND, self.FOCUS_UPPER_BOUND))
-        self.new_second_dispersion = round(np.clip(self.second_dispersion_history[-1], self.SECOND_DISPERSION_LOWER_BOUND, self.SECOND_DISPERSION_UPPER_BOUND))
 
-        mirror_values[0] = self.new_focus
-        dispersion_values[0] = self.new_second_dispersion
+def test_recorded_response_reproduces_the_recorded_run():
+    simulator = Simulator(gaussian_optimizer(), GAUSSIAN_PEAK)
+    simulator.run(100)
 
-        with open(MIRROR_FILE_PATH, 'w') as file:
-            file.write(' '.join(map(str, mirror_values)))
+    recorded = RecordedResponseModel.from_history(simulator.history, scales=[20, 500, 2000])
 
-        with open(DISPERSION_FILE_PATH, 'w') as file:
-            file.write(f'order2 = {dispersion_values[0]}\n')
-            file.write(f'order3 = {dispersion_values[1]}\n')
+    for setpoint, count in zip(simulator.history['parameters'], simulator.history['count']):
+        assert recorded(setpoint) == count
+    assert min(simulator.history['count']) <= recorded([-145, 36200, -27200]) <= max(simulator.history['count'])
 
-        QtCore.QCoreApplication.processEvents()
 
-    def count_function(self, focus_history, new_second_dispersion):
-        x = focus_history
-        y = new_second_dispersion
+# with one learning rate for parameters of very different ranges the heavy ball crawls along the wide ones,
+# the per-parameter scaling of adam and rmsprop needs no tuning
+def test_adaptive_update_rules_need_no_tuned_learning_rates():
+    def groups_to_peak(update_rule):
+        simulator = Simulator(gaussian_optimizer(learning_rates=5, update_rule=update_rule), GAUSSIAN_PEAK)
+        for image_groups in range(1, 301):
+            if simulator.step() >= 0.95 * GAUSSIAN_PEAK.height:
+                return image_groups
+        return None
 
-        count_func = (((0.1 * (x + y)))** 2 * np.sin(0.01 * (x + y)))
+    assert groups_to_peak('momentum') is None
+    assert groups_to_peak('adam') <= 60
+    assert groups_to_peak('rmsprop') <= 100
 
-        self.count_history.append(count_func)
 
-    def calc_derivatives(self):
+def test_update_rules_keep_the_integer_step_convergence():
+    for update_rule in ('nesterov', 'rmsprop', 'adam'):
+        optimizer = gaussian_optimizer(update_rule=update_rule, learning_rate_schedule='inverse_time', learning_rate_decay=0.1)
+        simulator = Simulator(optimizer, GAUSSIAN_PEAK)
+        result = simulator.run(600, stop_when_converged=True)
 
-        x = self.focus_history[-1]
-        y = self.second_dispersion_history[-1]
+        assert result["converged"], update_rule
+        assert result["best_count"] > 0.95 * GAUSSIAN_PEAK.height
+        assert np.all(simulator.history['parameters'] == np.rint(simulator.history['parameters']))
 
-        self.count_focus_der = 0.2*(0.1*(x+y))*np.sin(0.01*(x+y))+0.01*(np.cos(0.01*(x+y)))*(0.1*(x+y))**2
-        self.count_second_dispersion_der = 0.2*(0.1*(x+y))*np.sin(0.01*(x+y))+0.01*(np.cos(0.01*(x+y)))*(0.1*(x+y))**2
 
-        self.focus_der_history.append(self.count_focus_der)
-        self.second_dispersion_der_history.append(self.count_second_dispersion_der)
+def test_nesterov_without_momentum_is_plain_gradient_ascent():
+    optimizers = [gaussian_optimizer(update_rule=update_rule, momentum=0.0) for update_rule in ('momentum', 'nesterov')]
+    for optimizer in optimizers:
+        Simulator(optimizer, GAUSSIAN_PEAK).run(40)
+    assert np.array_equal(optimizers[0].values, optimizers[1].values)
 
-        self.total_gradient = (self.focus_der_history[-1] + self.second_dispersion_der_history[-1])
 
-        self.total_gradient_history.append(self.total_gradient)
-        self.der_iteration_data.append(self.der_images_processed)
-        
-        return {
-            "focus": self.count_focus_der,
-            "second_dispersion": self.count_second_dispersion_der,
-            }
-
-    def optimize_count(self):
-        derivatives = self.calc_derivatives()
-
-        if np.abs((self.momentum*(self.focus_history[-1]-self.focus_history[-2])) - self.focus_learning_rate * derivatives["focus"]) > 1:
-            self.new_focus = self.focus_history[-1] + (self.momentum*(self.focus_history[-1]-self.focus_history[-2])) - self.focus_learning_rate*self.focus_der_history[-1]
-
-            self.new_focus = np.clip(self.new_focus, self.FOCUS_LOWER_BOUND, self.FOCUS_UPPER_BOUND)
-            self.new_focus = round(self.new_focus)
-
-            self.focus_history = np.append(self.focus_history, [self.new_focus])
-            mirror_values[0] = self.new_focus
-
-        if np.abs((self.momentum*(self.second_dispersion_history[-1]-self.second_dispersion_history[-2])) - self.second_dispersion_learning_rate*derivatives["second_dispersion"]) > 1:
-            self.new_second_dispersion = (self.second_dispersion_history[-1] + (self.momentum*(self.second_dispersion_history[-1]-self.second_dispersion_history[-2])) - self.second_dispersion_learning_rate*self.second_dispersion_der_history[-1])
-                                                       
-            self.new_second_dispersion = np.clip(self.new_second_dispersion, self.SECOND_DISPERSION_LOWER_BOUND, self.SECOND_DISPERSION_UPPER_BOUND)
-            self.new_second_dispersion = round(self.new_second_dispersion)
-
-            self.second_dispersion_history = np.append(self.second_dispersion_history, [self.new_second_dispersion])
-            dispersion_values[0] = self.new_second_dispersion
-
-    def process_images(self):
-        self.images_processed += 1
-        self.iteration_data.append(self.images_processed)
-
-        if self.images_processed == 1:
-                   
-            self.focus_history.append(self.initial_focus)                       
-            self.second_dispersion_history.append(self.initial_second_dispersion)
-
-            self.count_function(self.focus_history[-1], self.second_dispersion_history[-1])   
-            self.calc_derivatives()
-                        
-            print(f"initial focus = {self.focus_history[-1]}, initial second dispersion = {self.second_dispersion_history[-1]}")
-
-        elif self.images_processed == 2:
-            self.new_focus = self.focus_history[-1] +1
-            self.new_second_dispersion =  self.second_dispersion_history[-1] +1
-
-            self.focus_history.append(self.new_focus)
-            self.second_dispersion_history.append(self.new_second_dispersion)
-
-            self.count_function(self.focus_history[-1], self.second_dispersion_history[-1])   
-            self.calc_derivatives()
-
-            print(f"function_value {self.count_history[-1]}, current values are: focus {self.focus_history[-1]}, second_dispersion {self.second_dispersion_history[-1]}")
-
-        else:
-   
-            self.der_images_processed += 1             
-            self.count_function(self.focus_history[-1], self.second_dispersion_history[-1])   
-            self.optimize_count()
-
-            print(f"iteration {self.iteration_data[-1]},function_value {self.count_history[-1]}, current values are: focus {self.focus_history[-1]}, second_dispersion {self.second_dispersion_history[-1]}")
-
-        QtCore.QCoreApplication.processEvents()
+if __name__ == "__main__":
+    model = AnalyticModel(readme_count_function, sign=-1)
 
-        self.write_values()
+    for name, momentum in (("momentum", 0.999), ("vanilla", 0)):
+        simulator = Simulator(readme_optimizer(momentum=momentum), model)
+        result = simulator.run(100)
 
-        # update the plots
-        self.plot_curve.setData(self.der_iteration_data, self.count_history)
-        self.total_gradient_curve.setData(self.der_iteration_data, self.total_gradient_history)
+        for iteration, (count, setpoint) in enumerate(zip(simulator.history['count'], simulator.history['parameters']), start=1):
+            print(f"iteration {iteration}, function_value {-count}, current values are: focus {setpoint[0]:.0f}, second_dispersion {setpoint[1]:.0f}")
 
+        print(f"{name}: best function value {-result['best_count']:.2f} at {result['best_setpoint']}, {result['image_groups_per_second']:.0f} iterations per second")
         print('-------------')
-
-if __name__ == "__main__":
-    app = BetatronApplication([])
-
-    for _ in range(100):
-        app.process_images()
-
-    win = QtWidgets.QMainWindow()
-    sys.exit(app.exec_())
\ No newline at end of file
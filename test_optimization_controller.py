@@ -0,0 +1,35 @@
+import numpy as np
+
+from optimization_controller import BetatronController
+
+
+def test_a_tracking_run_never_reuses_a_cached_measurement(tmp_path):
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'dm_parameters.txt').write_text('-150')
+    (tmp_path / 'dazzler_parameters.txt').write_text('order2 = 36100\norder3 = -27000\n')
+    controller = BetatronController(
+        IMG_PATH=str(tmp_path / 'images'),
+        mirror_file_path=str(tmp_path / 'dm_parameters.txt'),
+        dispersion_file_path=str(tmp_path / 'dazzler_parameters.txt'),
+        history_spill_directory=str(tmp_path / 'history'),
+        use_journal=False,
+        adaptive_image_group=False,
+        optimizer_mode='tracking',
+        seed=0,
+        # a dither of one step keeps coming back to the same few setpoints
+        parameter_settings=[{"name": "focus", "device": "mirror", "key": 0, "window": 20, "learning_rate": 5, "perturbation": 1}],
+        )
+    rng = np.random.default_rng(1)
+    try:
+        for image in range(400):
+            focus = controller.optimizer.setpoint[0]
+            # the peak drifts while the dither revisits its setpoints
+            controller.process_image_count(f'image_{image}.tiff', 5000 - 20 * (focus + 150 - image / 100) ** 2 + rng.normal(0, 5))
+    finally:
+        controller.shutdown()
+
+    parameters = controller.history['parameters'][:, 0]
+    assert len(np.unique(parameters)) < len(parameters) / 10
+    # every image group was measured, none was taken from the cache
+    assert controller.image_groups_processed == controller.group_sizer.groups > 150
+    assert controller.measurement_cache.stats()["hits"] == 0
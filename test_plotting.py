@@ -0,0 +1,45 @@
+import numpy as np
+
+from plotting import decimate_min_max
+
+
+def test_short_series_pass_through_unchanged():
+    x = np.arange(10.0)
+    y = np.sin(x)
+    decimated_x, decimated_y = decimate_min_max(x, y, 10)
+    assert np.array_equal(decimated_x, x) and np.array_equal(decimated_y, y)
+    assert not np.shares_memory(decimated_y, y)
+
+    # series of different lengths (appended one after the other) are cut to the shorter one
+    decimated_x, decimated_y = decimate_min_max(x, y[:7], 10)
+    assert np.array_equal(decimated_x, x[:7]) and np.array_equal(decimated_y, y[:7])
+
+
+def test_output_length_is_bounded_by_max_points():
+    rng = np.random.default_rng(0)
+    for length in (11, 100, 1001, 4097):
+        x = np.arange(length)
+        y = rng.normal(size=length)
+        for max_points in (2, 3, 10, 99, 500):
+            decimated_x, decimated_y = decimate_min_max(x, y, max_points)
+            assert len(decimated_x) == len(decimated_y) <= max_points
+            # the points are a subset of the series in their original order
+            assert np.all(np.diff(decimated_x) >= 0)
+            assert np.array_equal(decimated_y, y[decimated_x])
+
+
+def test_every_bin_keeps_its_minimum_and_maximum():
+    rng = np.random.default_rng(1)
+    length, max_points = 1003, 40
+    x = np.arange(length)
+    y = rng.normal(size=length)
+    y[517] = 50.0
+    y[90] = -50.0
+    decimated_x, decimated_y = decimate_min_max(x, y, max_points)
+
+    bin_size = -(-length // (max_points // 2))
+    for start in range(0, length, bin_size):
+        kept = decimated_y[(decimated_x >= start) & (decimated_x < start + bin_size)]
+        assert kept.min() == y[start:start + bin_size].min()
+        assert kept.max() == y[start:start + bin_size].max()
+    assert decimated_y.max() == 50.0 and decimated_y.min() == -50.0
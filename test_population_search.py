@@ -0,0 +1,35 @@
+import numpy as np
+
+from benchmark_suite import two_peak_landscape
+from population_search import find_basins, run_evolution_strategy, run_multi_start, start_points
+
+
+def test_start_points_cover_the_bounds_and_start_at_the_initial_values():
+    settings, _, _ = two_peak_landscape()
+    points = start_points(settings, 8, np.random.default_rng(0))
+
+    assert points[0].tolist() == settings["initial_values"]
+    assert np.all(points >= settings["lower_bounds"]) and np.all(points <= settings["upper_bounds"])
+    assert np.array_equal(points, np.round(points))
+    # about one start per eighth of every parameter's range (rounding may push a start over a stratum edge)
+    strata = ((points[1:] - settings["lower_bounds"]) / (np.array(settings["upper_bounds"]) - settings["lower_bounds"]) * 8).astype(int)
+    assert all(len(set(column)) >= 6 for column in strata.T)
+
+
+def test_multi_start_reports_the_best_basin_first():
+    settings, model, best_count = two_peak_landscape()
+    results = run_multi_start(settings, model, starts=8, image_groups=300, workers=2, seed=0, gradient_estimator='spsa', momentum=0.5)
+    basins = find_basins(results, settings["lower_bounds"], settings["upper_bounds"])
+
+    assert len(results) == 8 and results[0]["start"].tolist() == settings["initial_values"]
+    assert basins[0]["best_count"] > 0.99 * best_count
+    assert np.allclose(basins[0]["best_setpoint"], [-138, 36400, -27800], atol=[3, 50, 200])
+    assert sum(basin["runs"] for basin in basins) == 8
+
+
+def test_evolution_strategy_finds_the_higher_peak():
+    settings, model, best_count = two_peak_landscape()
+    result = run_evolution_strategy(settings, model, generations=30, workers=2, seed=0)
+
+    assert result["best_count"] > 0.99 * best_count
+    assert result["evaluations"] == 30 * 7
@@ -0,0 +1,60 @@
+import numpy as np
+
+from parameter_optimizer import ParameterOptimizer
+from run_journal import RunJournal, gradients, measurements, read_journal
+
+HEADER = {
+    "parameter_names": ["focus", "second_dispersion"],
+    "parameter_settings": [
+        {"name": "focus", "device": "mirror", "key": 0, "window": 20, "learning_rate": 5},
+        {"name": "second_dispersion", "device": "dazzler", "key": 0, "window": 500, "learning_rate": 5},
+        ],
+    "initial_values": [-150, 36100],
+    "optimizer_mode": "momentum",
+    "optimizer_settings": {"gradient_estimator": "difference", "momentum": 0.9, "count_change_tolerance": 10, "bayesian_batch_size": 1},
+    "seed": 3,
+    }
+
+
+def test_records_survive_a_torn_write(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    journal = RunJournal.create(path, HEADER)
+    journal.append_measurement(1, 5000.0, [-150, 36100], shots=2, standard_error=12.5)
+    journal.append_gradient(1, [10.0, -2.0])
+    journal.sync()
+    # a crash in the middle of the next record
+    journal.file.write(b'\x01\x00\x02')
+    journal.file.close()
+
+    header, records = read_journal(path)
+    assert header["seed"] == 3
+    assert len(measurements(records)) == 1 and len(gradients(records)) == 1
+    assert measurements(records)['values'][0].tolist() == [-150, 36100]
+    assert gradients(records)['value'][0] == 8.0
+
+    # appending cuts the torn record off first
+    journal = RunJournal.append_to(path)
+    journal.append_measurement(2, 5100.0, [-149, 36101], shots=2)
+    journal.close()
+    _, records = read_journal(path)
+    assert measurements(records)['value'].tolist() == [5000.0, 5100.0]
+
+
+def test_counts_of_a_journal_bring_the_optimizer_back_to_the_same_state(tmp_path):
+    def make_optimizer():
+        return ParameterOptimizer(HEADER["parameter_names"], HEADER["initial_values"], [-170, 35600], [-130, 36600], [5, 5], momentum=0.9, rng=np.random.default_rng(HEADER["seed"]))
+
+    path = str(tmp_path / 'run.journal')
+    journal = RunJournal.create(path, HEADER)
+    optimizer = make_optimizer()
+    for count in (5000.0, 5200.0, 5300.0, 5250.0, 5400.0):
+        journal.append_measurement(0, count, optimizer.setpoint)
+        optimizer.tell(count)
+    journal.close()
+
+    resumed = make_optimizer()
+    for record in measurements(read_journal(path)[1]):
+        assert np.array_equal(resumed.setpoint, record['values'])
+        resumed.tell(record['value'])
+    assert np.array_equal(resumed.setpoint, optimizer.setpoint)
+    assert np.array_equal(resumed.previous_values, optimizer.previous_values)
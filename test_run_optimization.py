@@ -0,0 +1,26 @@
+import json
+
+from run_optimization import controller_settings, parse_arguments
+
+
+def test_arguments_map_to_controller_settings(tmp_path):
+    initial_values = tmp_path / 'best.json'
+    initial_values.write_text(json.dumps({"focus": -150}))
+
+    arguments = parse_arguments(['--headless', '--images', 'shots', '--image-group', '4', '--optimizer', 'scan', '--scan-points', '7',
+                                 '--no-journal', '--upload', '--initial-values', str(initial_values), '--roi', '388', '812', '388', '812', '--binning', '2'])
+    assert controller_settings(arguments) == {
+        'IMG_PATH': 'shots',
+        'image_group': 4,
+        'optimizer_mode': 'scan',
+        'scan_points': 7,
+        'upload_to_devices': True,
+        'initial_setpoint': {"focus": -150},
+        'use_journal': False,
+        'scoring_settings': {'roi': (388, 812, 388, 812), 'binning': 2},
+        }
+
+
+def test_unset_arguments_keep_the_controller_defaults():
+    assert controller_settings(parse_arguments(['--headless'])) == {}
+    assert controller_settings(parse_arguments(['--roi', 'auto'])) == {'scoring_settings': {'roi': 'auto'}}
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from benchmark_suite import LANDSCAPES
+from parameter_optimizer import ParameterOptimizer
+from run_journal import RunJournal, replay
+from sensitivity_scan import SensitivityScan, fit_quadratic, learning_rates_from_hessian, order_by_travel, scan_design, scan_from_settings, travel
+from simulation import Simulator
+
+LOWER = np.array([-170, 35600, -29000])
+UPPER = np.array([-130, 36600, -25000])
+CENTER = np.array([-150, 36100, -27000])
+SCALE = (UPPER - LOWER) / 2
+
+
+@pytest.mark.parametrize('design, setpoints', [('sweeps', 13), ('grid', 125), ('latin_hypercube', 16)])
+def test_designs_stay_in_the_windows_and_start_at_the_center(design, setpoints):
+    points = scan_design(design, CENTER, LOWER, UPPER, points=5, rng=np.random.default_rng(0))
+    assert len(points) == setpoints
+    assert np.array_equal(points[0], CENTER)
+    assert np.all(points >= LOWER) and np.all(points <= UPPER)
+    assert np.array_equal(points, np.round(points))
+    assert len({tuple(point) for point in points}) == len(points)
+
+
+def test_ordering_shortens_the_actuator_travel():
+    points = scan_design('latin_hypercube', CENTER, LOWER, UPPER, points=10, rng=np.random.default_rng(1))
+    order = order_by_travel(points, CENTER, SCALE)
+    assert sorted(order.tolist()) == list(range(len(points)))
+    assert travel(points[order], CENTER, SCALE) < 0.5 * travel(points, CENTER, SCALE)
+
+
+def test_fit_recovers_the_hessian_of_a_quadratic():
+    hessian = np.array([[-8.0, 0.02, 0.0], [0.02, -0.01, 0.0005], [0.0, 0.0005, -0.001]])
+    gradient = np.array([30.0, 2.0, -0.5])
+
+    def response(setpoint):
+        distance = setpoint - CENTER
+        return 5000 + gradient @ distance + distance @ hessian @ distance / 2
+
+    points = scan_design('grid', CENTER, LOWER, UPPER, points=4)
+    fit = fit_quadratic(points, [response(point) for point in points], CENTER, SCALE)
+    assert np.allclose(fit.hessian, hessian, rtol=1e-6, atol=1e-9)
+    assert np.allclose(fit.gradient, gradient) and fit.r_squared == pytest.approx(1)
+
+    # sweeps only give the curvature of every parameter on its own
+    points = scan_design('sweeps', CENTER, LOWER, UPPER, points=5)
+    fit = fit_quadratic(points, [response(point) for point in points], CENTER, SCALE)
+    assert np.allclose(np.diag(fit.hessian), np.diag(hessian))
+    assert np.count_nonzero(fit.hessian - np.diag(np.diag(fit.hessian))) == 0
+
+    # a parameter without a downward curvature keeps its learning rate
+    assert np.allclose(learning_rates_from_hessian(np.diag([-2.0, 0.5, -0.01]), [7, 7, 7], 0.5), [0.25, 7, 50])
+
+
+@pytest.mark.parametrize('learning_rate', [1, 50])
+def test_scan_then_momentum_reaches_the_peak_without_tuned_learning_rates(learning_rate):
+    settings, model, best_count = LANDSCAPES['gaussian']()
+    rng = np.random.default_rng(0)
+
+    def make_optimizer(learning_rates, start):
+        return ParameterOptimizer(**dict(settings, initial_values=start, learning_rates=learning_rates), gradient_estimator='spsa', momentum=0.5, rng=rng)
+
+    scan = SensitivityScan(settings["names"], settings["initial_values"], settings["lower_bounds"], settings["upper_bounds"], repeats=2,
+                           learning_rates=learning_rate, make_optimizer=make_optimizer, rng=rng)
+    simulator = Simulator(scan, model)
+    simulator.run(2 * len(scan.design))
+    assert scan.optimizer is not None and not scan.updated
+    assert len(scan.measured_counts) == 2 * len(scan.design)
+    assert np.all(np.diag(scan.fit.hessian) < 0)
+
+    result = simulator.run(150)
+    assert result["best_count"] > 0.95 * best_count
+    assert result["steps"] > 0
+
+
+def test_journal_of_a_scan_replays_deterministically(tmp_path):
+    parameter_settings = [
+        {"name": "focus", "device": "mirror", "key": 0, "window": 20, "learning_rate": 1},
+        {"name": "second_dispersion", "device": "dazzler", "key": 0, "window": 500, "learning_rate": 1},
+        ]
+    initial_values = [-150, 36100]
+    optimizer_settings = {"gradient_estimator": "spsa", "momentum": 0.5, "count_change_tolerance": 10, "bayesian_batch_size": 1, "scan_design": "grid", "scan_points": 3}
+    header = {"parameter_names": ["focus", "second_dispersion"], "parameter_settings": parameter_settings, "initial_values": initial_values,
+              "optimizer_mode": "scan", "optimizer_settings": optimizer_settings, "seed": 4}
+
+    def response(setpoint):
+        return 5000 - 2 * (setpoint[0] + 145) ** 2 - 0.01 * (setpoint[1] - 36200) ** 2
+
+    path = str(tmp_path / 'scan.journal')
+    journal = RunJournal.create(path, header)
+    scan = scan_from_settings(parameter_settings, initial_values, design="grid", points=3, rng=np.random.default_rng(4), gradient_estimator="spsa", momentum=0.5, count_change_tolerance=10)
+    for group in range(30):
+        count = response(scan.setpoint)
+        journal.append_measurement(group + 1, count, scan.setpoint)
+        scan.tell(count)
+    journal.close()
+
+    first, second = replay(path), replay(path)
+    assert first["best_count"] == second["best_count"] == pytest.approx(5000, abs=60)
+    assert np.array_equal(first["best_setpoint"], second["best_setpoint"])
@@ -0,0 +1,41 @@
+import numpy as np
+
+from history_store import HistoryStore
+from session_link import SessionPublisher, SessionSubscriber, apply_message
+
+
+def test_a_viewer_rebuilds_the_history_of_a_session():
+    history = HistoryStore()
+    history.add_series('count')
+    history.add_series('parameters', width=2)
+    for index in range(3):
+        history.append('count', 1000 + index)
+        history.append('parameters', [index, -index])
+
+    publisher = SessionPublisher(history, ['focus', 'second_dispersion'], port=0)
+    subscriber = SessionSubscriber(*publisher.address)
+    messages = iter(subscriber)
+    viewer_history = HistoryStore()
+    try:
+        hello = next(messages)
+        assert hello["type"] == "hello" and hello["parameter_names"] == ['focus', 'second_dispersion']
+        assert hello["widths"] == {'count': None, 'parameters': 2}
+        apply_message(viewer_history, hello)
+
+        # only the points appended after the hello are sent, and nothing at all when there is nothing new
+        for index in range(3, 7):
+            history.append('count', 1000 + index)
+            history.append('parameters', [index, -index])
+            publisher.publish()
+            publisher.publish()
+            message = next(messages)
+            assert message["type"] == "points" and len(message["series"]["count"]) == 1
+            apply_message(viewer_history, message)
+        assert publisher.viewers == 1
+    finally:
+        subscriber.close()
+        publisher.close()
+
+    assert np.array_equal(viewer_history['count'], history['count'])
+    assert np.array_equal(viewer_history['parameters'], history['parameters'])
+    assert viewer_history['parameters'].shape == (7, 2)